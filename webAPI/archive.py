@@ -0,0 +1,178 @@
+"""
+Lưu trữ phiếu cân của các kỳ đã đóng sang bảng <bảng>_archive để bảng chính luôn nhỏ.
+
+Chạy thủ công hoặc theo lịch (Task Scheduler/cron):
+    python archive.py                       # Chuyển phiếu cũ hơn ARCHIVE_KEEP_DAYS ngày (tính theo tháng)
+    python archive.py --keep-days 180 --table nhapkho
+"""
+import argparse
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from database import engine as default_engine, ArchiveState, ARCHIVE_MODELS, TICKET_MODELS
+
+
+def closed_period_cutoff(keep_days: int, today: Optional[date] = None) -> date:
+    """Ngày đầu tháng của (hôm nay - keep_days): các tháng trước đó được coi là kỳ đã đóng"""
+    day = (today or date.today()) - timedelta(days=keep_days)
+    return day.replace(day=1)
+
+
+class ArchiveManager:
+    """
+    Quản lý mốc lưu trữ và chuyển phiếu sang bảng lưu trữ.
+
+    Mốc archived_before của mỗi bảng: mọi phiếu có ngaycan < mốc nằm ở bảng lưu trữ.
+    Bộ truy vấn chỉ đọc thêm bảng lưu trữ khi tu_ngay (hoặc không có tu_ngay) trước mốc.
+    Mỗi tiến trình API đọc lại mốc sau mỗi state_refresh giây, nên sau khi đặt mốc mới phải chờ state_refresh
+    giây mới chuyển phiếu (lưu trữ chạy từ CLI hoặc API node khác vẫn không làm mất phiếu khỏi kết quả).
+    """
+
+    def __init__(self, engine: Engine, keep_days: int = 90, batch_size: int = 5000, state_refresh: float = 60):
+        self.engine = engine
+        self.keep_days = keep_days
+        self.batch_size = batch_size
+        self.state_refresh = state_refresh
+        self._watermarks: Dict[str, date] = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[str], None]] = []
+
+    def add_listener(self, callback: Callable[[str], None]):
+        """Đăng ký callback(bảng) được gọi sau mỗi lô phiếu đã chuyển sang bảng lưu trữ"""
+        self._listeners.append(callback)
+
+    def watermarks(self, db: Session) -> Dict[str, date]:
+        """Mốc lưu trữ của các bảng (đọc lại sau mỗi state_refresh giây để đồng bộ giữa các API node)"""
+        with self._lock:
+            if time.monotonic() - self._loaded_at >= self.state_refresh:
+                rows = db.execute(select(ArchiveState.table_name, ArchiveState.archived_before)).all()
+                self._watermarks = {row.table_name: row.archived_before for row in rows if row.archived_before}
+                self._loaded_at = time.monotonic()
+            return self._watermarks
+
+    def needs_archive(self, db: Session, table: str, tu_ngay: Optional[date]) -> bool:
+        """Truy vấn có cần đọc bảng lưu trữ không"""
+        watermark = self.watermarks(db).get(table)
+        if watermark is None:
+            return False
+        return tu_ngay is None or tu_ngay < watermark
+
+    def _set_watermark(self, conn, table: str, cutoff: date) -> datetime:
+        """
+        Đặt mốc lưu trữ (chỉ tăng)
+        Returns:
+            datetime: Thời điểm mốc hiện tại được đặt
+        """
+        current = conn.execute(
+            select(ArchiveState.archived_before, ArchiveState.updated_at).where(ArchiveState.table_name == table)
+        ).first()
+        now = datetime.now()
+        if current is None:
+            conn.execute(insert(ArchiveState).values(table_name=table, archived_before=cutoff, updated_at=now))
+        elif current.archived_before is None or current.archived_before < cutoff:
+            conn.execute(
+                ArchiveState.__table__.update()
+                .where(ArchiveState.table_name == table)
+                .values(archived_before=cutoff, updated_at=now)
+            )
+        else:
+            return current.updated_at or now
+        return now
+
+    def archive_table(self, table: str, cutoff: date) -> int:
+        """
+        Chuyển các phiếu có ngaycan < cutoff sang bảng lưu trữ, theo từng lô trong transaction
+        Returns:
+            int: Số phiếu đã chuyển
+        """
+        model = TICKET_MODELS[table]
+        archive = ARCHIVE_MODELS[table]
+        columns = [column.name for column in model.__table__.columns]
+
+        # Đặt mốc trước khi chuyển để truy vấn trong lúc chuyển luôn đọc cả 2 bảng
+        with self.engine.begin() as conn:
+            watermark_set_at = self._set_watermark(conn, table, cutoff)
+        self._loaded_at = 0.0
+
+        # Chờ mọi tiến trình API đọc lại mốc mới (state_refresh) trước khi phiếu rời bảng chính
+        wait = (watermark_set_at - datetime.now()).total_seconds() + self.state_refresh + 1 if self.state_refresh > 0 else 0
+        if wait > 0:
+            print(f"⏳ {table}: chờ {wait:.0f}s để các API node đọc mốc lưu trữ mới trước khi chuyển phiếu")
+            time.sleep(wait)
+
+        moved = 0
+        while True:
+            with self.engine.begin() as conn:
+                batch = conn.execute(
+                    select(model.sophieu)
+                    .where(model.ngaycan < cutoff)
+                    .order_by(model.sophieu)
+                    .limit(self.batch_size)
+                ).scalars().all()
+                if not batch:
+                    break
+                conn.execute(
+                    insert(archive.__table__).from_select(
+                        columns,
+                        select(*[model.__table__.c[name] for name in columns]).where(model.sophieu.in_(batch))
+                    )
+                )
+                conn.execute(delete(model.__table__).where(model.sophieu.in_(batch)))
+            moved += len(batch)
+            for callback in self._listeners:
+                callback(table)
+        return moved
+
+    def run(self, table: Optional[str] = None, keep_days: Optional[int] = None) -> dict:
+        """
+        Lưu trữ các kỳ đã đóng cho một bảng hoặc tất cả
+        Returns:
+            dict: {cutoff, moved: {bảng: số phiếu}}
+        """
+        cutoff = closed_period_cutoff(self.keep_days if keep_days is None else keep_days)
+        tables = [table] if table else list(TICKET_MODELS.keys())
+        # Đặt mốc của mọi bảng trước: chỉ chờ state_refresh một lần cho cả lượt lưu trữ
+        with self.engine.begin() as conn:
+            for name in tables:
+                self._set_watermark(conn, name, cutoff)
+        moved = {name: self.archive_table(name, cutoff) for name in tables}
+        return {"cutoff": cutoff.isoformat(), "moved": moved}
+
+    def status(self) -> dict:
+        """Mốc lưu trữ và số phiếu ở bảng chính/bảng lưu trữ"""
+        result = {}
+        with Session(self.engine) as db:
+            watermarks = {row.table_name: row.archived_before for row in db.execute(select(ArchiveState)).scalars()}
+            for table, model in TICKET_MODELS.items():
+                result[table] = {
+                    "archived_before": watermarks[table].isoformat() if watermarks.get(table) else None,
+                    "hot_rows": db.query(model).count(),
+                    "archive_rows": db.query(ARCHIVE_MODELS[table]).count()
+                }
+        return result
+
+
+def create_archive_manager(engine: Engine = default_engine) -> ArchiveManager:
+    """Tạo ArchiveManager với cấu hình từ environment"""
+    return ArchiveManager(
+        engine,
+        keep_days=int(os.getenv("ARCHIVE_KEEP_DAYS", "90")),
+        batch_size=int(os.getenv("ARCHIVE_BATCH_SIZE", "5000")),
+        state_refresh=float(os.getenv("ARCHIVE_STATE_REFRESH", "60"))
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chuyển phiếu cân của các kỳ đã đóng sang bảng lưu trữ")
+    parser.add_argument("--keep-days", type=int, help="Số ngày giữ ở bảng chính (mặc định ARCHIVE_KEEP_DAYS)")
+    parser.add_argument("--table", choices=list(TICKET_MODELS.keys()), help="Chỉ lưu trữ một bảng")
+    args = parser.parse_args()
+    print(create_archive_manager().run(args.table, args.keep_days))
@@ -0,0 +1,191 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs
+
+
+class InvalidToken(Exception):
+    """Token không hợp lệ, hết hạn hoặc đã bị thu hồi"""
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class TokenAuthority:
+    """
+    Cấp và kiểm tra access token không trạng thái: <payload base64url>.<HMAC-SHA256 base64url>.
+
+    Kiểm tra token chỉ tính HMAC và tra dict trong tiến trình (không truy vấn database):
+    - Các jti đã thu hồi (đăng xuất), chỉ bỏ jti khi token đã hết hạn; quá dung lượng thì
+      thu hồi theo user (not_before) thay vì quên jti chưa hết hạn
+    - Mốc not_before theo user: đổi mật khẩu làm mọi token cấp trước đó hết hiệu lực
+    Danh sách thu hồi nằm trong tiến trình; chạy nhiều tiến trình API thì thời hạn token (ttl) là giới hạn trên.
+    """
+
+    def __init__(self, secret: bytes, ttl: int = 12 * 3600, revoked_capacity: int = 10000):
+        self.secret = secret
+        self.ttl = ttl
+        self.revoked_capacity = revoked_capacity
+        # jti -> thời điểm hết hạn của token
+        self._revoked: "OrderedDict[str, float]" = OrderedDict()
+        # iduser -> thời điểm (ms) trước đó token bị coi là hết hiệu lực
+        self._not_before: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.verified = 0
+        self.rejected = 0
+
+    def _sign(self, payload: str) -> str:
+        return _b64encode(hmac.new(self.secret, payload.encode("ascii"), hashlib.sha256).digest())
+
+    def issue(self, iduser: str) -> Tuple[str, int]:
+        """
+        Cấp token cho user
+        Returns:
+            (token, số giây còn hiệu lực)
+        """
+        now_ms = int(time.time() * 1000)
+        payload = _b64encode(json.dumps({
+            "sub": iduser,
+            "iat": now_ms,
+            "exp": now_ms // 1000 + self.ttl,
+            "jti": secrets.token_urlsafe(12)
+        }, separators=(",", ":")).encode("utf-8"))
+        return f"{payload}.{self._sign(payload)}", self.ttl
+
+    def verify(self, token: str) -> dict:
+        """
+        Kiểm tra token
+        Returns:
+            dict: payload {sub, iat, exp, jti}
+        Raises:
+            InvalidToken
+        """
+        try:
+            payload, signature = token.split(".")
+            if not hmac.compare_digest(signature, self._sign(payload)):
+                raise InvalidToken("Chữ ký token không hợp lệ")
+            claims = json.loads(_b64decode(payload))
+            if not all(key in claims for key in ("sub", "iat", "exp", "jti")):
+                raise InvalidToken("Token thiếu thông tin")
+        except InvalidToken:
+            self.rejected += 1
+            raise
+        except (ValueError, UnicodeError, TypeError):
+            self.rejected += 1
+            raise InvalidToken("Token không đúng định dạng")
+
+        if claims["exp"] < time.time():
+            self.rejected += 1
+            raise InvalidToken("Token đã hết hạn")
+        if claims["jti"] in self._revoked or claims["iat"] < self._not_before.get(claims["sub"], 0):
+            self.rejected += 1
+            raise InvalidToken("Token đã bị thu hồi")
+        self.verified += 1
+        return claims
+
+    def revoke(self, claims: dict):
+        """Thu hồi một token (đăng xuất)"""
+        with self._lock:
+            now = time.time()
+            if len(self._revoked) >= self.revoked_capacity:
+                # Chỉ bỏ các jti đã hết hạn (token hết hạn thì không cần nhớ)
+                for jti in [jti for jti, expires in self._revoked.items() if expires < now]:
+                    del self._revoked[jti]
+            if len(self._revoked) < self.revoked_capacity:
+                self._revoked[claims["jti"]] = claims["exp"]
+                return
+            # Danh sách đầy toàn token còn hạn: thu hồi mọi token của user cấp đến thời điểm của token này
+            # (không quên jti chưa hết hạn, nếu không token đã đăng xuất sẽ dùng lại được)
+            self._not_before[claims["sub"]] = max(self._not_before.get(claims["sub"], 0), claims["iat"] + 1)
+
+    def revoke_user(self, iduser: str):
+        """Thu hồi mọi token đã cấp cho user (đổi mật khẩu)"""
+        with self._lock:
+            self._not_before[iduser] = max(self._not_before.get(iduser, 0), int(time.time() * 1000) + 1)
+
+    def stats(self) -> dict:
+        return {"verified": self.verified, "rejected": self.rejected, "revoked": len(self._revoked)}
+
+
+def bearer_token(authorization: Optional[str], query_string: bytes = b"") -> Optional[str]:
+    """Lấy token từ header "Authorization: Bearer ..." hoặc tham số access_token (EventSource, thẻ img)"""
+    if authorization:
+        scheme, _, value = authorization.partition(" ")
+        if scheme.lower() == "bearer" and value.strip():
+            return value.strip()
+    if query_string and b"access_token=" in query_string:
+        values = parse_qs(query_string.decode("latin-1")).get("access_token")
+        if values:
+            return values[0]
+    return None
+
+
+class TokenAuthMiddleware:
+    """
+    ASGI middleware bắt buộc access token cho các API (khi AUTH_REQUIRED=true), trừ các đường dẫn công khai.
+    Payload của token được gắn vào request.state.user.
+    """
+
+    def __init__(self, app, authority: TokenAuthority, public_prefixes: Tuple[str, ...]):
+        self.app = app
+        self.authority = authority
+        self.public_prefixes = public_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"].startswith(self.public_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        token = bearer_token(headers.get(b"authorization", b"").decode("latin-1"), scope.get("query_string", b""))
+        try:
+            if token is None:
+                raise InvalidToken("Chưa đăng nhập")
+            claims = self.authority.verify(token)
+        except InvalidToken as e:
+            body = json.dumps({"detail": str(e)}, ensure_ascii=False).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 401,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode("latin-1")),
+                    (b"www-authenticate", b"Bearer")
+                ]
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        scope.setdefault("state", {})["user"] = claims
+        await self.app(scope, receive, send)
+
+
+def create_token_authority() -> TokenAuthority:
+    """Tạo TokenAuthority với cấu hình từ environment (AUTH_SECRET, AUTH_TOKEN_TTL)"""
+    secret = os.getenv("AUTH_SECRET")
+    if not secret:
+        print("⚠️ Chưa cấu hình AUTH_SECRET: dùng khóa ngẫu nhiên, token mất hiệu lực khi khởi động lại API")
+        secret = secrets.token_hex(32)
+    return TokenAuthority(
+        secret.encode("utf-8"),
+        ttl=int(os.getenv("AUTH_TOKEN_TTL", str(12 * 3600))),
+        revoked_capacity=int(os.getenv("AUTH_REVOKED_CAPACITY", "10000"))
+    )
+
+
+def auth_public_prefixes() -> Tuple[str, ...]:
+    """Các đường dẫn không cần token (AUTH_PUBLIC_PATHS, phân cách bởi dấu phẩy)"""
+    default = "/auth/login,/webapp,/docs,/redoc,/openapi.json,/realtime/update,/admin,/metrics"
+    return tuple(path.strip() for path in os.getenv("AUTH_PUBLIC_PATHS", default).split(",") if path.strip())
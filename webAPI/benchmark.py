@@ -0,0 +1,419 @@
+"""
+Benchmark các API với dữ liệu giả lập (phiếu cân, danh mục, cây thư mục hình ảnh) trên SQLite.
+
+Mỗi kích thước dữ liệu chạy trong một tiến trình con riêng (database, PICTURE_BASE_PATH và cache riêng),
+gọi thẳng ứng dụng FastAPI thật qua TestClient (cần httpx: pip install -r requirements-dev.txt).
+
+    python benchmark.py                                   # Kích thước 1000,10000,50000 phiếu mỗi bảng
+    python benchmark.py --sizes 20000 --requests 500 --concurrency 8 --output after.json
+    python benchmark.py --only logistics_all_30d,picture_list_day
+    python benchmark.py --compare before.json after.json  # So sánh hai lần chạy (thoát mã 1 nếu chậm đi)
+
+Dùng --database-url để chạy trên SQL Server (vd. container cục bộ) thay cho SQLite;
+dữ liệu phiếu cũ trong database đó chỉ bị xóa khi có --reset.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional
+
+WEBAPI_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Mã loại hình ảnh của từng bảng phiếu
+PICTURE_CODES = {"nhapkho": "NK", "xuatkho": "XK", "canthue": "CT", "nhaptau": "NT"}
+
+PROVINCES = ["51C", "51D", "61C", "72C", "60C", "50H", "70C", "62C", "93C", "86C"]
+CUSTOMER_WORDS = ["Công ty", "Hưng Thịnh", "Phú Mỹ", "Nam Lộc", "Tân Cảng", "Đông Á", "Minh Phát", "Thành Công", "Việt Hàn", "Sài Gòn"]
+GOODS = ["Cát", "Đá 1x2", "Đá 4x6", "Xi măng", "Sắt thép", "Than đá", "Gạo", "Phân bón", "Clinker", "Dăm gỗ", "Sỏi", "Đất san lấp"]
+DRIVERS = ["Nguyễn Văn An", "Trần Văn Bình", "Lê Văn Cường", "Phạm Văn Dũng", "Hoàng Văn Em", "Võ Văn Phúc"]
+WEIGHERS = ["Ca 1", "Ca 2", "Ca 3"]
+
+
+# ==== Dữ liệu giả lập ====
+
+class Dataset:
+    """Các giá trị của dữ liệu đã sinh, dùng để tạo tham số request"""
+
+    def __init__(self, size: int, days: int, picture_days: int, seed: int):
+        rng = random.Random(seed)
+        self.size = size
+        self.today = date.today()
+        self.days = [self.today - timedelta(days=offset) for offset in range(days)]
+        self.picture_days = self.days[:picture_days]
+        self.customers = [f"{rng.choice(CUSTOMER_WORDS)} {rng.choice(CUSTOMER_WORDS)} {index}" for index in range(max(20, size // 250))]
+        self.plates = [f"{rng.choice(PROVINCES)}{rng.randint(10000, 99999)}" for _ in range(max(50, size // 20))]
+        # Phiếu có hình ảnh: (bảng, sophieu, ngày cân, số lần cân)
+        self.pictured: List[tuple] = []
+
+
+def _ticket_rows(rng: random.Random, dataset: Dataset, table: str, first: int):
+    """Sinh các phiếu của một bảng, phân bố đều theo ngày (phiếu mới có số phiếu lớn hơn)"""
+    rows = []
+    per_day = dataset.size / len(dataset.days)
+    for index in range(dataset.size):
+        ngaycan = dataset.days[len(dataset.days) - 1 - int(index / per_day)]
+        lan1 = Decimal(rng.randint(12000, 48000))
+        tru = Decimal(rng.randint(0, 300))
+        lan2 = Decimal(rng.randint(8000, 15000))
+        tinh = abs(lan1 - lan2)
+        dongia = Decimal(rng.choice([85, 120, 150, 230, 410]))
+        lancan = 2 if rng.random() < 0.95 else 1
+        plate = rng.choice(dataset.plates)
+        rows.append({
+            "sophieu": first + index,
+            "ngaycan": ngaycan,
+            "msp": PICTURE_CODES[table],
+            "bienso1_1": plate,
+            "bienso1_2": rng.choice(dataset.plates) if rng.random() < 0.3 else None,
+            "bienso2_1": None,
+            "bienso2_2": None,
+            "khachhang": rng.choice(dataset.customers),
+            "loaihang": rng.choice(GOODS),
+            "laixe": rng.choice(DRIVERS),
+            "nguoican": rng.choice(WEIGHERS),
+            "khoiluonglan1": lan1,
+            "khoiluonglan2": lan2,
+            "khoiluongtinh": tinh,
+            "khoiluongtru": tru,
+            "phantramKCL": Decimal("0.00"),
+            "khoiluongthanhtoan": tinh - tru,
+            "dongia": dongia,
+            "thanhtien": (tinh - tru) * dongia,
+            "thoigiancanlan1": f"{ngaycan.isoformat()} {rng.randint(6, 21):02d}:{rng.randint(0, 59):02d}:00",
+            "thoigiancanlan2": f"{ngaycan.isoformat()} {rng.randint(6, 21):02d}:{rng.randint(0, 59):02d}:00",
+            "ghichu": None,
+            "chungtu": None,
+            "lancan": lancan,
+            "lanin": rng.randint(0, 2),
+            "xoaphieu": 1 if rng.random() < 0.02 else 0
+        })
+    return rows
+
+
+def generate_database(engine, dataset: Dataset, seed: int, batch_size: int = 5000):
+    """Sinh phiếu cân của 4 bảng và các bảng danh mục (khachhang, loaihang, xe)"""
+    from database import Base, TICKET_MODELS, Khachhang, Loaihang, Xe
+
+    rng = random.Random(seed)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for offset, (table, model) in enumerate(TICKET_MODELS.items()):
+            rows = _ticket_rows(rng, dataset, table, first=offset * 10_000_000 + 1)
+            for start in range(0, len(rows), batch_size):
+                conn.execute(model.__table__.insert(), rows[start:start + batch_size])
+            picture_from = dataset.picture_days[-1]
+            dataset.pictured.extend((table, row["sophieu"], row["ngaycan"], row["lancan"]) for row in rows if row["ngaycan"] >= picture_from)
+
+        conn.execute(Loaihang.__table__.insert(), [
+            {"mahang": f"H{index:03d}", "tenhang": name, "tykhoi": Decimal("1.0000"), "dongia": Decimal(rng.randint(50, 500))}
+            for index, name in enumerate(GOODS)
+        ])
+        conn.execute(Khachhang.__table__.insert(), [
+            {"ID": index + 1, "makhachhang": f"KH{index:04d}", "tenkhachhang": name[:50], "diachikhachhang": "Đồng Nai", "ghichukhachhang": None, "loaihang": rng.choice(GOODS)}
+            for index, name in enumerate(dataset.customers)
+        ])
+        conn.execute(Xe.__table__.insert(), [
+            {"ID": index + 1, "masoxe_xe": f"X{index:05d}", "blenso_xe": plate, "tenkhachhang_xe": rng.choice(dataset.customers)[:45], "diachixe_xe": None, "loaihang_xe": rng.choice(GOODS)[:20], "laixe_xe": rng.choice(DRIVERS), "ghichu_xe": None}
+            for index, plate in enumerate(dataset.plates)
+        ])
+
+
+def generate_pictures(base_path: str, dataset: Dataset, picture_bytes: int, seed: int) -> int:
+    """
+    Cây thư mục hình ảnh như trạm cân thật: <loại>/<YYYY-MM-DD>/<số phiếu>-CMR<camera>_<lần cân>.jpg,
+    3 camera mỗi lần cân, cho các phiếu của picture_days ngày gần nhất
+    Returns:
+        int: Số file đã tạo
+    """
+    payload = b"\xff\xd8\xff\xe0" + random.Random(seed).randbytes(max(0, picture_bytes - 6)) + b"\xff\xd9"
+    count = 0
+    for table, sophieu, ngaycan, lancan in dataset.pictured:
+        folder = os.path.join(base_path, PICTURE_CODES[table], ngaycan.isoformat())
+        os.makedirs(folder, exist_ok=True)
+        for sequence in range(1, lancan + 1):
+            for camera in (1, 2, 3):
+                with open(os.path.join(folder, f"{sophieu}-CMR{camera}_{sequence}.jpg"), "wb") as f:
+                    f.write(payload)
+                count += 1
+    return count
+
+
+# ==== Các kịch bản đo ====
+
+def _day(rng: random.Random, days: List[date]) -> str:
+    return rng.choice(days).isoformat()
+
+
+def scenarios(dataset: Dataset) -> Dict[str, Callable[[random.Random], tuple]]:
+    """Tên kịch bản -> hàm sinh (method, url, body) với tham số thay đổi theo mỗi request (tránh chỉ đo cache)"""
+    recent = dataset.days[:30]
+
+    def picture(rng: random.Random) -> tuple:
+        table, sophieu, ngaycan, _ = rng.choice(dataset.pictured)
+        return table, sophieu, ngaycan.isoformat()
+
+    def picture_image(rng: random.Random) -> tuple:
+        table, sophieu, day = picture(rng)
+        return ("GET", f"/picture/image?ticket_number={sophieu}&camera_number={rng.randint(1, 3)}&sequence=1&date={day}&picture_type={PICTURE_CODES[table]}", None)
+
+    def picture_list_ticket(rng: random.Random) -> tuple:
+        table, sophieu, _ = picture(rng)
+        return ("GET", f"/picture/list?ticket_number={sophieu}&picture_type={PICTURE_CODES[table]}", None)
+
+    def logistics_all_30d(rng: random.Random) -> tuple:
+        start = rng.choice(dataset.days[25:35])
+        return ("GET", f"/logistics/all?tu_ngay={start.isoformat()}", None)
+
+    return {
+        "nhapkho_day": lambda rng: ("GET", f"/nhapkho?tu_ngay={(day := _day(rng, dataset.days))}&den_ngay={day}", None),
+        "nhapkho_page": lambda rng: ("GET", f"/nhapkho?limit=100&offset={rng.randint(0, 20) * 100}", None),
+        "xuatkho_bienso": lambda rng: ("GET", f"/xuatkho?bienso={rng.choice(dataset.plates)[:6]}", None),
+        "canthue_khachhang": lambda rng: ("GET", f"/canthue?khachhang={rng.choice(dataset.customers)}&tu_ngay={_day(rng, dataset.days[30:90])}", None),
+        "nhaptau_week": lambda rng: ("GET", f"/nhaptau?tu_ngay={_day(rng, dataset.days[7:60])}", None),
+        "logistics_all_30d": logistics_all_30d,
+        "logistics_all_day": lambda rng: ("GET", f"/logistics/all?tu_ngay={(day := _day(rng, recent))}&den_ngay={day}", None),
+        "sync_tickets": lambda rng: ("GET", "/sync/tickets?limit=500", None),
+        "xe_profile": lambda rng: ("GET", f"/xe/{rng.choice(dataset.plates)}/profile", None),
+        "suggest_khachhang": lambda rng: ("GET", f"/suggest/khachhang?q={rng.choice(dataset.customers)[:rng.randint(1, 4)]}", None),
+        "realtime_update": lambda rng: ("POST", "/realtime/update", {"WeightValue": str(rng.randint(0, 60000)), "StatusCam1": "1", "StatusCam2": "1", "StatusCam3": "1"}),
+        "realtime_data": lambda rng: ("GET", "/realtime/data", None),
+        "picture_list_day": lambda rng: ("GET", f"/picture/list?date={_day(rng, dataset.picture_days)}&picture_type={rng.choice(list(PICTURE_CODES.values()))}", None),
+        "picture_list_ticket": picture_list_ticket,
+        "picture_image": picture_image
+    }
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def measure(client, request_fn: Callable[[random.Random], tuple], requests: int, concurrency: int, warmup: int, seed: int) -> dict:
+    """Gửi requests request (concurrency luồng song song), trả về throughput và latency (ms)"""
+    rng = random.Random(seed)
+    planned = [request_fn(rng) for _ in range(warmup + requests)]
+
+    def call(request: tuple) -> tuple:
+        method, url, body = request
+        started = time.perf_counter()
+        response = client.request(method, url, json=body)
+        return time.perf_counter() - started, response.status_code, len(response.content)
+
+    for request in planned[:warmup]:
+        call(request)
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(call, planned[warmup:]))
+    else:
+        results = [call(request) for request in planned[warmup:]]
+    wall = time.perf_counter() - started
+
+    latencies = sorted(result[0] * 1000 for result in results)
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "throughput_rps": round(requests / wall, 2) if wall > 0 else 0.0,
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "p50_ms": round(_percentile(latencies, 0.5), 3),
+        "p90_ms": round(_percentile(latencies, 0.9), 3),
+        "p99_ms": round(_percentile(latencies, 0.99), 3),
+        "max_ms": round(latencies[-1], 3),
+        "errors": sum(1 for result in results if result[1] >= 400),
+        "mean_bytes": round(statistics.fmean(result[2] for result in results))
+    }
+
+
+def run_size(args) -> dict:
+    """Chạy trong tiến trình con: sinh dữ liệu cho một kích thước rồi đo mọi kịch bản"""
+    work_dir = os.path.join(args.work_dir, f"size-{args.run_size}")
+    picture_path = os.path.join(work_dir, "pictures")
+    if not args.database_url:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir, exist_ok=True)
+
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    os.environ["PICTURE_BASE_PATH"] = picture_path
+    # Đo hiệu năng ứng dụng, không đo giới hạn request
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    os.environ["AUTH_REQUIRED"] = "false"
+    # Hình sinh thẳng vào thư mục được reindex trước khi đo (không chạy reindex nền khi khởi động)
+    os.environ["PICTURE_REINDEX_ON_STARTUP"] = "false"
+    sys.path.insert(0, WEBAPI_DIR)
+
+    from sqlalchemy import func, select
+    from sqlalchemy.exc import SAWarning
+    import database
+
+    # SQLite lưu DECIMAL dạng số thực: bỏ cảnh báo của SQLAlchemy khi benchmark
+    warnings.filterwarnings("ignore", category=SAWarning, message=".*Decimal.*")
+
+    if args.database_url:
+        with database.engine.begin() as conn:
+            database.Base.metadata.create_all(bind=conn)
+            existing = sum(conn.execute(select(func.count()).select_from(model)).scalar() for model in database.TICKET_MODELS.values())
+            if existing and not args.reset:
+                raise SystemExit(f"Database đã có {existing} phiếu, dùng --reset để xóa dữ liệu phiếu/danh mục trước khi benchmark")
+            for model in [*database.TICKET_MODELS.values(), *database.ARCHIVE_MODELS.values(), database.Khachhang, database.Loaihang, database.Xe, database.PictureCatalog]:
+                conn.execute(model.__table__.delete())
+        shutil.rmtree(picture_path, ignore_errors=True)
+
+    dataset = Dataset(args.run_size, args.days, args.picture_days, args.seed)
+    started = time.perf_counter()
+    generate_database(database.engine, dataset, args.seed)
+    files = generate_pictures(picture_path, dataset, args.picture_bytes, args.seed)
+    generate_seconds = time.perf_counter() - started
+
+    from fastapi.testclient import TestClient
+    import main as app_module
+
+    results = {}
+    only = set(args.only.split(",")) if args.only else None
+    with TestClient(app_module.app) as client:
+        # Hình sinh thẳng vào thư mục: đưa vào danh mục hình ảnh trước khi đo
+        db = database.SessionLocal()
+        try:
+            app_module.picture_store.reindex(db)
+        finally:
+            db.close()
+        for name, request_fn in scenarios(dataset).items():
+            if only and name not in only:
+                continue
+            results[name] = measure(client, request_fn, args.requests, args.concurrency, args.warmup, args.seed)
+            print(f"  {name:<22} p50 {results[name]['p50_ms']:>9.2f}ms  p99 {results[name]['p99_ms']:>9.2f}ms  {results[name]['throughput_rps']:>8.1f} req/s", file=sys.stderr)
+
+    return {
+        "dataset": {"tickets_per_table": args.run_size, "days": args.days, "picture_files": files, "generate_seconds": round(generate_seconds, 2)},
+        "scenarios": results
+    }
+
+
+# ==== Chạy và so sánh ====
+
+def _git(*command: str) -> Optional[str]:
+    try:
+        return subprocess.run(["git", *command], cwd=WEBAPI_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> dict:
+    commit = _git("rev-parse", "--short", "HEAD")
+    dirty = bool(_git("status", "--porcelain", "--", "."))
+    report = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": "custom" if args.database_url else "sqlite",
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed
+        },
+        "sizes": {}
+    }
+    for size in [int(value) for value in args.sizes.split(",")]:
+        print(f"📊 Kích thước {size} phiếu/bảng", file=sys.stderr)
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as result_file:
+            result_path = result_file.name
+        try:
+            # Tiến trình con riêng: database/engine, cache và biến môi trường của ứng dụng được tạo lại cho mỗi kích thước
+            command = [sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--run-size", str(size), "--result-file", result_path]
+            subprocess.run(command, cwd=WEBAPI_DIR, check=True, stdout=subprocess.DEVNULL)
+            with open(result_path, encoding="utf-8") as f:
+                report["sizes"][str(size)] = json.load(f)
+        finally:
+            os.unlink(result_path)
+
+    output = args.output or f"benchmark-{commit or 'local'}{'-dirty' if dirty else ''}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ Đã ghi kết quả: {output}", file=sys.stderr)
+    return report
+
+
+def compare(before_path: str, after_path: str, threshold: float) -> bool:
+    """
+    In bảng so sánh p50/p99/throughput của hai lần chạy
+    Returns:
+        bool: True nếu có kịch bản chậm đi quá threshold (%)
+    """
+    with open(before_path, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(after_path, encoding="utf-8") as f:
+        after = json.load(f)
+
+    def change(old: float, new: float) -> float:
+        return (new - old) / old * 100 if old else 0.0
+
+    print(f"{before['meta'].get('commit')} -> {after['meta'].get('commit')} (ngưỡng {threshold:.0f}%)")
+    regressed = False
+    for size, result in after["sizes"].items():
+        old_size = before["sizes"].get(size)
+        if old_size is None:
+            continue
+        print(f"\n{size} phiếu/bảng")
+        print(f"  {'kịch bản':<22} {'p50 ms':>20} {'p99 ms':>20} {'req/s':>20}")
+        for name, new in result["scenarios"].items():
+            old = old_size["scenarios"].get(name)
+            if old is None:
+                continue
+            p50, p99, rps = change(old["p50_ms"], new["p50_ms"]), change(old["p99_ms"], new["p99_ms"]), change(old["throughput_rps"], new["throughput_rps"])
+            worse = p50 > threshold or p99 > threshold or rps < -threshold
+            regressed = regressed or worse
+            print(
+                f"  {name:<22} {old['p50_ms']:>8.2f}→{new['p50_ms']:<8.2f}{p50:+5.0f}% {old['p99_ms']:>8.2f}→{new['p99_ms']:<8.2f}{p99:+5.0f}%"
+                f" {old['throughput_rps']:>8.1f}→{new['throughput_rps']:<8.1f}{rps:+5.0f}%{'  ⚠️' if worse else ''}"
+            )
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark các API với dữ liệu giả lập")
+    parser.add_argument("--sizes", default="1000,10000,50000", help="Số phiếu mỗi bảng, phân cách bởi dấu phẩy")
+    parser.add_argument("--requests", type=int, default=200, help="Số request đo cho mỗi kịch bản")
+    parser.add_argument("--concurrency", type=int, default=1, help="Số request gửi song song")
+    parser.add_argument("--warmup", type=int, default=10, help="Số request chạy trước khi đo")
+    parser.add_argument("--days", type=int, default=365, help="Số ngày dữ liệu phiếu")
+    parser.add_argument("--picture-days", type=int, default=30, help="Số ngày gần nhất có hình ảnh")
+    parser.add_argument("--picture-bytes", type=int, default=30000, help="Kích thước mỗi file hình ảnh")
+    parser.add_argument("--seed", type=int, default=1, help="Seed sinh dữ liệu và tham số request")
+    parser.add_argument("--only", help="Chỉ chạy các kịch bản này (phân cách bởi dấu phẩy)")
+    parser.add_argument("--work-dir", default=os.path.join(WEBAPI_DIR, ".bench"), help="Thư mục chứa database/hình ảnh giả lập")
+    parser.add_argument("--database-url", help="Chạy trên database này thay cho SQLite (vd. SQL Server trong container)")
+    parser.add_argument("--reset", action="store_true", help="Cho phép xóa dữ liệu phiếu/danh mục có sẵn trong --database-url")
+    parser.add_argument("--output", help="File JSON kết quả (mặc định benchmark-<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="So sánh hai file kết quả")
+    parser.add_argument("--threshold", type=float, default=10, help="Ngưỡng chậm đi (%%) khi so sánh")
+    parser.add_argument("--run-size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(args.compare[0], args.compare[1], args.threshold) else 0)
+    if args.run_size is not None:
+        result = run_size(args)
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        return
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import hashlib
+import os
+import threading
+import time
+import zlib
+from datetime import date, datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+
+# Số token (bảng, since) giữ trong cache trước khi bỏ các token đã hết hạn
+MAX_CACHED_TOKENS = 256
+
+
+def _sqlite_row_checksum(*values) -> int:
+    return zlib.crc32(repr(values).encode("utf-8"))
+
+
+def row_checksum(db: Session, model):
+    """
+    Biểu thức SQL checksum của mọi cột trong một dòng:
+    BINARY_CHECKSUM trên SQL Server, hàm row_checksum (CRC32, đăng ký trên kết nối) trên SQLite
+    """
+    columns = list(model.__table__.columns)
+    if db.bind.dialect.name == "mssql":
+        return func.binary_checksum(*columns)
+    db.connection().connection.driver_connection.create_function("row_checksum", -1, _sqlite_row_checksum, deterministic=True)
+    return func.row_checksum(*columns)
+
+
+def checksum_total(db: Session, checksum):
+    """Gộp checksum của nhiều dòng, không phụ thuộc thứ tự (CHECKSUM_AGG trên SQL Server, SUM trên SQLite)"""
+    if db.bind.dialect.name == "mssql":
+        return func.checksum_agg(checksum)
+    return func.sum(checksum)
+
+
+def bucket_checksums(db: Session, model, bucket_size: int, *conditions) -> Dict[int, int]:
+    """
+    Checksum mọi cột theo nhóm bucket_size số phiếu liên tiếp (sophieu // bucket_size) của các dòng thỏa conditions,
+    dùng để tìm nhóm phiếu đã thay đổi mà không giữ dấu vân tay của từng phiếu
+    """
+    bucket = model.sophieu // bucket_size
+    rows = db.execute(
+        select(bucket, checksum_total(db, row_checksum(db, model))).where(*conditions).group_by(bucket)
+    ).all()
+    return {int(number): checksum for number, checksum in rows}
+
+
+class ChangeTokens:
+    """
+    Token thay đổi của các bảng phiếu, dùng làm ETag/Last-Modified cho API danh sách phiếu.
+
+    Token của một bảng gồm:
+    - Bộ đếm trong tiến trình, tăng khi API tự thay đổi bảng (lưu trữ phiếu...)
+    - Phần đọc từ database: phiên bản Change Tracking nếu bảng đã bật (SQL Server, migration 0005),
+      nếu không thì COUNT, MAX(sophieu) và checksum mọi cột của các dòng truy vấn có thể trả về:
+      ngaycan >= since khi danh sách lọc từ ngày (seek trên index ngaycan), cả bảng nếu không có since
+    Phần database được cache ttl giây (Change Tracking) hoặc scan_ttl giây (checksum) theo (bảng, since),
+    nên nhiều dashboard cùng khoảng ngày làm mới cùng lúc chỉ tốn một truy vấn.
+    scan_ttl lớn hơn giảm tải database nhưng thay đổi hiển thị trên dashboard chậm hơn tối đa scan_ttl giây.
+    """
+
+    def __init__(self, models: Dict[str, object], ttl: float = 1.0, scan_ttl: Optional[float] = None):
+        self.models = models
+        self.ttl = ttl
+        self.scan_ttl = ttl if scan_ttl is None else scan_ttl
+        self._counters: Dict[str, int] = {table: 0 for table in models}
+        # (bảng, since) -> (token, thời điểm đọc, Last-Modified, thời gian cache)
+        self._tokens: Dict[Tuple[str, Optional[date]], Tuple[str, float, datetime, float]] = {}
+        self._change_tracking: Dict[str, bool] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def bump(self, table: str):
+        """Đánh dấu bảng đã thay đổi (gọi sau khi API ghi vào bảng)"""
+        with self._lock:
+            self._counters[table] = self._counters.get(table, 0) + 1
+            for key in [key for key in self._tokens if key[0] == table]:
+                del self._tokens[key]
+
+    def uses_change_tracking(self, db: Session, table: str) -> bool:
+        """Bảng đã bật SQL Server Change Tracking chưa (kiểm tra một lần)"""
+        enabled = self._change_tracking.get(table)
+        if enabled is None:
+            enabled = self._change_tracking[table] = db.execute(
+                text("SELECT COUNT(*) FROM sys.change_tracking_tables WHERE object_id = OBJECT_ID(:table)"),
+                {"table": table}
+            ).scalar() > 0
+        return enabled
+
+    def _fetch(self, db: Session, table: str, since: Optional[date] = None) -> Tuple[str, float]:
+        """
+        Đọc phần token từ database
+        Returns:
+            (token, thời gian cache)
+        """
+        model = self.models[table]
+        if db.bind.dialect.name == "mssql" and self.uses_change_tracking(db, table):
+            return f"ct{db.execute(text('SELECT CHANGE_TRACKING_CURRENT_VERSION()')).scalar()}", self.ttl
+        # Mọi cột người dùng thấy (khách hàng, biển số, đơn giá, ghi chú...) đều làm token thay đổi
+        query = select(
+            func.count(),
+            func.max(model.sophieu),
+            checksum_total(db, row_checksum(db, model))
+        ).select_from(model)
+        if since is not None:
+            # Phiếu cũ hơn since không có trong kết quả; phiếu sửa ngaycan vào khoảng này thì làm đổi checksum
+            query = query.where(model.ngaycan >= since)
+        row = db.execute(query).one()
+        return "-".join(str(value) for value in row), self.scan_ttl
+
+    def token(self, db: Session, table: str, since: Optional[date] = None) -> Tuple[str, datetime]:
+        """
+        Token và thời điểm thay đổi gần nhất đã ghi nhận của một bảng
+        Args:
+            since: Chỉ xét các phiếu có ngaycan >= since (danh sách lọc từ ngày)
+        Returns:
+            (token, last_modified)
+        """
+        now = time.monotonic()
+        key = (table, since)
+        with self._lock:
+            cached = self._tokens.get(key)
+            if cached is not None and now - cached[1] < cached[3]:
+                self.hits += 1
+                return cached[0], cached[2]
+            self.misses += 1
+            counter = self._counters.get(table, 0)
+
+        fetched, ttl = self._fetch(db, table, since)
+        token = f"{counter}:{fetched}"
+        with self._lock:
+            previous = self._tokens.get(key)
+            if previous is not None and previous[0] == token:
+                last_modified = previous[2]
+            else:
+                last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+            if len(self._tokens) >= MAX_CACHED_TOKENS:
+                # Nhiều khoảng ngày khác nhau: bỏ các token đã hết hạn
+                for stale in [stale for stale, value in self._tokens.items() if now - value[1] >= value[3]]:
+                    del self._tokens[stale]
+            self._tokens[key] = (token, now, last_modified, ttl)
+        return token, last_modified
+
+    def validators(self, db: Session, route: str, tables: List[str], query: str, since: Optional[date] = None) -> Tuple[str, datetime]:
+        """
+        ETag (từ route, tham số truy vấn và token các bảng) và Last-Modified cho một response
+        Args:
+            query: Tham số truy vấn đã chuẩn hóa (vd. TicketQueryParams.model_dump_json())
+            since: tu_ngay của truy vấn, token chỉ xét các phiếu từ ngày này
+        """
+        digest = hashlib.sha1(f"{route}|{query}".encode("utf-8"))
+        last_modified = None
+        for table in tables:
+            token, modified = self.token(db, table, since)
+            digest.update(f"|{table}={token}".encode("utf-8"))
+            if last_modified is None or modified > last_modified:
+                last_modified = modified
+        return f'"{digest.hexdigest()}"', last_modified
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "counters": dict(self._counters)}
+
+
+def not_modified(headers, etag: str, last_modified: Optional[datetime]) -> bool:
+    """
+    Kiểm tra request có điều kiện (If-None-Match, If-Modified-Since) khớp phiên bản hiện tại
+    """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        candidates = [value.strip() for value in if_none_match.split(",")]
+        return "*" in candidates or any(value.removeprefix("W/") == etag for value in candidates)
+
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            return last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def validator_headers(etag: str, last_modified: Optional[datetime]) -> Dict[str, str]:
+    """Header ETag/Last-Modified; no-cache để trình duyệt luôn hỏi lại bằng request có điều kiện"""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    return headers
+
+
+def create_change_tokens(models: Dict[str, object]) -> ChangeTokens:
+    """Tạo ChangeTokens với cấu hình từ environment"""
+    return ChangeTokens(
+        models,
+        ttl=float(os.getenv("CHANGE_TOKEN_TTL", "1")),
+        scan_ttl=float(os.getenv("CHANGE_TOKEN_SCAN_TTL", "5"))
+    )
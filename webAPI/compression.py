@@ -0,0 +1,163 @@
+import gzip
+import os
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+import anyio
+
+# Thư viện nén tùy chọn: pip install brotli zstandard
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Content-type không nén (đã nén sẵn hoặc là stream)
+SKIP_CONTENT_TYPES = ("text/event-stream", "image/", "video/", "audio/", "application/zip", "application/octet-stream")
+
+
+def _encoders() -> Dict[str, Callable[[bytes], bytes]]:
+    encoders = {}
+    if brotli is not None:
+        encoders["br"] = lambda body: brotli.compress(body, quality=5)
+    if zstandard is not None:
+        encoders["zstd"] = lambda body: zstandard.ZstdCompressor(level=6).compress(body)
+    encoders["gzip"] = lambda body: gzip.compress(body, compresslevel=6)
+    return encoders
+
+
+# Các encoding hỗ trợ theo thứ tự ưu tiên
+ENCODERS = _encoders()
+
+
+def negotiate_encoding(accept_encoding: Optional[str], supported: Optional[Iterable[str]] = None) -> Optional[str]:
+    """
+    Chọn encoding theo header Accept-Encoding (có q-value) và các thư viện đang có
+    Args:
+        supported: Các encoding được chọn theo thứ tự ưu tiên (mặc định tất cả ENCODERS)
+    Returns:
+        "br", "zstd", "gzip" hoặc None nếu không nén
+    """
+    if not accept_encoding:
+        return None
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    wildcard = accepted.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for name in (ENCODERS if supported is None else supported):
+        quality = accepted.get(name, wildcard)
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    return ENCODERS[encoding](body)
+
+
+def weak_etag(etag: Optional[str]) -> Optional[str]:
+    """ETag của bản nén khác byte với bản gốc nên chuyển thành weak ETag"""
+    if etag and not etag.startswith("W/"):
+        return f"W/{etag}"
+    return etag
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware nén response (br/zstd/gzip theo Accept-Encoding) khi body lớn hơn minimum_size.
+
+    - Nén trong worker thread, không chặn event loop
+    - Bỏ qua response đã có Content-Encoding (vd. bản nén lấy từ result_cache), stream (SSE),
+      hình ảnh, response trả về nhiều phần và các đường dẫn trong excluded_prefixes
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, excluded_prefixes: Tuple[str, ...] = ("/webapp",)):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.excluded_prefixes = excluded_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.excluded_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict((key.lower(), value) for key, value in scope["headers"])
+        encoding = negotiate_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None or b"range" in headers:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                response_headers = {key.lower(): value for key, value in message.get("headers", [])}
+                content_type = response_headers.get(b"content-type", b"").decode("latin-1")
+                if (
+                    message["status"] < 200 or message["status"] in (204, 206, 304)
+                    or b"content-encoding" in response_headers
+                    or content_type.startswith(SKIP_CONTENT_TYPES)
+                ):
+                    passthrough = True
+                    await send(message)
+                    return
+                start_message = message
+                return
+
+            # http.response.body
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < self.minimum_size:
+                # Response nhiều phần (stream file) hoặc quá nhỏ: gửi nguyên bản
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = await anyio.to_thread.run_sync(compress, body, encoding)
+            await send(self._with_encoding(start_message, encoding, len(compressed)))
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _with_encoding(message, encoding: str, length: int):
+        headers = []
+        vary = None
+        for key, value in message.get("headers", []):
+            name = key.lower()
+            if name == b"content-length":
+                continue
+            if name == b"etag":
+                value = weak_etag(value.decode("latin-1")).encode("latin-1")
+            if name == b"vary":
+                vary = value
+                continue
+            headers.append((key, value))
+        headers.append((b"content-encoding", encoding.encode("latin-1")))
+        headers.append((b"content-length", str(length).encode("latin-1")))
+        headers.append((b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"))
+        return {**message, "headers": headers}
+
+
+def compression_minimum_size() -> int:
+    """Kích thước body tối thiểu (bytes) để nén, cấu hình qua COMPRESSION_MIN_SIZE"""
+    return int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
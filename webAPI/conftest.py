@@ -0,0 +1,57 @@
+"""
+Cấu hình chung cho test (pytest), chạy trong thư mục webAPI:
+    python -m pytest -q
+
+Test dùng SQLite trong bộ nhớ, không kết nối SQL Server.
+"""
+import os
+
+# Đặt trước khi import database để engine mặc định không trỏ tới database thật (.env không ghi đè biến đã có)
+os.environ["DATABASE_URL"] = "sqlite://"
+
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+
+
+@pytest.fixture
+def engine():
+    """Database SQLite trong bộ nhớ dùng chung giữa các thread (StaticPool), đã tạo mọi bảng"""
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    with Session(engine) as session:
+        yield session
+
+
+def _make_ticket(model, sophieu: int, **values):
+    defaults = {
+        "sophieu": sophieu,
+        "ngaycan": date.today(),
+        "bienso1_1": "51D12345",
+        "khachhang": "CONG TY ABC",
+        "loaihang": "GAO",
+        "laixe": "NGUYEN VAN A",
+        "khoiluonglan1": 15000,
+        "khoiluonglan2": 5000,
+        "lancan": 2,
+        "lanin": 0,
+        "xoaphieu": 0
+    }
+    return model(**{**defaults, **values})
+
+
+@pytest.fixture
+def make_ticket():
+    """Tạo phiếu cân mẫu: make_ticket(model, sophieu, **cột) - cân hôm nay, chưa xóa"""
+    return _make_ticket
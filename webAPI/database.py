@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, String, Integer, Date, DECIMAL
+from sqlalchemy import create_engine, Column, String, Integer, Date, DateTime, DECIMAL, Index, Table, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -9,9 +9,9 @@ load_dotenv()
 
 def build_database_url():
     """Build database URL từ các tham số environment"""
-    # Kiểm tra xem có DATABASE_URL đầy đủ không
+    # Kiểm tra xem có DATABASE_URL đầy đủ không (mssql+pyodbc://..., hoặc sqlite:///... cho benchmark)
     database_url = os.getenv("DATABASE_URL")
-    if database_url and database_url.startswith("mssql+pyodbc://"):
+    if database_url and "://" in database_url:
         return database_url
     
     # Build từ các tham số riêng biệt
@@ -52,17 +52,38 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # Create Base class
 Base = declarative_base()
 
+def ticket_indexes(table_name: str):
+    """
+    Index cho các truy vấn danh sách phiếu: lọc/sắp xếp theo ngày cân, khách hàng, loại hàng, biển số.
+    Index lọc (filtered index) chỉ chứa phiếu chưa xóa (xoaphieu = 0).
+    API danh sách trả về cả dòng phiếu nên index chỉ dùng để tìm và sắp xếp (seek + key lookup theo sophieu),
+    không thêm cột INCLUDE.
+    """
+    return (
+        Index(f"IX_{table_name}_ngaycan", text("ngaycan DESC"), text("sophieu DESC")),
+        Index(
+            f"IX_{table_name}_active_ngaycan",
+            text("ngaycan DESC"), text("sophieu DESC"),
+            mssql_where=text("xoaphieu = 0"),
+            sqlite_where=text("xoaphieu = 0")
+        ),
+        Index(f"IX_{table_name}_khachhang", "khachhang", "ngaycan"),
+        Index(f"IX_{table_name}_loaihang", "loaihang", "ngaycan"),
+        Index(f"IX_{table_name}_bienso1_1", "bienso1_1")
+    )
+
 # User model
 class User(Base):
     __tablename__ = "user"
     
     iduser = Column(String(50), primary_key=True)
     ten = Column(String(100))
-    password = Column(String(50))
+    password = Column(String(255))                        # scrypt hash (or legacy plaintext until next login)
 
 # Nhapkho model - Import Warehouse Tickets
 class Nhapkho(Base):
     __tablename__ = "nhapkho"
+    __table_args__ = ticket_indexes("nhapkho")
     
     sophieu = Column(Integer, primary_key=True)           # Ticket number
     ngaycan = Column(Date)                                # Weighing date
@@ -94,6 +115,7 @@ class Nhapkho(Base):
 # Xuatkho model - Export Warehouse Tickets
 class Xuatkho(Base):
     __tablename__ = "xuatkho"
+    __table_args__ = ticket_indexes("xuatkho")
     
     sophieu = Column(Integer, primary_key=True)           # Ticket number
     ngaycan = Column(Date)                                # Weighing date
@@ -125,6 +147,7 @@ class Xuatkho(Base):
 # Canthue model - Weighing Service Tickets
 class Canthue(Base):
     __tablename__ = "canthue"
+    __table_args__ = ticket_indexes("canthue")
     
     sophieu = Column(Integer, primary_key=True)           # Ticket number
     ngaycan = Column(Date)                                # Weighing date
@@ -156,6 +179,7 @@ class Canthue(Base):
 # Nhaptau model - Ship Import Tickets
 class Nhaptau(Base):
     __tablename__ = "nhaptau"
+    __table_args__ = ticket_indexes("nhaptau")
     
     sophieu = Column(Integer, primary_key=True)           # Ticket number
     ngaycan = Column(Date)                                # Weighing date
@@ -184,6 +208,39 @@ class Nhaptau(Base):
     lanin = Column(Integer)                               # Print count
     xoaphieu = Column(Integer, default=0)                 # Deleted flag (0: active, 1: deleted)
 
+# Các bảng phiếu cân có cùng cấu trúc
+TICKET_MODELS = {
+    "nhapkho": Nhapkho,
+    "xuatkho": Xuatkho,
+    "canthue": Canthue,
+    "nhaptau": Nhaptau
+}
+
+def archive_model(model):
+    """
+    Tạo model bảng lưu trữ <bảng>_archive cùng cấu trúc với bảng phiếu,
+    chứa các phiếu của kỳ đã đóng được chuyển khỏi bảng chính
+    """
+    table_name = f"{model.__tablename__}_archive"
+    table = Table(
+        table_name,
+        Base.metadata,
+        *[Column(column.name, column.type, primary_key=column.primary_key) for column in model.__table__.columns],
+        Index(f"IX_{table_name}_ngaycan", text("ngaycan DESC"), text("sophieu DESC"))
+    )
+    return type(f"{model.__name__}Archive", (Base,), {"__table__": table})
+
+# Bảng lưu trữ của các bảng phiếu cân
+ARCHIVE_MODELS = {name: archive_model(model) for name, model in TICKET_MODELS.items()}
+
+# ArchiveState model - Mốc lưu trữ của từng bảng phiếu
+class ArchiveState(Base):
+    __tablename__ = "archive_state"
+    
+    table_name = Column(String(50), primary_key=True)    # Ticket table name
+    archived_before = Column(Date)                        # Tickets with ngaycan < this date are in the archive table
+    updated_at = Column(DateTime)                         # Last archive run
+
 # Loaihang model - Product/Goods Type
 class Loaihang(Base):
     __tablename__ = "loaihang"
@@ -230,6 +287,36 @@ class Camera(Base):
     SubStream = Column(Integer)                           # SubStream (0: main stream, 1: sub stream)
     Caching = Column(String(5))                           # Caching setting
 
+# PictureCatalog model - Danh mục hình ảnh (metadata của các object trong picture storage)
+class PictureCatalog(Base):
+    __tablename__ = "picture_catalog"
+    __table_args__ = (
+        Index("IX_picture_catalog_ticket", "ticket_number", "camera_number", "sequence"),
+        Index("IX_picture_catalog_date", "picture_type", "picture_date"),
+        Index("IX_picture_catalog_hash", "content_hash")
+    )
+    
+    storage_key = Column(String(255), primary_key=True)   # <picture_type>/<YYYY-MM-DD>/<filename>
+    picture_type = Column(String(10))                     # NK, CT, NT, XK
+    picture_date = Column(Date)                           # Picture date (folder date)
+    filename = Column(String(255))                        # [ticket]-CMR[camera]_[sequence].ext
+    ticket_number = Column(String(50))                    # Ticket number
+    camera_number = Column(Integer)                       # Camera number
+    sequence = Column(Integer)                            # Capture sequence
+    file_size = Column(Integer)                           # Size in bytes
+    content_type = Column(String(100))                    # MIME type
+    created_at = Column(DateTime)                         # Upload/index time
+    content_hash = Column(String(64))                     # SHA-256 of the content (hex)
+    blob_key = Column(String(255))                        # Key holding the bytes: cas/ab/cd/<hash> when deduplicated, NULL = storage_key
+
+# SchemaMigration model - Migration đã áp dụng
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    
+    id = Column(String(100), primary_key=True)            # Migration ID
+    description = Column(String(255))                     # Description
+    applied_at = Column(DateTime)                         # Applied time
+
 # Create tables
 def create_tables():
     """Tạo các bảng trong database"""
@@ -0,0 +1,376 @@
+"""
+Load test mô phỏng một ngày làm việc của trạm cân, chạy vào một API đang hoạt động (cần httpx).
+
+Các nhóm client chạy đồng thời theo lịch cố định (open-loop: request được gửi đúng giờ kể cả khi server chậm,
+latency tính từ thời điểm lẽ ra phải gửi nên không che giấu hàng đợi; lượt gửi bị bỏ vì quá --max-in-flight
+được tính là lỗi với latency bằng --timeout):
+- Trạm cân: POST /realtime/update liên tục, mỗi lần cân upload 3 hình (3 camera)
+- Dashboard: GET /logistics/all (gửi lại ETag như trình duyệt) và /realtime/data định kỳ
+- Mobile: tìm hình theo số phiếu vừa cân rồi tải hình
+
+    python loadtest.py --base-url http://localhost:8000 --duration 300
+    python loadtest.py --stations 4 --realtime-hz 10 --dashboards 20 --mobiles 50 --output peak.json
+    python loadtest.py --slo logistics_all=p95:800,p99:2000 --slo picture_upload=p95:1500
+    python loadtest.py --cleanup --output day.json     # Xóa hình đã upload sau khi test
+
+Hình upload có số phiếu LT<mã lần chạy>-<n> (picture_type/ngày hôm nay); --cleanup xóa chúng qua /picture/delete.
+Mọi client giả lập đi từ một máy nên dùng chung giới hạn request của server (429), trừ khi chạy với
+--forwarded-for và server đặt RATE_LIMIT_TRUST_PROXY=true.
+Thoát mã 1 nếu có route không đạt SLO.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from functools import partial
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+# SLO mặc định theo route: latency (ms) theo percentile và tỉ lệ lỗi tối đa (%)
+DEFAULT_SLOS = {
+    "realtime_update": {"p95": 100, "p99": 250, "error_rate": 0.1},
+    "realtime_data": {"p95": 100, "p99": 250, "error_rate": 0.1},
+    "picture_upload": {"p95": 1000, "p99": 2500, "error_rate": 0.5},
+    "logistics_all": {"p95": 1000, "p99": 3000, "error_rate": 0.5},
+    "picture_list": {"p95": 500, "p99": 1500, "error_rate": 0.5},
+    "picture_image": {"p95": 500, "p99": 1500, "error_rate": 0.5}
+}
+
+PICTURE_TYPES = ("NK", "XK", "CT", "NT")
+
+
+def parse_slo(values: List[str]) -> Dict[str, dict]:
+    """--slo route=p95:800,p99:2000,error_rate:1 ghi đè SLO mặc định của route"""
+    slos = {route: dict(slo) for route, slo in DEFAULT_SLOS.items()}
+    for value in values or []:
+        route, _, spec = value.partition("=")
+        for item in spec.split(","):
+            name, _, threshold = item.partition(":")
+            slos.setdefault(route.strip(), {})[name.strip()] = float(threshold)
+    return slos
+
+
+class RouteStats:
+    """Latency (ms) và kết quả của các request một route"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.statuses: Dict[int, int] = {}
+        self.errors = 0
+        self.rejected = 0    # 429/503 của giới hạn request
+        self.failures = 0    # Lỗi kết nối/timeout
+        self.dropped = 0     # Lượt gửi bị bỏ (quá --max-in-flight), cũng tính vào failures
+
+    def record(self, latency_ms: float, status: Optional[int]):
+        self.latencies.append(latency_ms)
+        if status is None:
+            self.failures += 1
+            self.errors += 1
+            return
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status in (429, 503):
+            self.rejected += 1
+        if status >= 400:
+            self.errors += 1
+
+    def record_dropped(self, latency_ms: float):
+        """Lượt gửi không được gửi: vẫn tính vào latency/lỗi để không che giấu quá tải (coordinated omission)"""
+        self.dropped += 1
+        self.record(latency_ms, None)
+
+    def summary(self, duration: float, slo: Optional[dict]) -> dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(q: float) -> float:
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 2)
+
+        count = len(latencies)
+        result = {
+            "count": count,
+            "rps": round(count / duration, 2) if duration else 0.0,
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": round(latencies[-1], 2) if latencies else 0.0,
+            "error_rate": round(self.errors * 100 / count, 3) if count else 0.0,
+            "rejected": self.rejected,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "statuses": {str(status): total for status, total in sorted(self.statuses.items())}
+        }
+        if slo:
+            violations = [f"{name} {result[name]} > {threshold}" for name, threshold in slo.items() if name in result and result[name] > threshold]
+            result["slo"] = slo
+            result["slo_ok"] = not violations
+            result["violations"] = violations
+        return result
+
+
+class LoadTest:
+    """Chạy các nhóm client theo lịch trong duration giây và thu thập latency theo route"""
+
+    def __init__(self, args):
+        self.args = args
+        self.run_id = f"{int(time.time()) % 100000:05d}"
+        self.stats: Dict[str, RouteStats] = {}
+        self.headers: Dict[str, str] = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # Phiếu đã upload hình: (số phiếu, loại, lần cân) cho client mobile tìm lại
+        self.tickets: List[tuple] = []
+        # Mọi số phiếu đã thử upload (kể cả lần upload lỗi/timeout) để --cleanup dọn
+        self.uploaded: List[tuple] = []
+        self.ticket_seq = 0
+        self.today = date.today().isoformat()
+        self.picture_payload = b"\xff\xd8\xff\xe0" + os.urandom(max(0, args.picture_bytes - 6)) + b"\xff\xd9"
+        self._tasks = set()
+
+    async def timed(self, route: str, scheduled: float, call: Callable[[], Awaitable[httpx.Response]]) -> Optional[httpx.Response]:
+        """Chạy request, latency tính từ thời điểm theo lịch (scheduled, time.monotonic)"""
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        response = None
+        try:
+            response = await call()
+        except httpx.HTTPError:
+            pass
+        finally:
+            self.in_flight -= 1
+        self.stats.setdefault(route, RouteStats()).record((time.monotonic() - scheduled) * 1000, response.status_code if response is not None else None)
+        return response
+
+    async def every(self, route: str, interval: float, action: Callable[[float], Awaitable[None]], deadline: float, sends: int = 1):
+        """
+        Gọi action theo chu kỳ interval (giây, lệch pha ngẫu nhiên), không chờ lần trước xong.
+        Quá --max-in-flight thì bỏ lượt, ghi sends request lỗi của route với latency bằng timeout.
+        """
+        if interval <= 0:
+            return
+        scheduled = time.monotonic() + random.uniform(0, interval)
+        while scheduled < deadline:
+            await asyncio.sleep(max(0.0, scheduled - time.monotonic()))
+            if self.in_flight < self.args.max_in_flight:
+                task = asyncio.create_task(action(scheduled))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            else:
+                stats = self.stats.setdefault(route, RouteStats())
+                for _ in range(sends):
+                    stats.record_dropped(self.args.timeout * 1000)
+            scheduled += interval * random.uniform(0.9, 1.1)
+
+    def client_headers(self, index: int) -> Dict[str, str]:
+        """Header riêng của client thứ index: X-Forwarded-For khác nhau để server (RATE_LIMIT_TRUST_PROXY=true) tính giới hạn theo từng client"""
+        if not self.args.forwarded_for:
+            return {}
+        return {"X-Forwarded-For": f"10.{index // 65025 % 250}.{index // 255 % 255}.{index % 255 + 1}"}
+
+    # ==== Trạm cân ====
+
+    async def realtime_update(self, client: httpx.AsyncClient, headers: Dict[str, str], scheduled: float):
+        weight = str(random.randint(0, 60000))
+        await self.timed("realtime_update", scheduled, lambda: client.post("/realtime/update", headers=headers, json={
+            "WeightValue": weight, "StatusCam1": "1", "StatusCam2": "1", "StatusCam3": "1"
+        }))
+
+    async def weighing(self, client: httpx.AsyncClient, headers: Dict[str, str], scheduled: float):
+        """Một lần cân: 3 camera upload hình gần như cùng lúc"""
+        self.ticket_seq += 1
+        ticket = f"LT{self.run_id}-{self.ticket_seq}"
+        picture_type = random.choice(PICTURE_TYPES)
+        sequence = 2 if random.random() < 0.5 else 1
+        self.uploaded.append((ticket, picture_type))
+
+        async def upload(camera: int):
+            await self.timed("picture_upload", scheduled, lambda: client.post(
+                "/picture/upload",
+                headers=headers,
+                params={"ticket_number": ticket, "picture_type": picture_type, "camera_number": camera, "sequence": sequence, "date": self.today},
+                files={"file": (f"cam{camera}.jpg", self.picture_payload, "image/jpeg")}
+            ))
+
+        await asyncio.gather(*(upload(camera) for camera in (1, 2, 3)))
+        self.tickets.append((ticket, picture_type, sequence))
+
+    # ==== Dashboard ====
+
+    def dashboard(self, client: httpx.AsyncClient, client_headers: Dict[str, str]):
+        etag = None
+        tu_ngay = (date.today() - timedelta(days=self.args.dashboard_days)).isoformat()
+
+        async def poll(scheduled: float):
+            nonlocal etag
+            headers = {**client_headers, "If-None-Match": etag} if etag else client_headers
+            response = await self.timed("logistics_all", scheduled, lambda: client.get("/logistics/all", params={"tu_ngay": tu_ngay}, headers=headers))
+            if response is not None and response.status_code == 200:
+                etag = response.headers.get("etag")
+
+        return poll
+
+    async def realtime_data(self, client: httpx.AsyncClient, headers: Dict[str, str], scheduled: float):
+        await self.timed("realtime_data", scheduled, lambda: client.get("/realtime/data", headers=headers))
+
+    # ==== Mobile ====
+
+    async def mobile_view(self, client: httpx.AsyncClient, headers: Dict[str, str], scheduled: float):
+        """Tìm hình của một phiếu vừa cân rồi tải một hình"""
+        if not self.tickets:
+            await self.timed("picture_list", scheduled, lambda: client.get("/picture/list", headers=headers, params={"date": self.today, "limit": 50}))
+            return
+        ticket, picture_type, sequence = random.choice(self.tickets[-200:])
+        await self.timed("picture_list", scheduled, lambda: client.get("/picture/list", headers=headers, params={
+            "ticket_number": ticket, "date": self.today, "picture_type": picture_type
+        }))
+        await self.timed("picture_image", time.monotonic(), lambda: client.get("/picture/image", headers=headers, params={
+            "ticket_number": ticket, "camera_number": random.randint(1, 3), "sequence": sequence, "date": self.today, "picture_type": picture_type
+        }))
+
+    async def login(self, client: httpx.AsyncClient):
+        response = await client.post("/auth/login", json={"iduser": self.args.username, "password": self.args.password})
+        response.raise_for_status()
+        token = response.json().get("access_token")
+        if token:
+            self.headers["Authorization"] = f"Bearer {token}"
+
+    async def run(self) -> float:
+        args = self.args
+        limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+            if args.username:
+                await self.login(client)
+                client.headers.update(self.headers)
+
+            started = time.monotonic()
+            deadline = started + args.duration
+            actors = []
+            clients = iter(range(args.stations + args.dashboards + args.mobiles))
+            for _ in range(args.stations):
+                headers = self.client_headers(next(clients))
+                actors.append(self.every("realtime_update", 1 / args.realtime_hz if args.realtime_hz else 0, partial(self.realtime_update, client, headers), deadline))
+                if not args.no_uploads:
+                    actors.append(self.every("picture_upload", args.weighing_interval, partial(self.weighing, client, headers), deadline, sends=3))
+            for _ in range(args.dashboards):
+                headers = self.client_headers(next(clients))
+                actors.append(self.every("logistics_all", args.dashboard_interval, self.dashboard(client, headers), deadline))
+                actors.append(self.every("realtime_data", args.realtime_poll_interval, partial(self.realtime_data, client, headers), deadline))
+            for _ in range(args.mobiles):
+                actors.append(self.every("picture_list", args.mobile_interval, partial(self.mobile_view, client, self.client_headers(next(clients))), deadline))
+
+            progress = asyncio.create_task(self.progress(started, deadline))
+            await asyncio.gather(*actors)
+            # Chờ các request cuối cùng
+            if self._tasks:
+                await asyncio.wait(self._tasks, timeout=args.timeout)
+            progress.cancel()
+            duration = time.monotonic() - started
+            if args.cleanup:
+                await self.cleanup(client)
+            return duration
+
+    async def _send(self, call: Callable[[], Awaitable[httpx.Response]], attempts: int = 5) -> Optional[httpx.Response]:
+        """Gửi request dọn dẹp, chờ theo Retry-After khi bị giới hạn (429/503)"""
+        response = None
+        for _ in range(attempts):
+            try:
+                response = await call()
+            except httpx.HTTPError:
+                return None
+            if response.status_code not in (429, 503):
+                return response
+            await asyncio.sleep(float(response.headers.get("retry-after", "1")))
+        return response
+
+    async def cleanup(self, client: httpx.AsyncClient):
+        """Xóa mọi hình LT<mã lần chạy>-<n> đã upload (tìm lại theo số phiếu, xóa qua /picture/delete)"""
+        deleted = failed = 0
+        for ticket, picture_type in self.uploaded:
+            response = await self._send(lambda: client.get("/picture/list", params={
+                "ticket_number": ticket, "date": self.today, "picture_type": picture_type
+            }))
+            if response is None or response.status_code != 200:
+                failed += 1
+                continue
+            for picture in response.json().get("pictures", []):
+                if picture["ticket_number"] != ticket:
+                    continue
+                response = await self._send(lambda: client.delete("/picture/delete", params={"file_path": picture["file_path"]}))
+                if response is not None and response.status_code in (200, 404):
+                    deleted += 1
+                else:
+                    failed += 1
+        print(f"🧹 Đã xóa {deleted} hình của {len(self.uploaded)} phiếu LT{self.run_id}-*" + (f", {failed} lỗi" if failed else ""), file=sys.stderr)
+
+    async def progress(self, started: float, deadline: float):
+        while time.monotonic() < deadline:
+            await asyncio.sleep(10)
+            total = sum(len(stats.latencies) for stats in self.stats.values())
+            errors = sum(stats.errors for stats in self.stats.values())
+            print(f"⏱️ {time.monotonic() - started:5.0f}s  {total} request, {errors} lỗi, {self.in_flight} đang chờ", file=sys.stderr)
+
+
+def report(load_test: LoadTest, duration: float, slos: Dict[str, dict]) -> dict:
+    routes = {route: stats.summary(duration, slos.get(route)) for route, stats in sorted(load_test.stats.items())}
+    print(f"\n{'route':<18} {'count':>7} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'lỗi %':>7}  SLO")
+    for route, result in routes.items():
+        verdict = "—" if "slo_ok" not in result else ("✅" if result["slo_ok"] else "❌ " + "; ".join(result["violations"]))
+        print(
+            f"{route:<18} {result['count']:>7} {result['rps']:>7.1f} {result['p50']:>8.1f} {result['p95']:>8.1f}"
+            f" {result['p99']:>8.1f} {result['max']:>8.1f} {result['error_rate']:>7.2f}  {verdict}"
+        )
+    return {
+        "run_id": load_test.run_id,
+        "duration": round(duration, 1),
+        "max_in_flight": load_test.max_in_flight,
+        "dropped": sum(stats.dropped for stats in load_test.stats.values()),
+        "config": {name: value for name, value in vars(load_test.args).items() if name not in ("password", "slo", "output")},
+        "routes": routes,
+        "slo_ok": all(result.get("slo_ok", True) for result in routes.values())
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test mô phỏng một ngày làm việc của trạm cân")
+    parser.add_argument("--base-url", default=os.getenv("LOADTEST_BASE_URL", "http://localhost:8000"))
+    parser.add_argument("--duration", type=float, default=300, help="Thời gian chạy (giây)")
+    parser.add_argument("--stations", type=int, default=2, help="Số trạm cân")
+    parser.add_argument("--realtime-hz", type=float, default=5, help="Số lần POST /realtime/update mỗi giây của mỗi trạm")
+    parser.add_argument("--weighing-interval", type=float, default=45, help="Số giây giữa hai lần cân (3 hình upload) của mỗi trạm")
+    parser.add_argument("--no-uploads", action="store_true", help="Không upload hình (không ghi file lên server)")
+    parser.add_argument("--cleanup", action="store_true", help="Sau khi test xóa các hình đã upload (qua /picture/delete)")
+    parser.add_argument("--picture-bytes", type=int, default=150000, help="Kích thước mỗi hình upload")
+    parser.add_argument("--dashboards", type=int, default=5, help="Số dashboard đang mở")
+    parser.add_argument("--dashboard-interval", type=float, default=10, help="Chu kỳ tải /logistics/all của dashboard (giây)")
+    parser.add_argument("--dashboard-days", type=int, default=30, help="Dashboard xem dữ liệu bao nhiêu ngày gần nhất")
+    parser.add_argument("--realtime-poll-interval", type=float, default=1, help="Chu kỳ GET /realtime/data của dashboard (giây)")
+    parser.add_argument("--mobiles", type=int, default=10, help="Số client mobile xem hình")
+    parser.add_argument("--mobile-interval", type=float, default=15, help="Chu kỳ xem hình của mỗi client mobile (giây)")
+    parser.add_argument("--username", help="Đăng nhập để lấy access token (khi AUTH_REQUIRED=true)")
+    parser.add_argument("--password", default=os.getenv("LOADTEST_PASSWORD"))
+    parser.add_argument("--timeout", type=float, default=30, help="Timeout mỗi request (giây)")
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--max-in-flight", type=int, default=2000, help="Bỏ lượt gửi khi số request đang chờ vượt mức này")
+    parser.add_argument("--forwarded-for", action="store_true", help="Gửi X-Forwarded-For khác nhau cho mỗi client giả lập (server đặt RATE_LIMIT_TRUST_PROXY=true)")
+    parser.add_argument("--slo", action="append", help="Ghi đè SLO: route=p95:800,p99:2000,error_rate:1 (lặp lại cho nhiều route)")
+    parser.add_argument("--output", help="Ghi kết quả JSON")
+    args = parser.parse_args()
+
+    slos = parse_slo(args.slo)
+    load_test = LoadTest(args)
+    print(f"🚚 Load test {args.base_url} trong {args.duration:.0f}s (mã lần chạy {load_test.run_id})", file=sys.stderr)
+    duration = asyncio.run(load_test.run())
+    result = report(load_test, duration, slos)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    sys.exit(0 if result["slo_ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,54 +1,183 @@
-from fastapi import FastAPI, HTTPException, Depends, Query, UploadFile, File
+from fastapi import FastAPI, HTTPException, Depends, Query, UploadFile, File, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import TypeAdapter
 from sqlalchemy.orm import Session
-from sqlalchemy import text, Column
 from typing import List, Dict, Optional, Union
 import uvicorn
-from datetime import datetime
+from datetime import datetime, date
 import os
 import pathlib
 from dotenv import load_dotenv
-import re
-import mimetypes
-from io import BytesIO
+import hmac
+import time
 
 # Load environment variables
 load_dotenv()
 
-from database import get_db, create_tables, User as DBUser, Nhapkho, Xuatkho, Canthue, Nhaptau, Loaihang, Khachhang, Xe, Camera
+from database import engine, get_db, create_tables, SessionLocal, User as DBUser, Nhapkho, Xuatkho, Canthue, Nhaptau, Loaihang, Khachhang, Xe, Camera, TICKET_MODELS, ARCHIVE_MODELS
 from schemas import (
     UserResponse, NhapkhoResponse, NhaptauResponse, XuatkhoResponse, 
     CanthueResponse, LoaihangResponse, KhachhangResponse, XeResponse, CameraResponse,
     RealtimeDataRequest, RealtimeDataResponse, RealtimeUpdateResponse,
     PictureUploadRequest, PictureUploadResponse, PictureListRequest, 
-    PictureListResponse, PictureInfo
+    PictureListResponse, PictureInfo, TicketQueryParams
 )
 
-# Biến toàn cục để lưu trữ dữ liệu realtime
-realtime_data = {
-    "WeightValue": "0.00",
-    "StatusCam1": "Offline",
-    "StatusCam2": "Offline", 
-    "StatusCam3": "Offline",
-    "timestamp": datetime.now().isoformat()
-}
+from realtime import create_realtime_hub
 
-# Hàm tiện ích để tạo điều kiện lọc tiếng Việt
-def vietnamese_filter(column: Column, value: str):
+# Lưu trữ dữ liệu realtime và tín hiệu cân ổn định
+realtime_hub = create_realtime_hub()
+
+# Khoảng thời gian gửi keep-alive cho client stream (giây)
+REALTIME_STREAM_KEEPALIVE = 15
+
+from master_cache import create_master_cache
+
+# Cache trong bộ nhớ cho các bảng danh mục
+master_cache = create_master_cache()
+master_cache.register("loaihang", Loaihang, ["mahang", "tenhang"])
+master_cache.register("khachhang", Khachhang, ["makhachhang", "tenkhachhang", "loaihang"])
+master_cache.register("xe", Xe, ["blenso_xe", "tenkhachhang_xe", "loaihang_xe", "laixe_xe"])
+master_cache.register("camera", Camera, ["IPAddrees", "UseName", "Port"])
+
+from suggest import SuggestService, SUGGEST_ENTITIES
+
+# Chỉ mục gợi ý (autocomplete) dựng trên cache danh mục
+suggest_service = SuggestService(master_cache)
+
+from change_token import create_change_tokens, not_modified, validator_headers
+
+# Token thay đổi của các bảng phiếu cho ETag/Last-Modified
+change_tokens = create_change_tokens(TICKET_MODELS)
+
+from plate_index import create_plate_index
+
+# Chỉ mục biển số -> thông tin phiếu gần nhất và biển số -> số phiếu
+plate_index = create_plate_index(TICKET_MODELS, change_tokens)
+master_cache.add_listener(plate_index.on_master_reload)
+
+# Số phiếu tối đa lọc bằng IN (SQL Server giới hạn 2100 tham số mỗi câu lệnh)
+PLATE_INDEX_MAX_IN = 2000
+
+from archive import create_archive_manager
+
+# Lưu trữ phiếu của các kỳ đã đóng sang bảng <bảng>_archive
+archive_manager = create_archive_manager()
+archive_manager.add_listener(change_tokens.bump)
+
+from ticket_query import TicketQueryEngine
+
+# Bộ truy vấn chung cho 4 bảng phiếu cân
+ticket_engine = TicketQueryEngine(TICKET_MODELS, plate_index, PLATE_INDEX_MAX_IN, archive_manager)
+
+from ticket_sync import create_ticket_sync, InvalidSyncToken
+
+# Đồng bộ tăng dần phiếu thay đổi cho client giữ bản sao cục bộ
+ticket_sync = create_ticket_sync(TICKET_MODELS, ARCHIVE_MODELS, change_tokens)
+
+def admin_key_valid(x_admin_key: Optional[str]) -> bool:
+    """X-Admin-Key khớp ADMIN_API_KEY (chưa cấu hình ADMIN_API_KEY thì luôn sai)"""
+    admin_key = os.getenv("ADMIN_API_KEY")
+    return bool(admin_key and x_admin_key and hmac.compare_digest(x_admin_key, admin_key))
+
+def require_admin(x_admin_key: str = Header(None)):
+    """Dependency cho các API quản trị: header X-Admin-Key phải khớp ADMIN_API_KEY"""
+    if not admin_key_valid(x_admin_key):
+        raise HTTPException(status_code=403, detail="Không có quyền truy cập API quản trị")
+
+from result_cache import create_result_cache
+from serialization import MSGPACK_MEDIA_TYPES, pack_msgpack, wants_msgpack
+from compression import CompressionMiddleware, compress, compression_minimum_size, negotiate_encoding, weak_etag
+from metrics import MetricsMiddleware, MetricsRegistry, instrument_engine, metrics_enabled, record_serialization
+
+# Nén response lớn hơn COMPRESSION_MIN_SIZE bytes theo Accept-Encoding (gzip, br/zstd nếu đã cài)
+COMPRESSION_MIN_SIZE = compression_minimum_size()
+
+# Cache kết quả API danh sách phiếu (JSON đã serialize), hết hạn theo token thay đổi của bảng
+result_cache = create_result_cache()
+_response_adapters: Dict[object, TypeAdapter] = {}
+
+async def ticket_list_response(request: Request, db: Session, tables: List[str], params: TicketQueryParams, response_type, load, extra: str = "") -> Response:
     """
-    Tạo điều kiện lọc hỗ trợ tiếng Việt không phân biệt hoa thường và dấu
+    Response cho API danh sách phiếu:
+    - ETag/Last-Modified theo token thay đổi của các bảng, 304 nếu client đã có phiên bản hiện tại
+    - JSON (hoặc MessagePack) lấy từ result_cache, các request trùng nhau cùng lúc chỉ chạy load() một lần
+    Args:
+        response_type: Kiểu dữ liệu trả về (vd. List[NhapkhoResponse]) để serialize
+        load: Hàm đồng bộ load(session) truy vấn database, trả về dữ liệu theo response_type.
+              Chạy với session riêng: truy vấn có thể tiếp tục cho các request đang chờ sau khi request này kết thúc
     """
-    if not value:
-        return None
-    collate_clause = f"N'%{value}%'"
-    return text(f"{column.key} LIKE {collate_clause} COLLATE Vietnamese_CI_AI")
+    # MessagePack nếu client gửi Accept: application/msgpack (ETag, cache riêng cho mỗi định dạng)
+    use_msgpack = wants_msgpack(request.headers.get("accept"))
+    query = params.model_dump_json() + extra + ("|msgpack" if use_msgpack else "")
+    # Token chỉ xét các phiếu từ tu_ngay: dashboard xem N ngày gần nhất không quét cả bảng
+    etag, last_modified = await run_in_threadpool(change_tokens.validators, db, request.url.path, tables, query, params.tu_ngay)
+    headers = validator_headers(etag, last_modified)
+    headers["Vary"] = "Accept"
+    if not_modified(request.headers, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    adapter = _response_adapters.get(response_type)
+    if adapter is None:
+        adapter = _response_adapters[response_type] = TypeAdapter(response_type)
+
+    def serialize() -> bytes:
+        with SessionLocal() as session:
+            data = load(session)
+            started = time.perf_counter()
+            try:
+                if use_msgpack:
+                    return pack_msgpack(data, response_type)
+                return adapter.dump_json(adapter.validate_python(data, from_attributes=True))
+            finally:
+                record_serialization(time.perf_counter() - started)
+
+    key = f"{request.url.path}|{query}"
+    body = await result_cache.get_or_compute(key, etag, serialize)
+
+    # Trả bản nén đã lưu trong cache (CompressionMiddleware bỏ qua response đã có Content-Encoding)
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    if encoding is not None and len(body) >= COMPRESSION_MIN_SIZE:
+        body = await result_cache.get_encoded(key, etag, body, encoding, compress)
+        headers.update({"Content-Encoding": encoding, "Vary": "Accept, Accept-Encoding", "ETag": weak_etag(etag)})
+    media_type = MSGPACK_MEDIA_TYPES[0] if use_msgpack else "application/json"
+    return Response(content=body, media_type=media_type, headers=headers)
+
+def ticket_query_params(
+    tu_ngay: date = None,        # Từ ngày (format: YYYY-MM-DD)
+    den_ngay: date = None,       # Đến ngày (format: YYYY-MM-DD)
+    khachhang: str = None,       # Lọc theo tên khách hàng
+    sophieu: str = None,         # Lọc theo số phiếu
+    bienso: str = None,          # Lọc theo biển số xe
+    bienso_exact: bool = False,  # Khớp chính xác biển số (mặc định khớp tiền tố)
+    loaihang: str = None,        # Lọc theo loại hàng
+    include_deleted: bool = False,  # Lấy cả phiếu đã xóa
+    limit: int = None,           # Giới hạn số records trả về
+    offset: int = 0              # Vị trí bắt đầu lấy dữ liệu
+) -> TicketQueryParams:
+    """Dependency gom các tham số lọc chung của các API phiếu cân"""
+    return TicketQueryParams(
+        tu_ngay=tu_ngay,
+        den_ngay=den_ngay,
+        khachhang=khachhang,
+        sophieu=sophieu,
+        bienso=bienso,
+        bienso_exact=bienso_exact,
+        loaihang=loaihang,
+        include_deleted=include_deleted,
+        limit=limit,
+        offset=offset
+    )
+
 from schemas import (
-    LoginRequest, LoginResponse, UserResponse, 
+    LoginRequest, LoginResponse, LogoutResponse, UserResponse, 
     ChangePasswordRequest, ChangePasswordResponse,
     RealtimeDataRequest, RealtimeDataResponse, RealtimeUpdateResponse,
     NhapkhoResponse, XuatkhoResponse, CanthueResponse, NhaptauResponse, 
-    LogisticsDataResponse, LoaihangResponse, KhachhangResponse, XeResponse
+    LogisticsDataResponse, LoaihangResponse, KhachhangResponse, XeResponse,
+    SuggestItem, SuggestResponse, XeProfileResponse, SyncTicketsResponse
 )
 
 # Tạo ứng dụng FastAPI
@@ -62,6 +191,57 @@ app = FastAPI(
 # Tạo bảng khi khởi động
 create_tables()
 
+# Áp dụng migration (index...) khi khởi động
+if os.getenv("RUN_MIGRATIONS_ON_STARTUP", "true").lower() == "true":
+    from migrations import run_migrations
+    run_migrations()
+
+from passwords import PasswordHasherBusy, create_password_hasher
+
+# Hash mật khẩu (scrypt) trong pool thread riêng có giới hạn hàng đợi
+password_hasher = create_password_hasher()
+
+def password_busy_error(e: PasswordHasherBusy) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "2"})
+
+@app.on_event("shutdown")
+def shutdown_password_hasher():
+    password_hasher.shutdown()
+
+from rate_limit import RateLimitMiddleware, create_rate_limiter, retry_after
+
+# Giới hạn request theo client và nhóm route (đặt trong auth để dùng user của token làm khóa client)
+rate_limiter = create_rate_limiter()
+rate_limit_enabled = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+
+def check_login_rate(iduser: str):
+    """Giới hạn số lần đăng nhập của từng tài khoản (chống dò mật khẩu không phụ thuộc IP)"""
+    if not rate_limit_enabled:
+        return
+    wait = rate_limiter.take_login(iduser)
+    if wait > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Đăng nhập quá nhiều lần, vui lòng thử lại sau",
+            headers={"Retry-After": retry_after(wait)}
+        )
+
+if rate_limit_enabled:
+    app.add_middleware(
+        RateLimitMiddleware,
+        limiter=rate_limiter,
+        trust_proxy=os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+    )
+
+from auth_tokens import TokenAuthMiddleware, InvalidToken, auth_public_prefixes, bearer_token, create_token_authority
+
+# Access token không trạng thái cấp khi đăng nhập
+token_authority = create_token_authority()
+
+# Bắt buộc token cho các API (trừ AUTH_PUBLIC_PATHS) khi AUTH_REQUIRED=true
+if os.getenv("AUTH_REQUIRED", "false").lower() == "true":
+    app.add_middleware(TokenAuthMiddleware, authority=token_authority, public_prefixes=auth_public_prefixes())
+
 # Cấu hình CORS
 app.add_middleware(
     CORSMiddleware,
@@ -71,18 +251,46 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Nén response API (webAPP có file nén sẵn riêng)
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+
+# Số liệu theo route (ngoài cùng để đo cả thời gian nén và request bị từ chối), xuất ra /metrics
+metrics_registry = MetricsRegistry()
+if metrics_enabled():
+    instrument_engine(engine)
+    app.add_middleware(MetricsMiddleware, registry=metrics_registry, router=app.router)
+
+from profiler import ProfilerBusy, ProfilerMiddleware, create_profiler, format_collapsed
+
+# Profile từng request khi có header X-Profile: 1 kèm X-Admin-Key (ngoài cùng để thấy cả thời gian của các middleware)
+profiler = create_profiler()
+app.add_middleware(
+    ProfilerMiddleware,
+    profiler=profiler,
+    authorize=lambda headers: admin_key_valid(headers.get(b"x-admin-key", b"").decode("latin-1"))
+)
+
+from sql_trace import create_sql_tracer
+
+# Thống kê/slow-query log của từng câu SQL theo route và bảng (route lấy từ MetricsMiddleware)
+sql_tracer = create_sql_tracer(engine)
+if os.getenv("SQL_TRACE_ENABLED", "true").lower() == "true":
+    sql_tracer.install()
+
 # Mount static files for Flutter webAPP
-from fastapi.staticfiles import StaticFiles
 import pathlib
 
+from static_assets import create_webapp_static_files
+
 webapp_path = pathlib.Path(__file__).parent.parent / "webAPP"
-app.mount("/webapp", StaticFiles(directory=str(webapp_path), html=True), name="webapp")
+app.mount("/webapp", create_webapp_static_files(webapp_path), name="webapp")
 
 
 # API login - DUY NHẤT ĐƯỢC GIỮ LẠI
 @app.post("/auth/login", response_model=LoginResponse)
 async def login_user(login_data: LoginRequest, db: Session = Depends(get_db)):
     """API đăng nhập user"""
+    check_login_rate(login_data.iduser)
     try:
         # Tìm user theo iduser
         user = db.query(DBUser).filter(DBUser.iduser == login_data.iduser).first()
@@ -94,15 +302,22 @@ async def login_user(login_data: LoginRequest, db: Session = Depends(get_db)):
                 user_info=None
             )
         
-        # Kiểm tra password (trong thực tế nên hash password)
-        if user.password != login_data.password:
+        # Kiểm tra password (scrypt, hoặc mật khẩu text cũ)
+        valid, needs_upgrade = await password_hasher.verify(login_data.password, user.password)
+        if not valid:
             return LoginResponse(
                 success=False,
                 message="Mật khẩu không đúng",
                 user_info=None
             )
         
-        # Đăng nhập thành công
+        # Mật khẩu text cũ (hoặc tham số hash cũ): lưu lại dạng hash mới
+        if needs_upgrade:
+            user.password = await password_hasher.hash(login_data.password)
+            db.commit()
+        
+        # Đăng nhập thành công, cấp access token
+        access_token, expires_in = token_authority.issue(user.iduser)
         return LoginResponse(
             success=True,
             message="Đăng nhập thành công",
@@ -110,17 +325,40 @@ async def login_user(login_data: LoginRequest, db: Session = Depends(get_db)):
                 iduser=user.iduser,
                 ten=user.ten,
                 password=None  # Không trả về password khi đăng nhập thành công
-            )
+            ),
+            access_token=access_token,
+            token_type="bearer",
+            expires_in=expires_in
         )
         
+    except PasswordHasherBusy as e:
+        raise password_busy_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi đăng nhập: {str(e)}")
 
+# API đăng xuất
+@app.post("/auth/logout", response_model=LogoutResponse)
+async def logout_user(authorization: str = Header(None)):
+    """API đăng xuất: thu hồi access token gửi trong header Authorization"""
+    token = bearer_token(authorization)
+    if token is None:
+        return LogoutResponse(success=False, message="Thiếu access token")
+    try:
+        token_authority.revoke(token_authority.verify(token))
+    except InvalidToken as e:
+        return LogoutResponse(success=False, message=str(e))
+    return LogoutResponse(success=True, message="Đăng xuất thành công")
+
 # API đổi mật khẩu
 @app.post("/auth/change-password", response_model=ChangePasswordResponse)
-async def change_password(change_data: ChangePasswordRequest, db: Session = Depends(get_db)):
-    """API đổi mật khẩu cho user"""
+async def change_password(change_data: ChangePasswordRequest, request: Request, db: Session = Depends(get_db)):
+    """API đổi mật khẩu cho user, các access token đã cấp cho user bị thu hồi"""
     try:
+        # Khi bắt buộc đăng nhập, chỉ được đổi mật khẩu của chính mình
+        token_user = getattr(request.state, "user", None)
+        if token_user is not None and token_user["sub"] != change_data.iduser:
+            raise HTTPException(status_code=403, detail="Không được đổi mật khẩu của người dùng khác")
+        
         # Tìm user theo iduser
         user = db.query(DBUser).filter(DBUser.iduser == change_data.iduser).first()
         
@@ -131,15 +369,17 @@ async def change_password(change_data: ChangePasswordRequest, db: Session = Depe
             )
         
         # Kiểm tra mật khẩu hiện tại
-        if user.password != change_data.current_password:
+        valid, _ = await password_hasher.verify(change_data.current_password, user.password)
+        if not valid:
             return ChangePasswordResponse(
                 success=False,
                 message="Mật khẩu hiện tại không đúng"
             )
         
         # Cập nhật mật khẩu mới
-        user.password = change_data.new_password
+        user.password = await password_hasher.hash(change_data.new_password)
         db.commit()
+        token_authority.revoke_user(user.iduser)
         
         # Trả về kết quả thành công
         return ChangePasswordResponse(
@@ -147,6 +387,10 @@ async def change_password(change_data: ChangePasswordRequest, db: Session = Depe
             message="Đổi mật khẩu thành công"
         )
         
+    except HTTPException:
+        raise
+    except PasswordHasherBusy as e:
+        raise password_busy_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi đổi mật khẩu: {str(e)}")
 
@@ -154,17 +398,14 @@ async def change_password(change_data: ChangePasswordRequest, db: Session = Depe
 @app.post("/realtime/update", response_model=RealtimeUpdateResponse)
 async def update_realtime_data(data: RealtimeDataRequest):
     """API để VB App gửi dữ liệu realtime lên server"""
-    global realtime_data
     try:
-        # Cập nhật dữ liệu realtime
-        current_time = datetime.now().isoformat()
-        realtime_data = {
-            "WeightValue": data.WeightValue,
-            "StatusCam1": data.StatusCam1,
-            "StatusCam2": data.StatusCam2,
-            "StatusCam3": data.StatusCam3,
-            "timestamp": current_time
-        }
+        # Cập nhật dữ liệu realtime và tín hiệu ổn định
+        current_time = realtime_hub.publish(
+            data.WeightValue,
+            data.StatusCam1,
+            data.StatusCam2,
+            data.StatusCam3
+        )
         
         return RealtimeUpdateResponse(
             success=True,
@@ -179,31 +420,44 @@ async def update_realtime_data(data: RealtimeDataRequest):
 @app.get("/realtime/data", response_model=RealtimeDataResponse)
 async def get_realtime_data():
     """API để Mobile App lấy dữ liệu realtime từ server"""
-    global realtime_data
     try:
-        return RealtimeDataResponse(
-            WeightValue=realtime_data["WeightValue"],
-            StatusCam1=realtime_data["StatusCam1"],
-            StatusCam2=realtime_data["StatusCam2"],
-            StatusCam3=realtime_data["StatusCam3"],
-            timestamp=realtime_data["timestamp"]
-        )
+        return RealtimeDataResponse(**realtime_hub.snapshot())
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi lấy dữ liệu realtime: {str(e)}")
 
+# API stream dữ liệu realtime (Server-Sent Events)
+@app.get("/realtime/stream")
+async def stream_realtime_data():
+    """
+    Đẩy dữ liệu realtime tới client mỗi khi VB App cập nhật (Server-Sent Events).
+    Mỗi event là một RealtimeDataResponse dạng JSON, bao gồm stable, stable_since và settled_weight.
+    
+    Examples:
+    - const source = new EventSource("/realtime/stream")
+    """
+    async def event_generator():
+        # Gửi dữ liệu hiện tại ngay khi client kết nối
+        yield f"data: {RealtimeDataResponse(**realtime_hub.snapshot()).model_dump_json()}\n\n"
+        while True:
+            if await realtime_hub.wait_for_update(REALTIME_STREAM_KEEPALIVE):
+                yield f"data: {RealtimeDataResponse(**realtime_hub.snapshot()).model_dump_json()}\n\n"
+            else:
+                # Giữ kết nối qua proxy khi không có dữ liệu mới
+                yield ": keep-alive\n\n"
+    
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # API để get dữ liệu từ table nhapkho với điều kiện lọc theo ngày
 @app.get("/nhapkho", response_model=List[NhapkhoResponse])
 async def get_nhapkho(
+    request: Request,
     db: Session = Depends(get_db),
-    tu_ngay: str = None,     # Từ ngày (format: YYYY-MM-DD)
-    den_ngay: str = None,    # Đến ngày (format: YYYY-MM-DD)
-    khachhang: str = None,   # Lọc theo tên khách hàng
-    sophieu: str = None,     # Lọc theo số phiếu
-    bienso: str = None,      # Lọc theo biển số xe
-    loaihang: str = None,    # Lọc theo loại hàng
-    limit: int = None,       # Giới hạn số records trả về
-    offset: int = 0          # Vị trí bắt đầu lấy dữ liệu
+    params: TicketQueryParams = Depends(ticket_query_params)
 ):
     """
     Lấy dữ liệu từ bảng nhapkho với các điều kiện lọc
@@ -213,8 +467,10 @@ async def get_nhapkho(
     - den_ngay: Đến ngày (YYYY-MM-DD), ví dụ: 2024-01-31
     - khachhang: Tìm theo tên khách hàng (contains)
     - sophieu: Tìm theo số phiếu (contains)
-    - bienso: Tìm theo biển số xe (contains)
+    - bienso: Tìm theo biển số xe trên cả 4 cột biển số (tiền tố, bỏ qua khoảng trắng, "-" và ".")
+    - bienso_exact: true để khớp chính xác biển số
     - loaihang: Tìm theo loại hàng (contains)
+    - include_deleted: true để lấy cả phiếu đã xóa (mặc định chỉ trả về phiếu chưa xóa)
     - limit: Giới hạn số lượng records trả về
     
     Examples:
@@ -224,62 +480,22 @@ async def get_nhapkho(
     - /nhapkho?tu_ngay=2024-01-01&den_ngay=2024-01-31&khachhang=ABC&bienso=51D&loaihang=Gạo&limit=10
     """
     try:
-        # Bắt đầu với query cơ bản
-        query = db.query(Nhapkho)
-        
-        # Lọc theo khoảng thời gian
-        if tu_ngay:
-            query = query.filter(Nhapkho.ngaycan >= tu_ngay)
-        
-        if den_ngay:
-            query = query.filter(Nhapkho.ngaycan <= den_ngay)
-            
-        # Lọc theo khách hàng (hỗ trợ tiếng Việt đầy đủ)
-        if khachhang:
-            query = query.filter(vietnamese_filter(Nhapkho.khachhang, khachhang))
-            
-        # Lọc theo số phiếu
-        if sophieu:
-            query = query.filter(Nhapkho.sophieu.contains(sophieu))
-            
-        # Lọc theo biển số xe (chỉ kiểm tra trường bienso1_1)
-        if bienso:
-            query = query.filter(vietnamese_filter(Nhapkho.bienso1_1, bienso))
-            
-        # Lọc theo loại hàng (hỗ trợ tiếng Việt đầy đủ)
-        if loaihang:
-            query = query.filter(vietnamese_filter(Nhapkho.loaihang, loaihang))
-        
-        # Sắp xếp theo ngày cân (mới nhất trước)
-        query = query.order_by(Nhapkho.ngaycan.desc())
-        
-        # Thêm offset để bỏ qua một số lượng bản ghi từ đầu
-        if offset and offset > 0:
-            query = query.offset(offset)
-            
-        # Giới hạn số lượng nếu có
-        if limit and limit > 0:
-            query = query.limit(limit)
-            
-        # Thực hiện query
-        results = query.all()
-        return results
+        return await ticket_list_response(
+            request, db, ["nhapkho"], params, List[NhapkhoResponse],
+            lambda session: ticket_engine.execute(session, "nhapkho", params)
+        )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi lấy dữ liệu nhapkho: {str(e)}")
 
 # API để get dữ liệu từ table xuatkho với điều kiện lọc theo ngày
 @app.get("/xuatkho", response_model=List[XuatkhoResponse])
 async def get_xuatkho(
+    request: Request,
     db: Session = Depends(get_db),
-    tu_ngay: str = None,     # Từ ngày (format: YYYY-MM-DD)
-    den_ngay: str = None,    # Đến ngày (format: YYYY-MM-DD)
-    khachhang: str = None,   # Lọc theo tên khách hàng
-    sophieu: str = None,     # Lọc theo số phiếu
-    bienso: str = None,      # Lọc theo biển số xe
-    loaihang: str = None,    # Lọc theo loại hàng
-    limit: int = None,       # Giới hạn số records trả về
-    offset: int = 0          # Vị trí bắt đầu lấy dữ liệu
+    params: TicketQueryParams = Depends(ticket_query_params)
 ):
     """
     Lấy dữ liệu từ bảng xuatkho với các điều kiện lọc
@@ -289,8 +505,10 @@ async def get_xuatkho(
     - den_ngay: Đến ngày (YYYY-MM-DD), ví dụ: 2024-01-31
     - khachhang: Tìm theo tên khách hàng (contains)
     - sophieu: Tìm theo số phiếu (contains)
-    - bienso: Tìm theo biển số xe (contains)
+    - bienso: Tìm theo biển số xe trên cả 4 cột biển số (tiền tố, bỏ qua khoảng trắng, "-" và ".")
+    - bienso_exact: true để khớp chính xác biển số
     - loaihang: Tìm theo loại hàng (contains)
+    - include_deleted: true để lấy cả phiếu đã xóa (mặc định chỉ trả về phiếu chưa xóa)
     - limit: Giới hạn số lượng records trả về
     
     Examples:
@@ -300,62 +518,22 @@ async def get_xuatkho(
     - /xuatkho?tu_ngay=2024-01-01&den_ngay=2024-01-31&khachhang=ABC&bienso=51D&loaihang=Gạo&limit=10
     """
     try:
-        # Bắt đầu với query cơ bản
-        query = db.query(Xuatkho)
-        
-        # Lọc theo khoảng thời gian
-        if tu_ngay:
-            query = query.filter(Xuatkho.ngaycan >= tu_ngay)
-        
-        if den_ngay:
-            query = query.filter(Xuatkho.ngaycan <= den_ngay)
-            
-        # Lọc theo khách hàng (hỗ trợ tiếng Việt đầy đủ)
-        if khachhang:
-            query = query.filter(vietnamese_filter(Xuatkho.khachhang, khachhang))
-            
-        # Lọc theo số phiếu
-        if sophieu:
-            query = query.filter(Xuatkho.sophieu.contains(sophieu))
-            
-        # Lọc theo biển số xe (chỉ kiểm tra trường bienso1_1)
-        if bienso:
-            query = query.filter(vietnamese_filter(Xuatkho.bienso1_1, bienso))
-            
-        # Lọc theo loại hàng (hỗ trợ tiếng Việt đầy đủ)
-        if loaihang:
-            query = query.filter(vietnamese_filter(Xuatkho.loaihang, loaihang))
-        
-        # Sắp xếp theo ngày cân (mới nhất trước)
-        query = query.order_by(Xuatkho.ngaycan.desc())
-        
-        # Thêm offset để bỏ qua một số lượng bản ghi từ đầu
-        if offset and offset > 0:
-            query = query.offset(offset)
-            
-        # Giới hạn số lượng nếu có
-        if limit and limit > 0:
-            query = query.limit(limit)
-            
-        # Thực hiện query
-        results = query.all()
-        return results
+        return await ticket_list_response(
+            request, db, ["xuatkho"], params, List[XuatkhoResponse],
+            lambda session: ticket_engine.execute(session, "xuatkho", params)
+        )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi lấy dữ liệu xuatkho: {str(e)}")
 
 # API để get dữ liệu từ table canthue với điều kiện lọc theo ngày
 @app.get("/canthue", response_model=List[CanthueResponse])
 async def get_canthue(
+    request: Request,
     db: Session = Depends(get_db),
-    tu_ngay: str = None,     # Từ ngày (format: YYYY-MM-DD)
-    den_ngay: str = None,    # Đến ngày (format: YYYY-MM-DD)
-    khachhang: str = None,   # Lọc theo tên khách hàng
-    sophieu: str = None,     # Lọc theo số phiếu
-    bienso: str = None,      # Lọc theo biển số xe
-    loaihang: str = None,    # Lọc theo loại hàng
-    limit: int = None,       # Giới hạn số records trả về
-    offset: int = 0          # Vị trí bắt đầu lấy dữ liệu
+    params: TicketQueryParams = Depends(ticket_query_params)
 ):
     """
     Lấy dữ liệu từ bảng canthue với các điều kiện lọc
@@ -365,8 +543,10 @@ async def get_canthue(
     - den_ngay: Đến ngày (YYYY-MM-DD), ví dụ: 2024-01-31
     - khachhang: Tìm theo tên khách hàng (contains)
     - sophieu: Tìm theo số phiếu (contains)
-    - bienso: Tìm theo biển số xe (contains)
+    - bienso: Tìm theo biển số xe trên cả 4 cột biển số (tiền tố, bỏ qua khoảng trắng, "-" và ".")
+    - bienso_exact: true để khớp chính xác biển số
     - loaihang: Tìm theo loại hàng (contains)
+    - include_deleted: true để lấy cả phiếu đã xóa (mặc định chỉ trả về phiếu chưa xóa)
     - limit: Giới hạn số lượng records trả về
     
     Examples:
@@ -376,62 +556,22 @@ async def get_canthue(
     - /canthue?tu_ngay=2024-01-01&den_ngay=2024-01-31&khachhang=ABC&bienso=51D&loaihang=Gạo&limit=10
     """
     try:
-        # Bắt đầu với query cơ bản
-        query = db.query(Canthue)
-        
-        # Lọc theo khoảng thời gian
-        if tu_ngay:
-            query = query.filter(Canthue.ngaycan >= tu_ngay)
-        
-        if den_ngay:
-            query = query.filter(Canthue.ngaycan <= den_ngay)
-            
-        # Lọc theo khách hàng (hỗ trợ tiếng Việt đầy đủ)
-        if khachhang:
-            query = query.filter(vietnamese_filter(Canthue.khachhang, khachhang))
-            
-        # Lọc theo số phiếu
-        if sophieu:
-            query = query.filter(Canthue.sophieu.contains(sophieu))
-            
-        # Lọc theo biển số xe (chỉ kiểm tra trường bienso1_1)
-        if bienso:
-            query = query.filter(vietnamese_filter(Canthue.bienso1_1, bienso))
-            
-        # Lọc theo loại hàng (hỗ trợ tiếng Việt đầy đủ)
-        if loaihang:
-            query = query.filter(vietnamese_filter(Canthue.loaihang, loaihang))
-        
-        # Sắp xếp theo ngày cân (mới nhất trước)
-        query = query.order_by(Canthue.ngaycan.desc())
-        
-        # Thêm offset để bỏ qua một số lượng bản ghi từ đầu
-        if offset and offset > 0:
-            query = query.offset(offset)
-            
-        # Giới hạn số lượng nếu có
-        if limit and limit > 0:
-            query = query.limit(limit)
-            
-        # Thực hiện query
-        results = query.all()
-        return results
+        return await ticket_list_response(
+            request, db, ["canthue"], params, List[CanthueResponse],
+            lambda session: ticket_engine.execute(session, "canthue", params)
+        )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi lấy dữ liệu canthue: {str(e)}")
 
 # API để get dữ liệu từ table nhaptau với điều kiện lọc theo ngày
 @app.get("/nhaptau", response_model=List[NhaptauResponse])
 async def get_nhaptau(
+    request: Request,
     db: Session = Depends(get_db),
-    tu_ngay: str = None,     # Từ ngày (format: YYYY-MM-DD)
-    den_ngay: str = None,    # Đến ngày (format: YYYY-MM-DD)
-    khachhang: str = None,   # Lọc theo tên khách hàng
-    sophieu: str = None,     # Lọc theo số phiếu
-    bienso: str = None,      # Lọc theo biển số xe
-    loaihang: str = None,    # Lọc theo loại hàng
-    limit: int = None,       # Giới hạn số records trả về
-    offset: int = 0          # Vị trí bắt đầu lấy dữ liệu
+    params: TicketQueryParams = Depends(ticket_query_params)
 ):
     """
     Lấy dữ liệu từ bảng nhaptau với các điều kiện lọc
@@ -441,8 +581,10 @@ async def get_nhaptau(
     - den_ngay: Đến ngày (YYYY-MM-DD), ví dụ: 2024-01-31
     - khachhang: Tìm theo tên khách hàng (contains)
     - sophieu: Tìm theo số phiếu (contains)
-    - bienso: Tìm theo biển số xe (contains)
+    - bienso: Tìm theo biển số xe trên cả 4 cột biển số (tiền tố, bỏ qua khoảng trắng, "-" và ".")
+    - bienso_exact: true để khớp chính xác biển số
     - loaihang: Tìm theo loại hàng (contains)
+    - include_deleted: true để lấy cả phiếu đã xóa (mặc định chỉ trả về phiếu chưa xóa)
     - limit: Giới hạn số lượng records trả về
     
     Examples:
@@ -452,62 +594,22 @@ async def get_nhaptau(
     - /nhaptau?tu_ngay=2024-01-01&den_ngay=2024-01-31&khachhang=ABC&bienso=51D&loaihang=Gạo&limit=10
     """
     try:
-        # Bắt đầu với query cơ bản
-        query = db.query(Nhaptau)
-        
-        # Lọc theo khoảng thời gian
-        if tu_ngay:
-            query = query.filter(Nhaptau.ngaycan >= tu_ngay)
-        
-        if den_ngay:
-            query = query.filter(Nhaptau.ngaycan <= den_ngay)
-            
-        # Lọc theo khách hàng (hỗ trợ tiếng Việt đầy đủ)
-        if khachhang:
-            query = query.filter(vietnamese_filter(Nhaptau.khachhang, khachhang))
-            
-        # Lọc theo số phiếu
-        if sophieu:
-            query = query.filter(Nhaptau.sophieu.contains(sophieu))
-            
-        # Lọc theo biển số xe (chỉ kiểm tra trường bienso1_1)
-        if bienso:
-            query = query.filter(vietnamese_filter(Nhaptau.bienso1_1, bienso))
-            
-        # Lọc theo loại hàng (hỗ trợ tiếng Việt đầy đủ)
-        if loaihang:
-            query = query.filter(vietnamese_filter(Nhaptau.loaihang, loaihang))
-        
-        # Sắp xếp theo ngày cân (mới nhất trước)
-        query = query.order_by(Nhaptau.ngaycan.desc())
-        
-        # Thêm offset để bỏ qua một số lượng bản ghi từ đầu
-        if offset and offset > 0:
-            query = query.offset(offset)
-            
-        # Giới hạn số lượng nếu có
-        if limit and limit > 0:
-            query = query.limit(limit)
-            
-        # Thực hiện query
-        results = query.all()
-        return results
+        return await ticket_list_response(
+            request, db, ["nhaptau"], params, List[NhaptauResponse],
+            lambda session: ticket_engine.execute(session, "nhaptau", params)
+        )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi lấy dữ liệu nhaptau: {str(e)}")
 
 # API tổng hợp dữ liệu từ 4 bảng: nhapkho, xuatkho, canthue, nhaptau
 @app.get("/logistics/all", response_model=LogisticsDataResponse)
 async def get_all_logistics_data(
+    request: Request,
     db: Session = Depends(get_db),
-    tu_ngay: str = None,     # Từ ngày (format: YYYY-MM-DD)
-    den_ngay: str = None,    # Đến ngày (format: YYYY-MM-DD)
-    khachhang: str = None,   # Lọc theo tên khách hàng
-    sophieu: str = None,     # Lọc theo số phiếu
-    bienso: str = None,      # Lọc theo biển số xe
-    loaihang: str = None,    # Lọc theo loại hàng
-    limit: int = None,       # Giới hạn số records trả về mỗi bảng
-    offset: int = 0,         # Vị trí bắt đầu lấy dữ liệu
+    params: TicketQueryParams = Depends(ticket_query_params),
     tables: str = None       # Chọn các bảng cụ thể, phân cách bởi dấu phẩy: "nhapkho,xuatkho,canthue,nhaptau"
 ):
     """
@@ -518,8 +620,10 @@ async def get_all_logistics_data(
     - den_ngay: Đến ngày (YYYY-MM-DD), ví dụ: 2024-01-31
     - khachhang: Tìm theo tên khách hàng (contains)
     - sophieu: Tìm theo số phiếu (contains)
-    - bienso: Tìm theo biển số xe (contains)
+    - bienso: Tìm theo biển số xe trên cả 4 cột biển số (tiền tố, bỏ qua khoảng trắng, "-" và ".")
+    - bienso_exact: true để khớp chính xác biển số
     - loaihang: Tìm theo loại hàng (contains)
+    - include_deleted: true để lấy cả phiếu đã xóa (mặc định chỉ trả về phiếu chưa xóa)
     - limit: Giới hạn số lượng records trả về mỗi bảng
     - tables: Chọn các bảng cụ thể, phân cách bởi dấu phẩy: "nhapkho,xuatkho,canthue,nhaptau"
     
@@ -530,165 +634,64 @@ async def get_all_logistics_data(
     - /logistics/all?tu_ngay=2024-01-01&den_ngay=2024-01-31&khachhang=ABC&bienso=51D&loaihang=Gạo&limit=10
     """
     try:
-        result = LogisticsDataResponse(
-            nhapkho=[],
-            xuatkho=[],
-            canthue=[],
-            nhaptau=[],
-            total_count={}
-        )
-        
         # Xác định các bảng cần lấy dữ liệu
         selected_tables = []
         if tables:
             selected_tables = [table.strip().lower() for table in tables.split(",")]
         else:
-            selected_tables = ["nhapkho", "xuatkho", "canthue", "nhaptau"]
+            selected_tables = list(TICKET_MODELS.keys())
+        ordered_tables = [table for table in TICKET_MODELS if table in selected_tables]
         
-        # Lấy dữ liệu từ bảng nhapkho
-        if "nhapkho" in selected_tables:
-            nhapkho_query = db.query(Nhapkho)
-            
-            # Áp dụng các điều kiện lọc
-            if tu_ngay:
-                nhapkho_query = nhapkho_query.filter(Nhapkho.ngaycan >= tu_ngay)
-            if den_ngay:
-                nhapkho_query = nhapkho_query.filter(Nhapkho.ngaycan <= den_ngay)
-            if khachhang:
-                nhapkho_query = nhapkho_query.filter(vietnamese_filter(Nhapkho.khachhang, khachhang))
-            if sophieu:
-                nhapkho_query = nhapkho_query.filter(Nhapkho.sophieu.contains(sophieu))
-            if bienso:
-                nhapkho_query = nhapkho_query.filter(vietnamese_filter(Nhapkho.bienso1_1, bienso))
-            if loaihang:
-                nhapkho_query = nhapkho_query.filter(vietnamese_filter(Nhapkho.loaihang, loaihang))
-            
-            # Sắp xếp theo ngày (mới nhất trước)
-            nhapkho_query = nhapkho_query.order_by(Nhapkho.ngaycan.desc())
+        def load(session: Session):
+            result = {"total_count": {}}
             
-            # Thêm offset để bỏ qua một số lượng bản ghi từ đầu
-            if offset and offset > 0:
-                nhapkho_query = nhapkho_query.offset(offset)
-                
-            # Giới hạn số lượng nếu có
-            if limit and limit > 0:
-                nhapkho_query = nhapkho_query.limit(limit)
+            # Lấy dữ liệu từng bảng qua bộ truy vấn chung
+            for table in ordered_tables:
+                results = ticket_engine.execute(session, table, params)
+                result[table] = results
+                result["total_count"][table] = len(results)
             
-            # Thực hiện query
-            nhapkho_results = nhapkho_query.all()
-            result.nhapkho = nhapkho_results
-            result.total_count["nhapkho"] = len(nhapkho_results)
+            # Tính tổng số bản ghi
+            result["total_count"]["all"] = sum(result["total_count"].values())
+            return result
         
-        # Lấy dữ liệu từ bảng xuatkho
-        if "xuatkho" in selected_tables:
-            xuatkho_query = db.query(Xuatkho)
-            
-            # Áp dụng các điều kiện lọc
-            if tu_ngay:
-                xuatkho_query = xuatkho_query.filter(Xuatkho.ngaycan >= tu_ngay)
-            if den_ngay:
-                xuatkho_query = xuatkho_query.filter(Xuatkho.ngaycan <= den_ngay)
-            if khachhang:
-                xuatkho_query = xuatkho_query.filter(vietnamese_filter(Xuatkho.khachhang, khachhang))
-            if sophieu:
-                xuatkho_query = xuatkho_query.filter(Xuatkho.sophieu.contains(sophieu))
-            if bienso:
-                xuatkho_query = xuatkho_query.filter(vietnamese_filter(Xuatkho.bienso1_1, bienso))
-            if loaihang:
-                xuatkho_query = xuatkho_query.filter(vietnamese_filter(Xuatkho.loaihang, loaihang))
-            
-            # Sắp xếp theo ngày (mới nhất trước)
-            xuatkho_query = xuatkho_query.order_by(Xuatkho.ngaycan.desc())
-            
-            # Thêm offset để bỏ qua một số lượng bản ghi từ đầu
-            if offset and offset > 0:
-                xuatkho_query = xuatkho_query.offset(offset)
-                
-            # Giới hạn số lượng nếu có
-            if limit and limit > 0:
-                xuatkho_query = xuatkho_query.limit(limit)
-            
-            # Thực hiện query
-            xuatkho_results = xuatkho_query.all()
-            result.xuatkho = xuatkho_results
-            result.total_count["xuatkho"] = len(xuatkho_results)
-        
-        # Lấy dữ liệu từ bảng canthue
-        if "canthue" in selected_tables:
-            canthue_query = db.query(Canthue)
-            
-            # Áp dụng các điều kiện lọc
-            if tu_ngay:
-                canthue_query = canthue_query.filter(Canthue.ngaycan >= tu_ngay)
-            if den_ngay:
-                canthue_query = canthue_query.filter(Canthue.ngaycan <= den_ngay)
-            if khachhang:
-                canthue_query = canthue_query.filter(vietnamese_filter(Canthue.khachhang, khachhang))
-            if sophieu:
-                canthue_query = canthue_query.filter(Canthue.sophieu.contains(sophieu))
-            if bienso:
-                canthue_query = canthue_query.filter(vietnamese_filter(Canthue.bienso1_1, bienso))
-            if loaihang:
-                canthue_query = canthue_query.filter(vietnamese_filter(Canthue.loaihang, loaihang))
-            
-            # Sắp xếp theo ngày (mới nhất trước)
-            canthue_query = canthue_query.order_by(Canthue.ngaycan.desc())
-            
-            # Thêm offset để bỏ qua một số lượng bản ghi từ đầu
-            if offset and offset > 0:
-                canthue_query = canthue_query.offset(offset)
-                
-            # Giới hạn số lượng nếu có
-            if limit and limit > 0:
-                canthue_query = canthue_query.limit(limit)
-            
-            # Thực hiện query
-            canthue_results = canthue_query.all()
-            result.canthue = canthue_results
-            result.total_count["canthue"] = len(canthue_results)
-        
-        # Lấy dữ liệu từ bảng nhaptau
-        if "nhaptau" in selected_tables:
-            nhaptau_query = db.query(Nhaptau)
-            
-            # Áp dụng các điều kiện lọc
-            if tu_ngay:
-                nhaptau_query = nhaptau_query.filter(Nhaptau.ngaycan >= tu_ngay)
-            if den_ngay:
-                nhaptau_query = nhaptau_query.filter(Nhaptau.ngaycan <= den_ngay)
-            if khachhang:
-                nhaptau_query = nhaptau_query.filter(vietnamese_filter(Nhaptau.khachhang, khachhang))
-            if sophieu:
-                nhaptau_query = nhaptau_query.filter(Nhaptau.sophieu.contains(sophieu))
-            if bienso:
-                nhaptau_query = nhaptau_query.filter(vietnamese_filter(Nhaptau.bienso1_1, bienso))
-            if loaihang:
-                nhaptau_query = nhaptau_query.filter(vietnamese_filter(Nhaptau.loaihang, loaihang))
-            
-            # Sắp xếp theo ngày (mới nhất trước)
-            nhaptau_query = nhaptau_query.order_by(Nhaptau.ngaycan.desc())
-            
-            # Thêm offset để bỏ qua một số lượng bản ghi từ đầu
-            if offset and offset > 0:
-                nhaptau_query = nhaptau_query.offset(offset)
-                
-            # Giới hạn số lượng nếu có
-            if limit and limit > 0:
-                nhaptau_query = nhaptau_query.limit(limit)
-            
-            # Thực hiện query
-            nhaptau_results = nhaptau_query.all()
-            result.nhaptau = nhaptau_results
-            result.total_count["nhaptau"] = len(nhaptau_results)
-        
-        # Tính tổng số bản ghi
-        result.total_count["all"] = sum(result.total_count.values())
-        
-        return result
+        return await ticket_list_response(
+            request, db, ordered_tables, params, LogisticsDataResponse, load,
+            f"|tables={','.join(ordered_tables)}"
+        )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi lấy dữ liệu tổng hợp: {str(e)}")
 
+# API đồng bộ tăng dần phiếu của 4 bảng
+@app.get("/sync/tickets", response_model=SyncTicketsResponse)
+def sync_tickets(
+    db: Session = Depends(get_db),
+    since: str = None,       # Token nhận được ở lần đồng bộ trước (bỏ trống ở lần đầu)
+    limit: int = None        # Số phiếu tối đa mỗi lần (mặc định SYNC_MAX_ROWS)
+):
+    """
+    Trả về các phiếu thêm mới, sửa (cân lần 2, in lại) hoặc xóa mềm (xoaphieu = 1) kể từ token since
+    của cả 4 bảng, kèm token mới cho lần đồng bộ tiếp theo
+    
+    - full_resync = true: token không còn dùng được (lần đầu, server khởi động lại, nhật ký đã quá cũ),
+      client tải lại dữ liệu bằng các API danh sách rồi đồng bộ tiếp từ token trả về
+    - has_more = true: còn thay đổi, gọi tiếp ngay với token mới
+    - deleted: số phiếu đã bị xóa hẳn khỏi database
+    
+    Examples:
+    - /sync/tickets
+    - /sync/tickets?since=local:1760000000:42
+    """
+    try:
+        return ticket_sync.pull(db, since, limit)
+    except InvalidSyncToken as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi khi đồng bộ phiếu: {str(e)}")
+
 # API để get dữ liệu từ table loaihang
 @app.get("/loaihang", response_model=List[LoaihangResponse])
 async def get_loaihang(
@@ -713,28 +716,13 @@ async def get_loaihang(
     - /loaihang?limit=10
     """
     try:
-        # Bắt đầu với query cơ bản
-        query = db.query(Loaihang)
-        
-        # Lọc theo mã hàng
-        if mahang:
-            query = query.filter(vietnamese_filter(Loaihang.mahang, mahang))
-            
-        # Lọc theo tên hàng (hỗ trợ tiếng Việt đầy đủ)
-        if tenhang:
-            query = query.filter(vietnamese_filter(Loaihang.tenhang, tenhang))
-        
-        # Thêm offset để bỏ qua một số lượng bản ghi từ đầu
-        if offset and offset > 0:
-            query = query.offset(offset)
-            
-        # Giới hạn số lượng nếu có
-        if limit and limit > 0:
-            query = query.limit(limit)
-            
-        # Thực hiện query
-        results = query.all()
-        return results
+        # Lọc từ cache danh mục (không phân biệt hoa thường và dấu)
+        return master_cache.query(
+            db, "loaihang",
+            contains={"mahang": mahang, "tenhang": tenhang},
+            offset=offset,
+            limit=limit
+        )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi lấy dữ liệu loaihang: {str(e)}")
@@ -765,32 +753,13 @@ async def get_khachhang(
     - /khachhang?loaihang=Gạo&limit=10
     """
     try:
-        # Bắt đầu với query cơ bản
-        query = db.query(Khachhang)
-        
-        # Lọc theo mã khách hàng
-        if makhachhang:
-            query = query.filter(vietnamese_filter(Khachhang.makhachhang, makhachhang))
-            
-        # Lọc theo tên khách hàng (hỗ trợ tiếng Việt đầy đủ)
-        if tenkhachhang:
-            query = query.filter(vietnamese_filter(Khachhang.tenkhachhang, tenkhachhang))
-            
-        # Lọc theo loại hàng (hỗ trợ tiếng Việt đầy đủ)
-        if loaihang:
-            query = query.filter(vietnamese_filter(Khachhang.loaihang, loaihang))
-        
-        # Thêm offset để bỏ qua một số lượng bản ghi từ đầu
-        if offset and offset > 0:
-            query = query.offset(offset)
-            
-        # Giới hạn số lượng nếu có
-        if limit and limit > 0:
-            query = query.limit(limit)
-            
-        # Thực hiện query
-        results = query.all()
-        return results
+        # Lọc từ cache danh mục (không phân biệt hoa thường và dấu)
+        return master_cache.query(
+            db, "khachhang",
+            contains={"makhachhang": makhachhang, "tenkhachhang": tenkhachhang, "loaihang": loaihang},
+            offset=offset,
+            limit=limit
+        )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi lấy dữ liệu khachhang: {str(e)}")
@@ -823,39 +792,53 @@ async def get_xe(
     - /xe?loaihang=Gạo&laixe=Nguyễn Văn A&limit=10
     """
     try:
-        # Bắt đầu với query cơ bản
-        query = db.query(Xe)
+        # Lọc từ cache danh mục (không phân biệt hoa thường và dấu)
+        return master_cache.query(
+            db, "xe",
+            contains={
+                "blenso_xe": bienso,
+                "tenkhachhang_xe": tenkhachhang,
+                "loaihang_xe": loaihang,
+                "laixe_xe": laixe
+            },
+            offset=offset,
+            limit=limit
+        )
         
-        # Lọc theo biển số
-        if bienso:
-            query = query.filter(vietnamese_filter(Xe.blenso_xe, bienso))
-            
-        # Lọc theo tên khách hàng (hỗ trợ tiếng Việt đầy đủ)
-        if tenkhachhang:
-            query = query.filter(vietnamese_filter(Xe.tenkhachhang_xe, tenkhachhang))
-            
-        # Lọc theo loại hàng (hỗ trợ tiếng Việt đầy đủ)
-        if loaihang:
-            query = query.filter(vietnamese_filter(Xe.loaihang_xe, loaihang))
-            
-        # Lọc theo tên lái xe (hỗ trợ tiếng Việt đầy đủ)
-        if laixe:
-            query = query.filter(vietnamese_filter(Xe.laixe_xe, laixe))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi khi lấy dữ liệu xe: {str(e)}")
+
+# API hồ sơ xe theo biển số
+@app.get("/xe/{plate}/profile", response_model=XeProfileResponse)
+def get_xe_profile(
+    plate: str,
+    db: Session = Depends(get_db)
+):
+    """
+    Tự điền thông tin khi xe vào trạm: dòng trong bảng xe cùng khách hàng, loại hàng,
+    lái xe của phiếu gần nhất và khối lượng bì gần nhất (từ cả 4 bảng phiếu)
+    
+    Parameters:
+    - plate: Biển số xe (không phân biệt khoảng trắng, dấu "-" và ".")
+    
+    Examples:
+    - /xe/51D-123.45/profile
+    - /xe/51D12345/profile
+    """
+    try:
+        # Đảm bảo map biển số -> bảng xe còn mới
+        master_cache.rows(db, "xe")
         
-        # Thêm offset để bỏ qua một số lượng bản ghi từ đầu
-        if offset and offset > 0:
-            query = query.offset(offset)
-            
-        # Giới hạn số lượng nếu có
-        if limit and limit > 0:
-            query = query.limit(limit)
-            
-        # Thực hiện query
-        results = query.all()
-        return results
+        profile = plate_index.profile(db, plate)
+        if profile is None:
+            raise HTTPException(status_code=400, detail="Biển số không hợp lệ")
+        
+        return XeProfileResponse(**profile)
         
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Lỗi khi lấy dữ liệu xe: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Lỗi khi lấy hồ sơ xe: {str(e)}")
 
 # Camera endpoint
 @app.get("/camera", response_model=List[CameraResponse])
@@ -873,81 +856,248 @@ def get_camera(
     Lấy danh sách camera theo điều kiện lọc
     """
     try:
-        # Tạo query cơ bản
-        query = db.query(Camera)
-        
         # Áp dụng filters với validation
+        camera_id = None
         if id is not None:
             try:
                 camera_id = int(id)
-                query = query.filter(Camera.ID == camera_id)
             except (ValueError, TypeError):
                 raise HTTPException(status_code=400, detail="ID phải là số nguyên hợp lệ")
         
-        if ip:
-            query = query.filter(Camera.IPAddrees.ilike(f"%{ip}%"))
-        
-        if username:
-            query = query.filter(Camera.UseName.ilike(f"%{username}%"))
-        
+        active_status = None
         if active is not None:
             try:
                 active_status = int(active)
                 if active_status not in [0, 1]:
                     raise HTTPException(status_code=400, detail="Active phải là 0 (tắt) hoặc 1 (bật)")
-                query = query.filter(Camera.Active == active_status)
             except (ValueError, TypeError):
                 raise HTTPException(status_code=400, detail="Active phải là số nguyên (0 hoặc 1)")
         
-        if port:
-            query = query.filter(Camera.Port.ilike(f"%{port}%"))
-        
-        # Thêm offset để bỏ qua một số lượng bản ghi từ đầu
-        if offset and offset > 0:
-            query = query.offset(offset)
-            
-        # Giới hạn số lượng nếu có
-        if limit and limit > 0:
-            query = query.limit(limit)
-            
-        # Thực hiện query
-        results = query.all()
-        return results
+        # Lọc từ cache danh mục
+        return master_cache.query(
+            db, "camera",
+            contains={"IPAddrees": ip, "UseName": username, "Port": port},
+            equals={"ID": camera_id, "Active": active_status},
+            offset=offset,
+            limit=limit
+        )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi lấy dữ liệu camera: {str(e)}")
 
-# ==== PICTURE MANAGEMENT APIs ====
+# API gợi ý (autocomplete) cho khách hàng, loại hàng, biển số xe
+@app.get("/suggest/{entity}", response_model=SuggestResponse)
+async def suggest(
+    entity: str,
+    db: Session = Depends(get_db),
+    q: str = Query(..., description="Chuỗi người dùng đang nhập"),
+    limit: int = Query(10, ge=1, le=100, description="Số lượng gợi ý tối đa")
+):
+    """
+    Gợi ý theo tiền tố, không phân biệt hoa thường và dấu
+    
+    Parameters:
+    - entity: khachhang (tenkhachhang), loaihang (tenhang), xe (blenso_xe)
+    - q: Chuỗi người dùng đang nhập
+    - limit: Số lượng gợi ý tối đa
+    
+    Examples:
+    - /suggest/khachhang?q=cong ty
+    - /suggest/loaihang?q=gao&limit=5
+    - /suggest/xe?q=51D-12
+    """
+    try:
+        if entity not in SUGGEST_ENTITIES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Entity không hợp lệ. Cho phép: {', '.join(SUGGEST_ENTITIES.keys())}"
+            )
+        
+        matches = suggest_service.suggest(db, entity, q, limit)
+        return SuggestResponse(
+            entity=entity,
+            query=q,
+            suggestions=[SuggestItem(id=pk, value=value) for pk, value in matches]
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi khi lấy gợi ý: {str(e)}")
 
-# Các hằng số
-PICTURE_TYPES = {
-    "NK": "NhapKho",
-    "CT": "CanThue", 
-    "NT": "NhapTau",
-    "XK": "XuatKho"
-}
+# API thống kê cache
+@app.get("/cache/stats")
+def get_cache_stats():
+    """
+    Thống kê hit/miss của các cache trong tiến trình
+    """
+    return {
+        "master_data": master_cache.stats(),
+        "ticket_query": ticket_engine.stats(),
+        "change_tokens": change_tokens.stats(),
+        "result_cache": result_cache.stats(),
+        "auth_tokens": token_authority.stats(),
+        "password_hasher": password_hasher.stats(),
+        "rate_limit": rate_limiter.stats()
+    }
 
-def get_picture_base_path():
-    """Lấy đường dẫn base cho hình ảnh từ environment variable"""
-    return os.getenv("PICTURE_BASE_PATH", r"D:\Picture")
+# API số liệu cho Prometheus
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def get_metrics():
+    """Số liệu theo route định dạng Prometheus (latency, request đang xử lý, kích thước response, thời gian SQL/serialize)"""
+    if not metrics_enabled():
+        raise HTTPException(status_code=404, detail="Chưa bật thu thập số liệu (METRICS_ENABLED)")
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
-def create_folder_structure(picture_type: str, date: str):
+# ==== ARCHIVE APIs ====
+
+@app.get("/admin/archive", dependencies=[Depends(require_admin)])
+def get_archive_status():
     """
-    Tạo cấu trúc thư mục cho hình ảnh
-    Args:
-        picture_type: NK, CT, NT, XK
-        date: YYYY-MM-DD format
-    Returns:
-        str: Đường dẫn thư mục đã tạo
+    Mốc lưu trữ và số phiếu ở bảng chính/bảng lưu trữ của từng bảng phiếu
     """
-    base_path = get_picture_base_path()
-    folder_path = os.path.join(base_path, picture_type, date)
+    try:
+        return archive_manager.status()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi khi lấy trạng thái lưu trữ: {str(e)}")
+
+@app.post("/admin/archive/run", dependencies=[Depends(require_admin)])
+def run_archive(
+    table: str = None,       # Chỉ lưu trữ một bảng (mặc định tất cả)
+    keep_days: int = None    # Số ngày giữ ở bảng chính (mặc định ARCHIVE_KEEP_DAYS)
+):
+    """
+    Chuyển phiếu của các tháng đã đóng (trước tháng của hôm nay - keep_days) sang bảng lưu trữ.
+    Sau khi đặt mốc mới, chờ ARCHIVE_STATE_REFRESH giây (mọi API node đọc lại mốc) rồi mới chuyển phiếu.
     
+    Examples:
+    - POST /admin/archive/run
+    - POST /admin/archive/run?table=nhapkho&keep_days=180
+    """
+    try:
+        if table is not None and table not in TICKET_MODELS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Bảng không hợp lệ. Cho phép: {', '.join(TICKET_MODELS.keys())}"
+            )
+        return archive_manager.run(table, keep_days)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi khi lưu trữ phiếu: {str(e)}")
+
+# ==== SQL TRACE APIs ====
+
+@app.get("/admin/sql/stats", dependencies=[Depends(require_admin)])
+def get_sql_stats(
+    sort: str = "total_ms",  # Sắp xếp theo: total_ms, p99_ms, p50_ms, max_ms, count, rows, slow
+    limit: int = 50,
+    route: str = None,       # Chỉ các câu SQL của route (vd. /logistics/all)
+    table: str = None        # Chỉ các câu SQL đọc/ghi bảng
+):
+    """
+    Thống kê theo dạng câu SQL: số lần chạy, p50/p99, số dòng trả về, route và bảng
+
+    Examples:
+    - GET /admin/sql/stats?route=/logistics/all
+    - GET /admin/sql/stats?sort=p99_ms&table=nhapkho
+    """
     try:
-        pathlib.Path(folder_path).mkdir(parents=True, exist_ok=True)
-        return folder_path
+        return {"tracer": sql_tracer.stats(), "shapes": sql_tracer.shapes(sort, limit, route, table)}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Không thể tạo thư mục {folder_path}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Lỗi khi lấy thống kê SQL: {str(e)}")
+
+@app.get("/admin/sql/slow", dependencies=[Depends(require_admin)])
+def get_slow_queries(limit: int = 50):
+    """
+    Các câu SQL chậm gần nhất (vượt SQL_SLOW_MS)
+    """
+    return {"slow_ms": sql_tracer.stats()["slow_ms"], "queries": sql_tracer.slow_queries(limit)}
+
+@app.get("/admin/sql/plan/{fingerprint}", dependencies=[Depends(require_admin)])
+def get_sql_plan(fingerprint: str):
+    """
+    SHOWPLAN XML đã lấy cho dạng câu SQL chậm (SQL_TRACE_SHOWPLAN=true), mở được bằng SSMS (.sqlplan)
+    """
+    plan = sql_tracer.plan(fingerprint)
+    if plan is None:
+        raise HTTPException(status_code=404, detail=f"Chưa có plan cho {fingerprint}")
+    return Response(content=plan, media_type="application/xml")
+
+@app.post("/admin/sql/reset", dependencies=[Depends(require_admin)])
+def reset_sql_stats():
+    """
+    Xóa thống kê SQL để đo lại từ đầu
+    """
+    sql_tracer.reset()
+    return {"success": True, "message": "Đã xóa thống kê SQL"}
+
+# ==== PROFILER APIs ====
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+def profile_process(
+    seconds: float = 10,         # Thời gian lấy mẫu (tối đa PROFILER_MAX_SECONDS)
+    interval_ms: float = None,   # Chu kỳ lấy mẫu (mặc định PROFILER_INTERVAL_MS)
+    include_idle: bool = False   # Lấy cả thread đang rảnh (chờ việc, chờ socket)
+):
+    """
+    Lấy mẫu stack mọi thread của API trong một khoảng thời gian, trả về file collapsed stack
+    (mở bằng speedscope.app hoặc flamegraph.pl)
+
+    Examples:
+    - GET /admin/profile?seconds=30
+    """
+    try:
+        if seconds <= 0:
+            raise HTTPException(status_code=400, detail="seconds phải > 0")
+        counts = profiler.profile_process(seconds, interval_ms / 1000 if interval_ms else None, include_idle)
+        filename = f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded"
+        return PlainTextResponse(format_collapsed(counts), headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi khi profile: {str(e)}")
+
+@app.get("/admin/profile/requests", dependencies=[Depends(require_admin)])
+def get_request_profiles():
+    """
+    Các request đã profile gần nhất (gửi request kèm header X-Profile: 1 và X-Admin-Key)
+    """
+    return {"profiles": profiler.request_profiles()}
+
+@app.get("/admin/profile/requests/{profile_id}", dependencies=[Depends(require_admin)])
+def get_request_profile(profile_id: str):
+    """
+    Collapsed stack của một request theo X-Profile-Id trả về trong response
+    """
+    profile = profiler.request_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Không tìm thấy profile {profile_id}")
+    return PlainTextResponse(
+        format_collapsed(profile.counts),
+        headers={"Content-Disposition": f'attachment; filename="request-{profile_id}.folded"'}
+    )
+
+# ==== PICTURE MANAGEMENT APIs ====
+
+from picture_storage import PICTURE_TYPES, PictureExists, create_picture_store, picture_key
+
+# Hình ảnh: backend lưu file (PICTURE_STORAGE=local|s3) + danh mục picture_catalog trong database
+picture_store = create_picture_store()
+# Đưa hình đã có trong storage (chép thẳng vào thư mục, chuyển từ bản cũ) vào danh mục, chạy nền
+if os.getenv("PICTURE_REINDEX_ON_STARTUP", "true").lower() == "true":
+    picture_store.reindex_in_background(SessionLocal)
+
+def sync_picture_folders(db: Session, picture_type: Optional[str], date: Optional[str]):
+    """
+    Thêm vào danh mục hình trạm cân ghi thẳng vào thư mục của các ngày được tra cứu
+    (không có ngày: thư mục hôm nay; các ngày cũ đã được đồng bộ khi khởi động)
+    """
+    picture_date = date or datetime.now().strftime("%Y-%m-%d")
+    for ptype in ([picture_type] if picture_type else PICTURE_TYPES):
+        picture_store.sync_folder(db, ptype, picture_date)
 
 def generate_filename(ticket_number: str, camera_number: int, sequence: int):
     """
@@ -961,28 +1111,54 @@ def generate_filename(ticket_number: str, camera_number: int, sequence: int):
     """
     return f"{ticket_number}-CMR{camera_number}_{sequence}"
 
-def parse_filename(filename: str):
-    """
-    Parse tên file để lấy thông tin
-    Args:
-        filename: Tên file (có thể có extension)
-    Returns:
-        dict: {ticket_number, camera_number, sequence} hoặc None nếu không match
-    """
-    # Loại bỏ extension
-    name_without_ext = os.path.splitext(filename)[0]
-    
-    # Pattern: [Số phiếu]-CMR[Camera]_[Sequence]
-    pattern = r"^(.+)-CMR(\d+)_(\d+)$"
-    match = re.match(pattern, name_without_ext)
-    
-    if match:
-        return {
-            "ticket_number": match.group(1),
-            "camera_number": int(match.group(2)),
-            "sequence": int(match.group(3))
+def validate_picture_type(picture_type: Optional[str]):
+    if picture_type and picture_type not in PICTURE_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Loại phiếu không hợp lệ. Cho phép: {', '.join(PICTURE_TYPES.keys())}"
+        )
+
+def parse_picture_date(value: Optional[str]) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Định dạng ngày không hợp lệ. Sử dụng YYYY-MM-DD")
+
+def picture_info(row) -> PictureInfo:
+    """Thông tin hình từ dòng picture_catalog"""
+    picture_date = row.picture_date.isoformat()
+    return PictureInfo(
+        filename=row.filename,
+        file_path=picture_store.storage.location(row.storage_key),
+        image_url=f"/picture/view/{row.picture_type}/{picture_date}/{row.filename}",
+        ticket_number=row.ticket_number,
+        picture_type=row.picture_type,
+        camera_number=row.camera_number,
+        sequence=row.sequence,
+        date=picture_date,
+        file_size=row.file_size or 0,
+        created_time=row.created_at.isoformat() if row.created_at else ""
+    )
+
+def picture_response(row) -> Response:
+    """Trả nội dung hình: FileResponse với storage cục bộ, stream từng khối với S3 (metadata lấy từ catalog)"""
+    # Với PICTURE_DEDUP nội dung nằm ở blob theo hash, tên file tải về vẫn là tên của hình
+    blob_key = picture_store.blob_key(row)
+    local_path = picture_store.storage.local_path(blob_key)
+    if local_path is not None:
+        if not os.path.isfile(local_path):
+            raise HTTPException(status_code=404, detail=f"Không tìm thấy file: {row.filename}")
+        return FileResponse(path=local_path, media_type=row.content_type, filename=row.filename)
+    return StreamingResponse(
+        picture_store.storage.iter_chunks(blob_key),
+        media_type=row.content_type,
+        headers={
+            "Content-Length": str(row.file_size),
+            "Content-Disposition": f'attachment; filename="{row.filename}"'
         }
-    return None
+    )
 
 @app.post("/picture/upload", response_model=PictureUploadResponse)
 async def upload_picture(
@@ -991,68 +1167,52 @@ async def upload_picture(
     picture_type: str = Query(..., description="Loại phiếu: NK, CT, NT, XK"),
     camera_number: int = Query(..., description="Số camera (1, 2, 3...)"),
     sequence: int = Query(1, description="Lần chụp thứ mấy (1, 2, 3...)"),
-    date: Optional[str] = Query(None, description="Ngày chụp (YYYY-MM-DD), mặc định là hôm nay")
+    date: Optional[str] = Query(None, description="Ngày chụp (YYYY-MM-DD), mặc định là hôm nay"),
+    db: Session = Depends(get_db)
 ):
     """
     Upload hình ảnh với cấu trúc thư mục theo ngày và tên file theo camera
     """
     try:
         # Validate picture_type
-        if picture_type not in PICTURE_TYPES:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Loại phiếu không hợp lệ. Cho phép: {', '.join(PICTURE_TYPES.keys())}"
-            )
-        
+        validate_picture_type(picture_type)
+
         # Validate camera_number
         if camera_number < 1:
             raise HTTPException(status_code=400, detail="Số camera phải >= 1")
-            
+
         # Validate sequence
         if sequence < 1:
             raise HTTPException(status_code=400, detail="Sequence phải >= 1")
-        
+
         # Sử dụng ngày hiện tại nếu không được cung cấp
         if not date:
             date = datetime.now().strftime("%Y-%m-%d")
-        
-        # Validate date format
-        try:
-            datetime.strptime(date, "%Y-%m-%d")
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Định dạng ngày không hợp lệ. Sử dụng YYYY-MM-DD")
-        
-        # Tạo cấu trúc thư mục
-        folder_path = create_folder_structure(picture_type, date)
-        folder_created = not os.path.exists(folder_path)
-        
+        parse_picture_date(date)
+
         # Tạo tên file
         file_extension = os.path.splitext(file.filename)[1] if file.filename else ""
-        filename_base = generate_filename(ticket_number, camera_number, sequence)
-        filename = filename_base + file_extension
-        
-        # Đường dẫn đầy đủ của file
-        file_path = os.path.join(folder_path, filename)
-        
-        # Kiểm tra file đã tồn tại
-        if os.path.exists(file_path):
-            raise HTTPException(
-                status_code=400, 
-                detail=f"File đã tồn tại: {filename}"
-            )
-        
-        # Lưu file
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-        
+        filename = generate_filename(ticket_number, camera_number, sequence) + file_extension
+        content_type = file.content_type if file.content_type and file.content_type.startswith("image/") else None
+
+        def save():
+            # Thư mục (loại/ngày) chưa có hình nào
+            folder_created = not picture_store.find(db, picture_type=picture_type, picture_date=parse_picture_date(date), limit=1)
+            row = picture_store.put(db, picture_type, date, filename, file.file, content_type)
+            return row, folder_created
+
+        # Ghi file theo từng khối trong worker thread (không chặn event loop, không đọc cả file vào bộ nhớ)
+        row, folder_created = await run_in_threadpool(save)
+
         return PictureUploadResponse(
             success=True,
             message=f"Upload thành công: {filename}",
-            file_path=file_path,
+            file_path=picture_store.storage.location(row.storage_key),
             folder_created=folder_created
         )
-        
+
+    except (PictureExists, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except HTTPException:
         raise
     except Exception as e:
@@ -1065,11 +1225,13 @@ def list_pictures(
     picture_type: Optional[str] = Query(None, description="Loại phiếu: NK, CT, NT, XK"),
     camera_number: Optional[int] = Query(None, description="Số camera"),
     sequence: Optional[int] = Query(None, description="Lần chụp (1, 2, 3...)"),
-    limit: Optional[int] = Query(None, description="Giới hạn số lượng kết quả")
+    limit: Optional[int] = Query(None, description="Giới hạn số lượng kết quả"),
+    db: Session = Depends(get_db)
 ):
     """
-    Lấy danh sách hình ảnh theo các điều kiện lọc.
-    
+    Lấy danh sách hình ảnh theo các điều kiện lọc (tra trong danh mục hình ảnh; chỉ liệt kê thư mục của ngày
+    được tra cứu để thêm hình trạm cân ghi thẳng vào, tối đa một lần mỗi PICTURE_FOLDER_SYNC_SECONDS giây).
+
     Parameters:
     - ticket_number: Số phiếu cần tìm (chính xác)
     - date: Ngày cụ thể (YYYY-MM-DD)
@@ -1077,7 +1239,7 @@ def list_pictures(
     - camera_number: Số camera
     - sequence: Lần chụp (1, 2, 3...)
     - limit: Giới hạn số lượng kết quả trả về
-    
+
     Examples:
     - /picture/list?ticket_number=PH001
     - /picture/list?date=2025-08-17
@@ -1085,103 +1247,26 @@ def list_pictures(
     - /picture/list?ticket_number=PH001&picture_type=NK&camera_number=1
     """
     try:
-        base_path = get_picture_base_path()
-        pictures = []
-        
-        # Validate picture_type nếu được cung cấp
-        if picture_type and picture_type not in PICTURE_TYPES:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Loại phiếu không hợp lệ. Cho phép: {', '.join(PICTURE_TYPES.keys())}"
-            )
-        
-        # Validate date format nếu được cung cấp
-        if date:
-            try:
-                datetime.strptime(date, "%Y-%m-%d")
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Định dạng ngày không hợp lệ. Sử dụng YYYY-MM-DD")
-        
-        # Xác định các thư mục cần scan
-        picture_types_to_scan = [picture_type] if picture_type else list(PICTURE_TYPES.keys())
-        
-        for ptype in picture_types_to_scan:
-            type_path = os.path.join(base_path, ptype)
-            if not os.path.exists(type_path):
-                continue
-                
-            # Xác định các thư mục ngày cần scan
-            if date:
-                # Nếu có date cụ thể, chỉ tìm trong thư mục đó
-                date_folders = [date] if os.path.exists(os.path.join(type_path, date)) else []
-            else:
-                # Lấy tất cả thư mục ngày
-                date_folders = [d for d in os.listdir(type_path) 
-                              if os.path.isdir(os.path.join(type_path, d)) and re.match(r"\d{4}-\d{2}-\d{2}", d)]
-            
-            for date_folder in date_folders:
-                folder_path = os.path.join(type_path, date_folder)
-                
-                if os.path.exists(folder_path):
-                    for filename in os.listdir(folder_path):
-                        file_path = os.path.join(folder_path, filename)
-                        
-                        # Chỉ xử lý file (không phải thư mục)
-                        if os.path.isfile(file_path):
-                            # Parse thông tin từ tên file
-                            file_info = parse_filename(filename)
-                            
-                            if file_info:
-                                # Áp dụng các bộ lọc
-                                if ticket_number and file_info["ticket_number"] != ticket_number:
-                                    continue
-                                    
-                                if camera_number and file_info["camera_number"] != camera_number:
-                                    continue
-                                
-                                if sequence and file_info["sequence"] != sequence:
-                                    continue
-                                
-                                # Lấy thông tin file
-                                file_stat = os.stat(file_path)
-                                
-                                # Tạo URL để xem hình ảnh
-                                image_url = f"/picture/view/{ptype}/{date_folder}/{filename}"
-                                
-                                pictures.append(PictureInfo(
-                                    filename=filename,
-                                    file_path=file_path,
-                                    image_url=image_url,
-                                    ticket_number=file_info["ticket_number"],
-                                    picture_type=ptype,
-                                    camera_number=file_info["camera_number"],
-                                    sequence=file_info["sequence"],
-                                    date=date_folder,
-                                    file_size=file_stat.st_size,
-                                    created_time=datetime.fromtimestamp(file_stat.st_ctime).isoformat()
-                                ))
-                                
-                                # Kiểm tra giới hạn số lượng
-                                if limit and len(pictures) >= limit:
-                                    break
-                    
-                    # Kiểm tra giới hạn số lượng (break khỏi loop date_folder)
-                    if limit and len(pictures) >= limit:
-                        break
-                
-                # Kiểm tra giới hạn số lượng (break khỏi loop picture type)
-                if limit and len(pictures) >= limit:
-                    break
-        
-        # Sắp xếp theo ngày và tên file
-        pictures.sort(key=lambda x: (x.date, x.filename))
-        
+        validate_picture_type(picture_type)
+        picture_date = parse_picture_date(date)
+        sync_picture_folders(db, picture_type, date)
+        rows = picture_store.find(
+            db,
+            ticket_number=ticket_number,
+            picture_type=picture_type,
+            picture_date=picture_date,
+            camera_number=camera_number,
+            sequence=sequence,
+            limit=limit
+        )
+        pictures = [picture_info(row) for row in rows]
+
         return PictureListResponse(
             success=True,
             message=f"Tìm thấy {len(pictures)} hình ảnh",
             pictures=pictures
         )
-        
+
     except HTTPException:
         raise
     except Exception as e:
@@ -1193,87 +1278,53 @@ def get_picture(
     camera_number: int = Query(..., description="Số camera (bắt buộc)"),
     sequence: int = Query(..., description="Lần chụp (bắt buộc)"),
     date: Optional[str] = Query(None, description="Ngày (YYYY-MM-DD), nếu không có sẽ tìm trong tất cả ngày"),
-    picture_type: Optional[str] = Query(None, description="Loại phiếu: NK, CT, NT, XK")
+    picture_type: Optional[str] = Query(None, description="Loại phiếu: NK, CT, NT, XK"),
+    db: Session = Depends(get_db)
 ):
     """
     Lấy chính xác 1 hình ảnh theo số phiếu, camera, lần chụp.
     Trả về thông tin file hoặc lỗi nếu không tìm thấy.
     """
     try:
-        base_path = get_picture_base_path()
-        
-        # Validate picture_type nếu được cung cấp
-        if picture_type and picture_type not in PICTURE_TYPES:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Loại phiếu không hợp lệ. Cho phép: {', '.join(PICTURE_TYPES.keys())}"
-            )
-        
-        # Validate date format nếu được cung cấp
-        if date:
-            try:
-                datetime.strptime(date, "%Y-%m-%d")
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Định dạng ngày không hợp lệ. Sử dụng YYYY-MM-DD")
-        
-        # Xác định các thư mục cần tìm
-        picture_types_to_search = [picture_type] if picture_type else list(PICTURE_TYPES.keys())
-        
-        for ptype in picture_types_to_search:
-            type_path = os.path.join(base_path, ptype)
-            if not os.path.exists(type_path):
-                continue
-                
-            # Xác định các thư mục ngày cần tìm
-            if date:
-                date_folders = [date] if os.path.exists(os.path.join(type_path, date)) else []
-            else:
-                date_folders = [d for d in os.listdir(type_path) 
-                              if os.path.isdir(os.path.join(type_path, d)) and re.match(r"\d{4}-\d{2}-\d{2}", d)]
-            
-            for date_folder in date_folders:
-                folder_path = os.path.join(type_path, date_folder)
-                
-                if os.path.exists(folder_path):
-                    for filename in os.listdir(folder_path):
-                        file_path = os.path.join(folder_path, filename)
-                        
-                        if os.path.isfile(file_path):
-                            # Parse thông tin từ tên file
-                            file_info = parse_filename(filename)
-                            
-                            if file_info:
-                                # Kiểm tra khớp chính xác
-                                if (file_info["ticket_number"] == ticket_number and 
-                                    file_info["camera_number"] == camera_number and 
-                                    file_info["sequence"] == sequence):
-                                    
-                                    # Tìm thấy! Trả về thông tin file
-                                    file_stat = os.stat(file_path)
-                                    
-                                    return {
-                                        "success": True,
-                                        "message": f"Tìm thấy hình ảnh: {filename}",
-                                        "picture": {
-                                            "filename": filename,
-                                            "file_path": file_path,
-                                            "ticket_number": file_info["ticket_number"],
-                                            "picture_type": ptype,
-                                            "camera_number": file_info["camera_number"],
-                                            "sequence": file_info["sequence"],
-                                            "date": date_folder,
-                                            "file_size": file_stat.st_size,
-                                            "created_time": datetime.fromtimestamp(file_stat.st_ctime).isoformat()
-                                        }
-                                    }
-        
+        validate_picture_type(picture_type)
+        picture_date = parse_picture_date(date)
+        sync_picture_folders(db, picture_type, date)
+        rows = picture_store.find(
+            db,
+            ticket_number=ticket_number,
+            picture_type=picture_type,
+            picture_date=picture_date,
+            camera_number=camera_number,
+            sequence=sequence,
+            limit=1,
+            newest_first=True
+        )
+
+        if rows:
+            info = picture_info(rows[0])
+            return {
+                "success": True,
+                "message": f"Tìm thấy hình ảnh: {info.filename}",
+                "picture": {
+                    "filename": info.filename,
+                    "file_path": info.file_path,
+                    "ticket_number": info.ticket_number,
+                    "picture_type": info.picture_type,
+                    "camera_number": info.camera_number,
+                    "sequence": info.sequence,
+                    "date": info.date,
+                    "file_size": info.file_size,
+                    "created_time": info.created_time
+                }
+            }
+
         # Không tìm thấy
         return {
             "success": False,
             "message": f"Không tìm thấy hình ảnh: Số phiếu {ticket_number}, Camera {camera_number}, Lần chụp {sequence}",
             "picture": None
         }
-        
+
     except HTTPException:
         raise
     except Exception as e:
@@ -1281,122 +1332,89 @@ def get_picture(
 
 @app.delete("/picture/delete")
 def delete_picture(
-    file_path: str = Query(..., description="Đường dẫn đầy đủ của file cần xóa")
+    file_path: str = Query(..., description="Đường dẫn đầy đủ của file cần xóa (file_path trả về từ API upload/list)"),
+    db: Session = Depends(get_db)
 ):
     """
     Xóa hình ảnh
     """
     try:
-        base_path = get_picture_base_path()
-        
-        # Kiểm tra file có nằm trong base path không (bảo mật)
-        if not file_path.startswith(base_path):
+        # Chỉ xóa được hình nằm trong storage hình ảnh (bảo mật)
+        key = picture_store.storage.key_from_location(file_path)
+        if key is None:
             raise HTTPException(status_code=400, detail="Đường dẫn file không hợp lệ")
-        
-        # Kiểm tra file tồn tại
-        if not os.path.exists(file_path):
+
+        if not picture_store.remove(db, key):
             raise HTTPException(status_code=404, detail="File không tồn tại")
-        
-        # Xóa file
-        os.remove(file_path)
-        
-        return {"success": True, "message": f"Đã xóa file: {os.path.basename(file_path)}"}
-        
+
+        return {"success": True, "message": f"Đã xóa file: {key.rsplit('/', 1)[-1]}"}
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi xóa file: {str(e)}")
 
 @app.get("/picture/folders")
-def get_picture_folders():
+def get_picture_folders(db: Session = Depends(get_db)):
     """
-    Lấy cấu trúc thư mục hình ảnh
+    Lấy cấu trúc thư mục hình ảnh (các ngày có hình của từng loại phiếu)
     """
     try:
-        base_path = get_picture_base_path()
+        dates = picture_store.dates(db)
         result = {
-            "base_path": base_path,
+            "base_path": picture_store.storage.location(""),
             "folders": {}
         }
-        
+
         for ptype in PICTURE_TYPES.keys():
-            type_path = os.path.join(base_path, ptype)
             result["folders"][ptype] = {
                 "full_name": PICTURE_TYPES[ptype],
-                "path": type_path,
-                "exists": os.path.exists(type_path),
-                "dates": []
+                "path": picture_store.storage.location(ptype),
+                "exists": bool(dates[ptype]),
+                "dates": dates[ptype]  # Ngày mới nhất trước
             }
-            
-            if os.path.exists(type_path):
-                date_folders = [d for d in os.listdir(type_path) 
-                              if os.path.isdir(os.path.join(type_path, d)) and re.match(r"\d{4}-\d{2}-\d{2}", d)]
-                date_folders.sort(reverse=True)  # Ngày mới nhất trước
-                result["folders"][ptype]["dates"] = date_folders
-        
+
         return result
-        
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi lấy cấu trúc thư mục: {str(e)}")
 
 @app.get("/picture/view/{picture_type}/{date}/{filename}")
 def view_picture(
     picture_type: str,
-    date: str, 
-    filename: str
+    date: str,
+    filename: str,
+    db: Session = Depends(get_db)
 ):
     """
     Xem/tải hình ảnh trực tiếp
-    
+
     Parameters:
     - picture_type: Loại phiếu (NK, CT, NT, XK)
     - date: Ngày (YYYY-MM-DD)
     - filename: Tên file hình ảnh
-    
+
     Returns: File hình ảnh trực tiếp
-    
+
     Examples:
     - GET /picture/view/NK/2025-08-17/5-CMR1_1.png
     - GET /picture/view/CT/2025-08-17/PH001-CMR2_1.jpg
     """
     try:
         # Validate picture_type
-        if picture_type not in PICTURE_TYPES:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Loại phiếu không hợp lệ. Cho phép: {', '.join(PICTURE_TYPES.keys())}"
-            )
-        
+        validate_picture_type(picture_type)
+
         # Validate date format
-        try:
-            datetime.strptime(date, "%Y-%m-%d")
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Định dạng ngày không hợp lệ. Sử dụng YYYY-MM-DD")
-        
-        # Tạo đường dẫn file
-        base_path = get_picture_base_path()
-        file_path = os.path.join(base_path, picture_type, date, filename)
-        
-        # Kiểm tra file có tồn tại
-        if not os.path.exists(file_path):
+        parse_picture_date(date)
+
+        row = picture_store.get(db, picture_key(picture_type, date, filename))
+        if row is None:
             raise HTTPException(status_code=404, detail=f"Không tìm thấy file: {filename}")
-        
-        # Kiểm tra đây có phải là file không (không phải thư mục)
-        if not os.path.isfile(file_path):
-            raise HTTPException(status_code=400, detail="Path không phải là file")
-        
-        # Xác định content type
-        content_type, _ = mimetypes.guess_type(file_path)
-        if content_type is None:
-            content_type = "application/octet-stream"
-        
-        # Trả về file trực tiếp
-        return FileResponse(
-            path=file_path,
-            media_type=content_type,
-            filename=filename
-        )
-        
+
+        return picture_response(row)
+
     except HTTPException:
         raise
     except Exception as e:
@@ -1406,22 +1424,23 @@ def view_picture(
 def get_picture_image(
     ticket_number: str = Query(..., description="Số phiếu"),
     camera_number: int = Query(..., description="Số camera"),
-    sequence: int = Query(..., description="Lần chụp"), 
+    sequence: int = Query(..., description="Lần chụp"),
     date: Optional[str] = Query(None, description="Ngày (YYYY-MM-DD), nếu không có sẽ tìm trong tất cả ngày"),
-    picture_type: Optional[str] = Query(None, description="Loại phiếu: NK, CT, NT, XK")
+    picture_type: Optional[str] = Query(None, description="Loại phiếu: NK, CT, NT, XK"),
+    db: Session = Depends(get_db)
 ):
     """
     Lấy hình ảnh trực tiếp theo số phiếu, camera, lần chụp
-    
+
     Parameters:
     - ticket_number: Số phiếu (bắt buộc)
     - camera_number: Số camera (bắt buộc)
     - sequence: Lần chụp (bắt buộc)
-    - date: Ngày (YYYY-MM-DD), nếu không có sẽ tìm trong tất cả ngày
+    - date: Ngày (YYYY-MM-DD), nếu không có sẽ tìm trong tất cả ngày (lấy ngày mới nhất)
     - picture_type: Loại phiếu (NK, CT, NT, XK)
-    
+
     Returns: File hình ảnh trực tiếp
-    
+
     Examples:
     - GET /picture/image?ticket_number=5&camera_number=1&sequence=1
     - GET /picture/image?ticket_number=PH001&camera_number=2&sequence=1&date=2025-08-17
@@ -1430,82 +1449,113 @@ def get_picture_image(
         # Validate parameters
         if camera_number < 1:
             raise HTTPException(status_code=400, detail="Camera number phải >= 1")
-        
+
         if sequence < 1:
             raise HTTPException(status_code=400, detail="Sequence phải >= 1")
-        
-        # Validate picture_type nếu được cung cấp
-        if picture_type and picture_type not in PICTURE_TYPES:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Loại phiếu không hợp lệ. Cho phép: {', '.join(PICTURE_TYPES.keys())}"
-            )
-        
-        # Validate date format nếu được cung cấp
-        if date:
-            try:
-                datetime.strptime(date, "%Y-%m-%d")
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Định dạng ngày không hợp lệ. Sử dụng YYYY-MM-DD")
-        
-        base_path = get_picture_base_path()
-        
-        # Xác định các loại phiếu cần tìm
-        picture_types_to_search = [picture_type] if picture_type else list(PICTURE_TYPES.keys())
-        
-        # Tìm kiếm file
-        for ptype in picture_types_to_search:
-            type_path = os.path.join(base_path, ptype)
-            if not os.path.exists(type_path):
-                continue
-            
-            # Xác định thư mục ngày cần tìm
-            if date:
-                date_folders = [date] if os.path.exists(os.path.join(type_path, date)) else []
-            else:
-                date_folders = [d for d in os.listdir(type_path) 
-                              if os.path.isdir(os.path.join(type_path, d)) and re.match(r"\d{4}-\d{2}-\d{2}", d)]
-            
-            for date_folder in date_folders:
-                folder_path = os.path.join(type_path, date_folder)
-                
-                if os.path.exists(folder_path):
-                    for filename in os.listdir(folder_path):
-                        file_path = os.path.join(folder_path, filename)
-                        
-                        # Chỉ xử lý file
-                        if os.path.isfile(file_path):
-                            # Parse thông tin từ tên file
-                            file_info = parse_filename(filename)
-                            
-                            if file_info:
-                                # Kiểm tra khớp chính xác
-                                if (file_info["ticket_number"] == ticket_number and 
-                                    file_info["camera_number"] == camera_number and 
-                                    file_info["sequence"] == sequence):
-                                    
-                                    # Tìm thấy! Trả về file trực tiếp
-                                    content_type, _ = mimetypes.guess_type(file_path)
-                                    if content_type is None:
-                                        content_type = "application/octet-stream"
-                                    
-                                    return FileResponse(
-                                        path=file_path,
-                                        media_type=content_type,
-                                        filename=filename
-                                    )
-        
+
+        validate_picture_type(picture_type)
+        picture_date = parse_picture_date(date)
+        sync_picture_folders(db, picture_type, date)
+        rows = picture_store.find(
+            db,
+            ticket_number=ticket_number,
+            picture_type=picture_type,
+            picture_date=picture_date,
+            camera_number=camera_number,
+            sequence=sequence,
+            limit=1,
+            newest_first=True
+        )
+
+        if rows:
+            return picture_response(rows[0])
+
         # Không tìm thấy
         raise HTTPException(
-            status_code=404, 
+            status_code=404,
             detail=f"Không tìm thấy hình ảnh: Số phiếu {ticket_number}, Camera {camera_number}, Lần chụp {sequence}"
         )
-        
+
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi lấy hình ảnh: {str(e)}")
 
+@app.post("/admin/pictures/reindex", dependencies=[Depends(require_admin)])
+def reindex_pictures(
+    picture_type: Optional[str] = None,   # Chỉ một loại phiếu
+    date: Optional[str] = None,           # Chỉ một ngày (cần picture_type)
+    db: Session = Depends(get_db)
+):
+    """
+    Đồng bộ danh mục hình ảnh với storage: thêm hình chép thẳng vào storage, bỏ hình đã bị xóa ngoài API
+
+    Examples:
+    - POST /admin/pictures/reindex
+    - POST /admin/pictures/reindex?picture_type=NK&date=2025-08-17
+    """
+    try:
+        validate_picture_type(picture_type)
+        parse_picture_date(date)
+        if date and not picture_type:
+            raise HTTPException(status_code=400, detail="Cần picture_type khi lọc theo ngày")
+        return picture_store.reindex(db, picture_type, date)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi khi đồng bộ danh mục hình ảnh: {str(e)}")
+
+@app.post("/admin/pictures/dedup", dependencies=[Depends(require_admin)])
+def dedup_pictures(
+    picture_type: Optional[str] = None,   # Chỉ một loại phiếu
+    date: Optional[str] = None,           # Chỉ một ngày (cần picture_type)
+    db: Session = Depends(get_db)
+):
+    """
+    Chuyển hình đang lưu theo tên sang lưu theo nội dung (hình trùng byte chỉ giữ một bản)
+
+    Examples:
+    - POST /admin/pictures/dedup
+    - POST /admin/pictures/dedup?picture_type=NK&date=2025-08-17
+    """
+    try:
+        validate_picture_type(picture_type)
+        parse_picture_date(date)
+        if date and not picture_type:
+            raise HTTPException(status_code=400, detail="Cần picture_type khi lọc theo ngày")
+        return picture_store.deduplicate(db, picture_type, date)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi khi chuyển hình sang lưu theo nội dung: {str(e)}")
+
+@app.post("/admin/pictures/sweep", dependencies=[Depends(require_admin)])
+def sweep_pictures(
+    grace_seconds: Optional[float] = Query(None, ge=0, description="Chỉ xóa blob cũ hơn số giây này (mặc định PICTURE_BLOB_GRACE_SECONDS)"),
+    db: Session = Depends(get_db)
+):
+    """
+    Xóa blob lưu theo nội dung không còn hình nào tham chiếu (xóa hình không xóa blob ngay)
+    """
+    try:
+        return picture_store.sweep_blobs(db, grace_seconds)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi khi dọn blob hình ảnh: {str(e)}")
+
+@app.get("/admin/pictures/dedup/report", dependencies=[Depends(require_admin)])
+def dedup_report(
+    top: int = Query(10, ge=1, le=100, description="Số blob dùng chung nhiều nhất"),
+    db: Session = Depends(get_db)
+):
+    """
+    Dung lượng đã tiết kiệm nhờ lưu hình theo nội dung: logical_bytes (tổng theo tên), stored_bytes (lưu thật),
+    reclaimed_bytes, dedupable_bytes (hình trùng còn lưu theo tên, tiết kiệm được khi chạy dedup)
+    """
+    try:
+        return picture_store.report(db, top)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi khi lấy báo cáo dung lượng hình ảnh: {str(e)}")
+
 # Chạy server
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
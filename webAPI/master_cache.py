@@ -0,0 +1,179 @@
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from text_utils import fold_vietnamese
+
+
+class MasterTable:
+    """
+    Bản sao trong bộ nhớ của một bảng danh mục (loaihang, khachhang, xe, camera)
+    cùng chỉ mục các cột văn bản đã bỏ dấu
+    """
+
+    def __init__(self, name: str, model, text_columns: List[str]):
+        self.name = name
+        self.model = model
+        self.columns = [column.key for column in model.__table__.columns]
+        self.primary_key = [column.key for column in model.__table__.primary_key.columns]
+        self.text_columns = text_columns
+        self.rows: List[dict] = []
+        self.folded: List[Dict[str, str]] = []
+        self.signature = None
+        self.loaded_at = 0.0
+        self.checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.checks = 0
+
+    def load(self, db: Session):
+        """Đọc toàn bộ bảng và dựng lại chỉ mục bỏ dấu"""
+        query = db.query(self.model).order_by(*[getattr(self.model, key) for key in self.primary_key])
+        rows = [{key: getattr(obj, key) for key in self.columns} for obj in query.all()]
+        self.rows = rows
+        self.folded = [{key: fold_vietnamese(row[key]) for key in self.text_columns} for row in rows]
+        self.signature = self.fetch_signature(db)
+        self.loaded_at = self.checked_at = time.monotonic()
+        self.reloads += 1
+
+    def fetch_signature(self, db: Session):
+        """
+        Truy vấn phát hiện thay đổi: số dòng + checksum (SQL Server)
+        Các database khác chỉ dùng số dòng
+        """
+        table = db.bind.dialect.identifier_preparer.quote(self.model.__tablename__)
+        if db.bind.dialect.name == "mssql":
+            sql = f"SELECT COUNT_BIG(*), CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM {table}"
+        else:
+            sql = f"SELECT COUNT(*), NULL FROM {table}"
+        row = db.execute(text(sql)).first()
+        return (row[0], row[1])
+
+
+class MasterDataCache:
+    """
+    Cache trong tiến trình cho các bảng danh mục ít thay đổi.
+
+    - Mỗi bảng được nạp một lần, các bộ lọc được trả lời từ bộ nhớ
+    - Sau mỗi check_interval giây chạy truy vấn phát hiện thay đổi (số dòng + checksum),
+      nạp lại nếu khác
+    - Sau ttl giây luôn nạp lại, kể cả khi checksum không đổi
+    """
+
+    def __init__(self, ttl: float = 300, check_interval: float = 10):
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.tables: Dict[str, MasterTable] = {}
+        self._listeners: List[Callable[[str, List[dict], List[dict]], None]] = []
+        self._lock = threading.Lock()
+
+    def register(self, name: str, model, text_columns: List[str]):
+        """Đăng ký một bảng danh mục với các cột văn bản cần lập chỉ mục bỏ dấu"""
+        self.tables[name] = MasterTable(name, model, text_columns)
+
+    def add_listener(self, callback: Callable[[str, List[dict], List[dict]], None]):
+        """Đăng ký callback(name, old_rows, new_rows) được gọi mỗi khi một bảng được nạp lại"""
+        self._listeners.append(callback)
+
+    def invalidate(self, name: Optional[str] = None):
+        """Đánh dấu một bảng (hoặc tất cả) cần nạp lại ở lần truy cập tiếp theo"""
+        with self._lock:
+            for table in self.tables.values():
+                if name is None or table.name == name:
+                    table.loaded_at = 0.0
+                    table.signature = None
+
+    def _ensure_fresh(self, table: MasterTable, db: Session):
+        """Nạp lại bảng nếu chưa nạp, quá TTL hoặc truy vấn phát hiện thay đổi khác"""
+        now = time.monotonic()
+        reload = table.signature is None or now - table.loaded_at >= self.ttl
+        if not reload and now - table.checked_at >= self.check_interval:
+            table.checks += 1
+            table.checked_at = now
+            reload = table.fetch_signature(db) != table.signature
+
+        if not reload:
+            table.hits += 1
+            return
+
+        table.misses += 1
+        old_rows = table.rows
+        table.load(db)
+        for callback in self._listeners:
+            callback(table.name, old_rows, table.rows)
+
+    def rows(self, db: Session, name: str) -> List[dict]:
+        """Trả về toàn bộ dòng của bảng (đã đảm bảo còn mới)"""
+        table = self.tables[name]
+        with self._lock:
+            self._ensure_fresh(table, db)
+            return table.rows
+
+    def query(
+        self,
+        db: Session,
+        name: str,
+        contains: Optional[Dict[str, Optional[str]]] = None,
+        equals: Optional[Dict[str, object]] = None,
+        offset: Optional[int] = None,
+        limit: Optional[int] = None
+    ) -> List[dict]:
+        """
+        Lọc bảng danh mục từ bộ nhớ
+        Args:
+            contains: {cột: giá trị} - tìm chuỗi con không phân biệt hoa thường và dấu
+            equals: {cột: giá trị} - so sánh bằng
+            offset, limit: phân trang
+        Returns:
+            list[dict]: Các dòng khớp điều kiện
+        """
+        table = self.tables[name]
+        needles = {key: fold_vietnamese(value) for key, value in (contains or {}).items() if value}
+        exact = {key: value for key, value in (equals or {}).items() if value is not None}
+
+        with self._lock:
+            self._ensure_fresh(table, db)
+            rows, folded = table.rows, table.folded
+
+        results = []
+        skip = offset if offset and offset > 0 else 0
+        for row, folded_row in zip(rows, folded):
+            if any(needle not in folded_row[key] for key, needle in needles.items()):
+                continue
+            if any(row[key] != value for key, value in exact.items()):
+                continue
+            if skip:
+                skip -= 1
+                continue
+            results.append(row)
+            if limit and limit > 0 and len(results) >= limit:
+                break
+        return results
+
+    def stats(self) -> dict:
+        """Thống kê hit/miss của từng bảng"""
+        now = time.monotonic()
+        result = {}
+        for table in self.tables.values():
+            result[table.name] = {
+                "rows": len(table.rows),
+                "hits": table.hits,
+                "misses": table.misses,
+                "reloads": table.reloads,
+                "change_checks": table.checks,
+                "age_seconds": round(now - table.loaded_at, 1) if table.signature is not None else None
+            }
+        return result
+
+
+def create_master_cache() -> MasterDataCache:
+    """Tạo MasterDataCache với cấu hình từ environment"""
+    return MasterDataCache(
+        ttl=float(os.getenv("MASTER_CACHE_TTL", "300")),
+        check_interval=float(os.getenv("MASTER_CACHE_CHECK_INTERVAL", "10"))
+    )
@@ -0,0 +1,252 @@
+import bisect
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from starlette.routing import Match
+
+# Mốc histogram (giây) cho thời gian xử lý, thời gian database và serialize
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Mốc histogram (bytes) cho kích thước response
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class RequestMetrics:
+    """Số liệu của một request, được các phần xử lý (database, serialize, quét hình ảnh) cộng dồn"""
+
+    __slots__ = ("route", "db_seconds", "db_queries", "serialize_seconds", "files_scanned")
+
+    def __init__(self, route: str = UNMATCHED_ROUTE):
+        self.route = route
+        self.db_seconds = 0.0
+        self.db_queries = 0
+        self.serialize_seconds = 0.0
+        self.files_scanned = 0
+
+
+# Request đang xử lý; run_in_threadpool sao chép context nên thread worker cộng vào cùng đối tượng
+_current: ContextVar[Optional[RequestMetrics]] = ContextVar("request_metrics", default=None)
+
+
+def current_route() -> Optional[str]:
+    """Đường dẫn mẫu của route đang xử lý, None nếu ngoài request (job nền, CLI)"""
+    current = _current.get()
+    return current.route if current is not None else None
+
+
+def record_serialization(seconds: float):
+    """Cộng thời gian serialize response vào request hiện tại"""
+    current = _current.get()
+    if current is not None:
+        current.serialize_seconds += seconds
+
+
+def count_files(count: int):
+    """Cộng số file đã duyệt khi quét thư mục hình ảnh vào request hiện tại"""
+    current = _current.get()
+    if current is not None:
+        current.files_scanned += count
+
+
+class Histogram:
+    """Histogram tích lũy kiểu Prometheus (bucket đếm số quan sát <= mốc)"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """
+    Số liệu theo route (đường dẫn mẫu của FastAPI, vd. /xe/{plate}/profile) để xuất ra /metrics:
+    - Số request theo status, số request đang xử lý
+    - Histogram thời gian xử lý, kích thước response, thời gian database và thời gian serialize
+    - Số câu SQL và số file hình ảnh đã quét
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        self.in_flight: Dict[Tuple[str, str], int] = {}
+        self.duration: Dict[Tuple[str, str], Histogram] = {}
+        self.response_size: Dict[Tuple[str, str], Histogram] = {}
+        self.db_time: Dict[Tuple[str, str], Histogram] = {}
+        self.serialize_time: Dict[Tuple[str, str], Histogram] = {}
+        self.db_queries: Dict[Tuple[str, str], int] = {}
+        self.files_scanned: Dict[Tuple[str, str], int] = {}
+        self.started_at = time.time()
+
+    @staticmethod
+    def _observe(histograms: Dict[Tuple[str, str], Histogram], key: Tuple[str, str], value: float, buckets: Tuple[float, ...]):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def start(self, method: str, route: str):
+        with self._lock:
+            key = (method, route)
+            self.in_flight[key] = self.in_flight.get(key, 0) + 1
+
+    def finish(self, method: str, route: str, status: int, seconds: float, size: int, request: RequestMetrics):
+        key = (method, route)
+        with self._lock:
+            self.in_flight[key] -= 1
+            self.requests[(method, route, status)] = self.requests.get((method, route, status), 0) + 1
+            self._observe(self.duration, key, seconds, LATENCY_BUCKETS)
+            self._observe(self.response_size, key, size, SIZE_BUCKETS)
+            if request.db_queries:
+                self._observe(self.db_time, key, request.db_seconds, LATENCY_BUCKETS)
+                self.db_queries[key] = self.db_queries.get(key, 0) + request.db_queries
+            if request.serialize_seconds:
+                self._observe(self.serialize_time, key, request.serialize_seconds, LATENCY_BUCKETS)
+            if request.files_scanned:
+                self.files_scanned[key] = self.files_scanned.get(key, 0) + request.files_scanned
+
+    def render(self) -> str:
+        """Xuất số liệu theo định dạng text của Prometheus (text/plain; version=0.0.4)"""
+        lines: List[str] = []
+
+        def header(name: str, kind: str, help_text: str):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def histograms(name: str, help_text: str, values: Dict[Tuple[str, str], Histogram]):
+            header(name, "histogram", help_text)
+            for (method, route), histogram in sorted(values.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(method=method, route=route, le=_format_number(bound))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(method=method, route=route)} {_format_number(histogram.sum)}")
+                lines.append(f"{name}_count{_labels(method=method, route=route)} {histogram.count}")
+
+        def counters(name: str, kind: str, help_text: str, values: Dict[Tuple[str, str], int]):
+            header(name, kind, help_text)
+            for (method, route), value in sorted(values.items()):
+                lines.append(f"{name}{_labels(method=method, route=route)} {value}")
+
+        with self._lock:
+            header("http_requests_total", "counter", "Số request HTTP đã xử lý")
+            for (method, route, status), value in sorted(self.requests.items()):
+                lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {value}")
+            counters("http_requests_in_flight", "gauge", "Số request đang xử lý", self.in_flight)
+            histograms("http_request_duration_seconds", "Thời gian xử lý request (giây)", self.duration)
+            histograms("http_response_size_bytes", "Kích thước body response (bytes, sau khi nén)", self.response_size)
+            histograms("http_request_db_seconds", "Tổng thời gian chạy SQL của request (giây)", self.db_time)
+            histograms("http_request_serialize_seconds", "Thời gian serialize response của request (giây)", self.serialize_time)
+            counters("db_queries_total", "counter", "Số câu SQL đã chạy", self.db_queries)
+            counters("picture_files_scanned_total", "counter", "Số file hình ảnh đã duyệt khi quét thư mục", self.files_scanned)
+            header("process_start_time_seconds", "gauge", "Thời điểm khởi động API (unix time)")
+            lines.append(f"process_start_time_seconds {_format_number(self.started_at)}")
+        return "\n".join(lines) + "\n"
+
+
+def instrument_engine(engine):
+    """Đo thời gian từng câu SQL của engine và cộng vào request đang xử lý"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        current = _current.get()
+        started = getattr(context, "_metrics_started", None)
+        if current is not None and started is not None:
+            current.db_seconds += time.perf_counter() - started
+            current.db_queries += 1
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware ghi số liệu mỗi request HTTP vào MetricsRegistry.
+    Route được xác định theo bảng route của ứng dụng (không dùng đường dẫn thật để giới hạn số nhãn),
+    request không khớp route nào được gom vào nhãn <unmatched>.
+    """
+
+    def __init__(self, app, registry: MetricsRegistry, router, max_cached_paths: int = 4096):
+        self.app = app
+        self.registry = registry
+        self.router = router
+        self.max_cached_paths = max_cached_paths
+        # đường dẫn thật -> đường dẫn mẫu của route
+        self._route_cache: Dict[str, str] = {}
+
+    def _route_template(self, scope) -> str:
+        path = scope["path"]
+        template = self._route_cache.get(path)
+        if template is not None:
+            return template
+        template = UNMATCHED_ROUTE
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match != Match.NONE:
+                template = route.path
+                break
+        if len(self._route_cache) >= self.max_cached_paths:
+            self._route_cache.clear()
+        self._route_cache[path] = template
+        return template
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = self._route_template(scope)
+        request = RequestMetrics(route)
+        token = _current.set(request)
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        self.registry.start(method, route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.registry.finish(method, route, status, time.perf_counter() - started, size, request)
+            _current.reset(token)
+
+
+def metrics_enabled() -> bool:
+    """Bật/tắt thu thập số liệu và API /metrics (METRICS_ENABLED, mặc định bật)"""
+    return os.getenv("METRICS_ENABLED", "true").lower() == "true"
@@ -0,0 +1,407 @@
+"""
+Quản lý migration schema (index, thay đổi cột...) cho database.
+
+Chạy khi khởi động API (RUN_MIGRATIONS_ON_STARTUP=true) hoặc thủ công:
+    python migrations.py                          # Áp dụng migration còn thiếu và kiểm tra
+    python migrations.py --manual                 # Áp dụng cả migration chạy thủ công (sửa dữ liệu...)
+    python migrations.py --check                  # Chỉ kiểm tra
+    python migrations.py --plan-report plans.md   # Áp dụng và ghi báo cáo so sánh query plan trước/sau
+
+Migration manual (sửa dữ liệu phiếu, đổi cấu hình database) không chạy khi khởi động API,
+người quản trị chạy bằng --manual vào lúc phù hợp (ngoài giờ cân, đã sao lưu).
+"""
+import argparse
+import xml.etree.ElementTree as ET
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from database import engine as default_engine, PictureCatalog, SchemaMigration, TICKET_MODELS, User
+
+SHOWPLAN_NS = {"p": "http://schemas.microsoft.com/sqlserver/2004/07/showplan"}
+
+
+class Migration:
+    """
+    Một bước migration
+    Args:
+        id: Mã migration (duy nhất, theo thứ tự)
+        apply: Hàm áp dụng (phải chạy lại được nhiều lần)
+        verify: Hàm kiểm tra, trả về danh sách lỗi (rỗng nếu đúng)
+        manual: Chỉ chạy khi được yêu cầu (python migrations.py --manual), không chạy khi khởi động API
+    """
+
+    def __init__(self, id: str, description: str, apply: Callable[[Connection], None], verify: Optional[Callable[[Connection], List[str]]] = None, manual: bool = False):
+        self.id = id
+        self.description = description
+        self.apply = apply
+        self.verify = verify or (lambda conn: [])
+        self.manual = manual
+
+
+# ==== Migration 0001: index cho các bảng phiếu ====
+
+def _create_ticket_indexes(conn: Connection):
+    """Tạo các index khai báo trong database.ticket_indexes nếu chưa có"""
+    for model in TICKET_MODELS.values():
+        for index in model.__table__.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def _verify_ticket_indexes(conn: Connection) -> List[str]:
+    """Kiểm tra các index đã tồn tại, index lọc có đúng điều kiện xoaphieu = 0"""
+    problems = []
+    for table, model in TICKET_MODELS.items():
+        if conn.dialect.name == "mssql":
+            rows = conn.execute(
+                text("SELECT name, has_filter, filter_definition FROM sys.indexes WHERE object_id = OBJECT_ID(:table)"),
+                {"table": table}
+            ).all()
+            existing = {row.name: row for row in rows}
+        else:
+            existing = {index["name"]: None for index in inspect(conn).get_indexes(table)}
+
+        for index in model.__table__.indexes:
+            if index.name not in existing:
+                problems.append(f"{table}: thiếu index {index.name}")
+                continue
+            row = existing[index.name]
+            if row is not None and index.dialect_options["mssql"]["where"] is not None:
+                definition = (row.filter_definition or "").replace("[", "").replace("]", "").replace("(", "").replace(")", "")
+                if not row.has_filter or definition.replace(" ", "") != "xoaphieu=0":
+                    problems.append(f"{table}: index {index.name} không có điều kiện lọc xoaphieu = 0")
+    return problems
+
+
+# ==== Migration 0002: xoaphieu NULL -> 0 ====
+
+XOAPHIEU_MIGRATION_ID = "0002_xoaphieu_not_null"
+
+
+def _xoaphieu_default_exists(conn: Connection, table: str) -> bool:
+    """Kiểm tra cột xoaphieu đã có DEFAULT constraint (SQL Server)"""
+    return conn.execute(
+        text(
+            "SELECT COUNT(*) FROM sys.default_constraints dc "
+            "JOIN sys.columns c ON c.object_id = dc.parent_object_id AND c.column_id = dc.parent_column_id "
+            "WHERE dc.parent_object_id = OBJECT_ID(:table) AND c.name = 'xoaphieu'"
+        ),
+        {"table": table}
+    ).scalar() > 0
+
+
+def _backfill_xoaphieu(conn: Connection):
+    """
+    Phiếu cũ có xoaphieu NULL được coi là chưa xóa, để khớp điều kiện xoaphieu = 0.
+    Thêm DEFAULT 0 ở database để phiếu do VB App thêm mới không bị NULL.
+    """
+    for table, model in TICKET_MODELS.items():
+        conn.execute(model.__table__.update().where(model.xoaphieu.is_(None)).values(xoaphieu=0))
+        if conn.dialect.name == "mssql" and not _xoaphieu_default_exists(conn, table):
+            conn.exec_driver_sql(f"ALTER TABLE [{table}] ADD CONSTRAINT [DF_{table}_xoaphieu] DEFAULT 0 FOR [xoaphieu]")
+
+
+def _verify_xoaphieu(conn: Connection) -> List[str]:
+    problems = []
+    for table, model in TICKET_MODELS.items():
+        count = conn.execute(select(func.count()).select_from(model).where(model.xoaphieu.is_(None))).scalar()
+        if count:
+            problems.append(f"{table}: còn {count} phiếu có xoaphieu NULL")
+        if conn.dialect.name == "mssql" and not _xoaphieu_default_exists(conn, table):
+            problems.append(f"{table}: cột xoaphieu chưa có DEFAULT 0")
+    return problems
+
+
+# ==== Migration 0003: cột user.password đủ dài cho mật khẩu đã hash ====
+
+PASSWORD_LENGTH = User.__table__.c.password.type.length
+
+
+def _password_column(conn: Connection):
+    return conn.execute(
+        text(
+            "SELECT DATA_TYPE, CHARACTER_MAXIMUM_LENGTH, IS_NULLABLE FROM INFORMATION_SCHEMA.COLUMNS "
+            "WHERE TABLE_NAME = 'user' AND COLUMN_NAME = 'password'"
+        )
+    ).first()
+
+
+def _widen_password(conn: Connection):
+    """Mở rộng cột password (giữ kiểu varchar/nvarchar và NULL/NOT NULL hiện tại)"""
+    if conn.dialect.name != "mssql":
+        return
+    column = _password_column(conn)
+    if column is None or column.CHARACTER_MAXIMUM_LENGTH == -1 or column.CHARACTER_MAXIMUM_LENGTH >= PASSWORD_LENGTH:
+        return
+    nullable = "NULL" if column.IS_NULLABLE == "YES" else "NOT NULL"
+    conn.exec_driver_sql(f"ALTER TABLE [user] ALTER COLUMN [password] {column.DATA_TYPE}({PASSWORD_LENGTH}) {nullable}")
+
+
+def _verify_password_column(conn: Connection) -> List[str]:
+    if conn.dialect.name != "mssql":
+        return []
+    column = _password_column(conn)
+    if column is None:
+        return ["user: không tìm thấy cột password"]
+    if column.CHARACTER_MAXIMUM_LENGTH != -1 and column.CHARACTER_MAXIMUM_LENGTH < PASSWORD_LENGTH:
+        return [f"user: cột password chỉ dài {column.CHARACTER_MAXIMUM_LENGTH}, cần {PASSWORD_LENGTH}"]
+    return []
+
+
+# ==== Migration 0004: cột content_hash/blob_key cho danh mục hình ảnh (lưu trữ theo nội dung) ====
+
+PICTURE_CONTENT_COLUMNS = ("content_hash", "blob_key")
+
+
+def _add_picture_content_columns(conn: Connection):
+    """Thêm cột content_hash, blob_key và index IX_picture_catalog_hash vào picture_catalog đã tạo trước đó"""
+    table = PictureCatalog.__table__
+    if not inspect(conn).has_table(table.name):
+        table.create(conn)
+        return
+    existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    quote = conn.dialect.identifier_preparer.quote
+    for name in PICTURE_CONTENT_COLUMNS:
+        if name not in existing:
+            column_type = table.c[name].type.compile(dialect=conn.dialect)
+            conn.exec_driver_sql(f"ALTER TABLE {quote(table.name)} ADD {quote(name)} {column_type} NULL")
+    for index in table.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _verify_picture_content_columns(conn: Connection) -> List[str]:
+    table = PictureCatalog.__table__
+    if not inspect(conn).has_table(table.name):
+        return [f"{table.name}: chưa có bảng"]
+    existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    problems = [f"{table.name}: thiếu cột {name}" for name in PICTURE_CONTENT_COLUMNS if name not in existing]
+    indexes = {index["name"] for index in inspect(conn).get_indexes(table.name)}
+    problems.extend(f"{table.name}: thiếu index {index.name}" for index in table.indexes if index.name not in indexes)
+    return problems
+
+
+# ==== Migration 0005: bật Change Tracking cho các bảng phiếu (SQL Server) ====
+
+CHANGE_RETENTION_DAYS = 7
+
+
+def _enable_change_tracking(conn: Connection):
+    """
+    Bật Change Tracking cho database và 4 bảng phiếu: token ETag và /sync/tickets đọc phiên bản thay đổi
+    thay vì quét checksum cả bảng. ALTER DATABASE không chạy được trong transaction nên dùng kết nối autocommit.
+    """
+    if conn.dialect.name != "mssql":
+        return
+    with conn.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as autocommit:
+        enabled = autocommit.execute(
+            text("SELECT COUNT(*) FROM sys.change_tracking_databases WHERE database_id = DB_ID()")
+        ).scalar() > 0
+        if not enabled:
+            autocommit.exec_driver_sql(
+                "DECLARE @sql nvarchar(max) = N'ALTER DATABASE ' + QUOTENAME(DB_NAME()) + "
+                f"N' SET CHANGE_TRACKING = ON (CHANGE_RETENTION = {CHANGE_RETENTION_DAYS} DAYS, AUTO_CLEANUP = ON)'; "
+                "EXEC (@sql)"
+            )
+        for table in TICKET_MODELS:
+            if not _change_tracking_enabled(autocommit, table):
+                autocommit.exec_driver_sql(f"ALTER TABLE [{table}] ENABLE CHANGE_TRACKING")
+
+
+def _change_tracking_enabled(conn: Connection, table: str) -> bool:
+    return conn.execute(
+        text("SELECT COUNT(*) FROM sys.change_tracking_tables WHERE object_id = OBJECT_ID(:table)"),
+        {"table": table}
+    ).scalar() > 0
+
+
+def _verify_change_tracking(conn: Connection) -> List[str]:
+    if conn.dialect.name != "mssql":
+        return []
+    return [f"{table}: chưa bật Change Tracking" for table in TICKET_MODELS if not _change_tracking_enabled(conn, table)]
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(
+        "0001_ticket_indexes",
+        "Index ngaycan/khachhang/loaihang/bienso1_1 và filtered index xoaphieu = 0 cho 4 bảng phiếu",
+        _create_ticket_indexes,
+        _verify_ticket_indexes
+    ),
+    Migration(
+        XOAPHIEU_MIGRATION_ID,
+        "Đặt xoaphieu = 0 cho phiếu có xoaphieu NULL (phiếu chưa xóa)",
+        _backfill_xoaphieu,
+        _verify_xoaphieu,
+        manual=True
+    ),
+    Migration(
+        "0003_user_password_length",
+        "Mở rộng user.password để lưu mật khẩu đã hash (scrypt)",
+        _widen_password,
+        _verify_password_column
+    ),
+    Migration(
+        "0004_picture_content_hash",
+        "Thêm content_hash/blob_key vào picture_catalog để lưu hình trùng nội dung một lần (PICTURE_DEDUP)",
+        _add_picture_content_columns,
+        _verify_picture_content_columns
+    ),
+    Migration(
+        "0005_ticket_change_tracking",
+        "Bật SQL Server Change Tracking cho 4 bảng phiếu (ETag, /sync/tickets không quét cả bảng); khởi động lại API sau khi chạy",
+        _enable_change_tracking,
+        _verify_change_tracking,
+        manual=True
+    )
+]
+
+
+# ==== Query plan ====
+
+def hot_query_shapes(table: str = "nhapkho") -> Dict[str, object]:
+    """Các dạng truy vấn danh sách phiếu thường gặp nhất (giá trị mẫu) để so sánh query plan"""
+    model = TICKET_MODELS[table]
+    recent = date.today() - timedelta(days=30)
+    newest_first = (model.ngaycan.desc(), model.sophieu.desc())
+    return {
+        "30 ngày gần nhất": select(model).where(model.ngaycan >= recent).order_by(*newest_first).limit(100),
+        "Phiếu chưa xóa, 30 ngày gần nhất": select(model).where(model.xoaphieu == 0, model.ngaycan >= recent).order_by(*newest_first).limit(100),
+        "Theo khách hàng": select(model).where(model.khachhang.like("%ABC%")).order_by(*newest_first).limit(100),
+        "Theo loại hàng": select(model).where(model.loaihang.like("GAO%")).order_by(*newest_first).limit(100),
+        "Theo biển số": select(model).where(model.bienso1_1 == "51D12345").order_by(*newest_first)
+    }
+
+
+def _literal_sql(conn: Connection, stmt) -> str:
+    return str(stmt.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+
+
+def capture_plan(conn: Connection, stmt) -> dict:
+    """
+    Lấy query plan ước lượng (không thực thi câu lệnh)
+    Returns:
+        dict: {cost, operators} - cost chỉ có với SQL Server
+    """
+    sql = _literal_sql(conn, stmt)
+    if conn.dialect.name == "mssql":
+        conn.exec_driver_sql("SET SHOWPLAN_XML ON")
+        try:
+            plan_xml = conn.exec_driver_sql(sql).scalar()
+        finally:
+            conn.exec_driver_sql("SET SHOWPLAN_XML OFF")
+        root = ET.fromstring(plan_xml)
+        statement = root.find(".//p:StmtSimple", SHOWPLAN_NS)
+        operators = []
+        for rel_op in root.iter(f"{{{SHOWPLAN_NS['p']}}}RelOp"):
+            obj = rel_op.find("./*/p:Object", SHOWPLAN_NS)
+            index_name = obj.get("Index", "") if obj is not None else ""
+            operators.append(f"{rel_op.get('PhysicalOp')} {index_name}".strip())
+        return {
+            "cost": float(statement.get("StatementSubTreeCost", 0)) if statement is not None else None,
+            "operators": operators
+        }
+    if conn.dialect.name == "sqlite":
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").all()
+        return {"cost": None, "operators": [row[-1] for row in rows]}
+    return {"cost": None, "operators": []}
+
+
+def capture_plans(conn: Connection) -> Dict[str, dict]:
+    return {name: capture_plan(conn, stmt) for name, stmt in hot_query_shapes().items()}
+
+
+def format_plan_report(before: Dict[str, dict], after: Dict[str, dict]) -> str:
+    """Báo cáo Markdown so sánh query plan trước và sau migration"""
+    lines = [f"# Query plan trước/sau migration ({datetime.now().isoformat(timespec='seconds')})", ""]
+    for name in after:
+        lines.append(f"## {name}")
+        lines.append("")
+        for label, plans in (("Trước", before), ("Sau", after)):
+            plan = plans.get(name)
+            if plan is None:
+                continue
+            cost = f" (cost {plan['cost']:.4f})" if plan["cost"] is not None else ""
+            lines.append(f"- {label}{cost}: {' → '.join(plan['operators']) or 'không có'}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+# ==== Runner ====
+
+def is_applied(conn: Connection, migration_id: str) -> bool:
+    """Migration đã được áp dụng trên database chưa"""
+    if not inspect(conn).has_table(SchemaMigration.__tablename__):
+        return False
+    return conn.execute(select(SchemaMigration.id).where(SchemaMigration.id == migration_id)).first() is not None
+
+
+def run_migrations(engine: Engine = default_engine, plan_report_path: Optional[str] = None, check_only: bool = False, include_manual: bool = False) -> dict:
+    """
+    Áp dụng các migration chưa chạy, kiểm tra tất cả và áp dụng lại migration kiểm tra thất bại
+    Args:
+        include_manual: Áp dụng cả migration manual (mặc định bỏ qua, chỉ báo còn chờ)
+    Returns:
+        dict: {applied, repaired, pending, problems}
+    """
+    SchemaMigration.__table__.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        applied_ids = set(conn.execute(select(SchemaMigration.id)).scalars())
+        before = capture_plans(conn) if plan_report_path else None
+
+    report = {"applied": [], "repaired": [], "pending": [], "problems": []}
+    for migration in MIGRATIONS:
+        if migration.manual and not include_manual and migration.id not in applied_ids:
+            report["pending"].append(migration.id)
+            continue
+        if migration.id in applied_ids:
+            with engine.connect() as conn:
+                problems = migration.verify(conn)
+            if not problems:
+                continue
+            if check_only:
+                report["problems"].extend(problems)
+                continue
+            report["repaired"].append(migration.id)
+        elif check_only:
+            report["problems"].append(f"Chưa áp dụng migration {migration.id}")
+            continue
+
+        with engine.begin() as conn:
+            migration.apply(conn)
+            if migration.id not in applied_ids:
+                conn.execute(SchemaMigration.__table__.insert().values(
+                    id=migration.id,
+                    description=migration.description,
+                    applied_at=datetime.now()
+                ))
+                report["applied"].append(migration.id)
+        with engine.connect() as conn:
+            report["problems"].extend(migration.verify(conn))
+
+    if plan_report_path:
+        with engine.connect() as conn:
+            after = capture_plans(conn)
+        with open(plan_report_path, "w", encoding="utf-8") as f:
+            f.write(format_plan_report(before, after))
+
+    for migration_id in report["applied"]:
+        print(f"🛠️ Đã áp dụng migration {migration_id}")
+    for migration_id in report["repaired"]:
+        print(f"🛠️ Đã áp dụng lại migration {migration_id}")
+    for migration_id in report["pending"]:
+        print(f"⏭️ Bỏ qua migration {migration_id} (chạy thủ công: python migrations.py --manual)")
+    for problem in report["problems"]:
+        print(f"⚠️ Migration: {problem}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Áp dụng và kiểm tra migration database")
+    parser.add_argument("--check", action="store_true", help="Chỉ kiểm tra, không thay đổi database")
+    parser.add_argument("--plan-report", help="Ghi báo cáo so sánh query plan trước/sau vào file Markdown")
+    parser.add_argument("--manual", action="store_true", help="Áp dụng cả migration chạy thủ công (sửa dữ liệu phiếu...)")
+    args = parser.parse_args()
+    result = run_migrations(plan_report_path=args.plan_report, check_only=args.check, include_manual=args.manual)
+    raise SystemExit(1 if result["problems"] else 0)
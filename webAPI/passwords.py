@@ -0,0 +1,126 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional, Tuple
+
+# Tiền tố của mật khẩu đã hash; giá trị không có tiền tố là mật khẩu dạng text cũ
+SCRYPT_PREFIX = "scrypt$"
+
+
+class PasswordHasherBusy(Exception):
+    """Hàng đợi hash mật khẩu đã đầy (quá nhiều đăng nhập cùng lúc)"""
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    # Chạy trong worker thread/process: hashlib.scrypt nhả GIL nên không chiếm event loop
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, maxmem=128 * n * r * 2, dklen=32)
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def is_hashed(stored: Optional[str]) -> bool:
+    return bool(stored) and stored.startswith(SCRYPT_PREFIX)
+
+
+class PasswordHasher:
+    """
+    Hash/kiểm tra mật khẩu bằng scrypt trong pool thread riêng (hoặc pool process), giới hạn số yêu cầu đang chờ.
+
+    - Định dạng lưu: scrypt$<n>$<r>$<p>$<salt base64>$<hash base64>
+    - Mật khẩu text cũ vẫn đăng nhập được, verify báo cần nâng cấp để lưu lại dạng hash
+    - Quá workers + max_queue yêu cầu cùng lúc thì từ chối ngay (PasswordHasherBusy)
+      thay vì xếp hàng vô hạn, để đợt đăng nhập đổi ca không làm chậm các API khác
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 32, n: int = 2 ** 14, r: int = 8, p: int = 1, use_processes: bool = False):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.n = n
+        self.r = r
+        self.p = p
+        self.use_processes = use_processes
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.use_processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    async def _run(self, password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise PasswordHasherBusy("Hệ thống đang bận xử lý đăng nhập, vui lòng thử lại sau")
+            self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), _scrypt, password, salt, n, r, p)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        """Hash mật khẩu để lưu vào User.password"""
+        salt = secrets.token_bytes(16)
+        digest = await self._run(password, salt, self.n, self.r, self.p)
+        return f"{SCRYPT_PREFIX}{self.n}${self.r}${self.p}${_b64(salt)}${_b64(digest)}"
+
+    async def verify(self, password: str, stored: Optional[str]) -> Tuple[bool, bool]:
+        """
+        Kiểm tra mật khẩu
+        Returns:
+            (đúng mật khẩu, cần lưu lại dạng hash mới)
+        """
+        if not stored:
+            return False, False
+        if not is_hashed(stored):
+            # Mật khẩu text cũ: so sánh thời gian hằng, nâng cấp khi đăng nhập đúng
+            ok = hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+            return ok, ok
+        try:
+            _, n, r, p, salt, expected = stored.split("$")
+            n, r, p = int(n), int(r), int(p)
+            salt, expected = base64.b64decode(salt), base64.b64decode(expected)
+        except ValueError:
+            return False, False
+        digest = await self._run(password, salt, n, r, p)
+        ok = hmac.compare_digest(digest, expected)
+        return ok, ok and (n, r, p) != (self.n, self.r, self.p)
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "pending": self._pending, "max_queue": self.max_queue, "rejected": self.rejected}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def create_password_hasher() -> PasswordHasher:
+    """
+    Tạo PasswordHasher với cấu hình từ environment.
+    Mặc định dùng thread pool (hashlib.scrypt nhả GIL). PASSWORD_HASH_POOL=process dùng pool process:
+    trên Windows process con được spawn và import lại main.py (tạo bảng, migration...), chỉ bật khi đã kiểm tra.
+    """
+    use_processes = os.getenv("PASSWORD_HASH_POOL", "thread").lower() == "process"
+    if use_processes and os.name == "nt":
+        print("⚠️ PASSWORD_HASH_POOL=process trên Windows: mỗi worker import lại main.py khi khởi động")
+    return PasswordHasher(
+        workers=int(os.getenv("PASSWORD_HASH_WORKERS", "2")),
+        max_queue=int(os.getenv("PASSWORD_HASH_QUEUE", "32")),
+        n=int(os.getenv("PASSWORD_SCRYPT_N", str(2 ** 14))),
+        use_processes=use_processes
+    )
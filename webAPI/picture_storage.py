@@ -0,0 +1,851 @@
+"""
+Lưu trữ hình ảnh phiếu cân: backend lưu file (thư mục cục bộ hoặc S3/MinIO) và danh mục picture_catalog
+trong database để tra cứu hình theo phiếu/ngày mà không phải quét thư mục.
+
+Đồng bộ danh mục với file đã có sẵn (hình chép thẳng vào PICTURE_BASE_PATH, chuyển từ bản cũ):
+    python picture_storage.py reindex
+    python picture_storage.py reindex --type NK --date 2025-08-17
+API tự thêm vào danh mục khi khởi động (PICTURE_REINDEX_ON_STARTUP, chạy nền) và theo từng thư mục được tra cứu
+(PICTURE_FOLDER_SYNC_SECONDS) cho hình trạm cân ghi thẳng vào thư mục.
+
+Lưu hình theo nội dung (PICTURE_DEDUP=true): hình trùng byte (camera treo, gửi lại cùng khung hình) chỉ lưu
+một lần tại cas/<2 ký tự>/<2 ký tự>/<sha256>, các tên [Số phiếu]-CMR[Camera]_[Sequence] là tham chiếu trong catalog.
+    python picture_storage.py dedup                   # Chuyển hình đang lưu theo tên sang lưu theo nội dung
+    python picture_storage.py report                  # Dung lượng đã tiết kiệm
+    python picture_storage.py sweep                   # Xóa blob không còn hình nào tham chiếu
+Xóa hình không xóa blob ngay (hình khác, tiến trình API hoặc node khác có thể đang dùng): chạy sweep định kỳ,
+chỉ xét blob cũ hơn PICTURE_BLOB_GRACE_SECONDS giây.
+"""
+import argparse
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from datetime import date, datetime
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import PictureCatalog
+from metrics import count_files
+
+# Thư viện S3 tùy chọn: pip install boto3 (PICTURE_STORAGE=s3)
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+    ClientError = None
+
+# Các loại phiếu có hình ảnh
+PICTURE_TYPES = {
+    "NK": "NhapKho",
+    "CT": "CanThue",
+    "NT": "NhapTau",
+    "XK": "XuatKho"
+}
+
+CHUNK_SIZE = 256 * 1024
+
+# Nội dung hình lưu theo hash (PICTURE_DEDUP): cas/ab/cd/<sha256>, file tạm khi upload: cas/tmp/<uuid>
+CAS_PREFIX = "cas/"
+CAS_TEMP_PREFIX = CAS_PREFIX + "tmp/"
+# Blob đang được sweep_blobs xóa: cas/trash/<sha256>.<thời điểm chuyển>.<id>
+CAS_TRASH_PREFIX = CAS_PREFIX + "trash/"
+
+_DATE_FOLDER = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+class PictureExists(Exception):
+    """Hình ảnh (cùng loại, ngày, tên file) đã tồn tại"""
+
+
+def parse_filename(filename: str):
+    """
+    Parse tên file để lấy thông tin
+    Args:
+        filename: Tên file (có thể có extension)
+    Returns:
+        dict: {ticket_number, camera_number, sequence} hoặc None nếu không match
+    """
+    # Loại bỏ extension
+    name_without_ext = os.path.splitext(filename)[0]
+
+    # Pattern: [Số phiếu]-CMR[Camera]_[Sequence]
+    match = re.match(r"^(.+)-CMR(\d+)_(\d+)$", name_without_ext)
+    if match:
+        return {
+            "ticket_number": match.group(1),
+            "camera_number": int(match.group(2)),
+            "sequence": int(match.group(3))
+        }
+    return None
+
+
+def picture_key(picture_type: str, picture_date: str, filename: str) -> str:
+    """Khóa của hình trong storage: <loại>/<YYYY-MM-DD>/<tên file>"""
+    return f"{picture_type}/{picture_date}/{filename}"
+
+
+def parse_picture_key(key: str) -> Optional[dict]:
+    """Thông tin hình từ khóa storage, None nếu không đúng cấu trúc <loại>/<ngày>/<số phiếu>-CMR<camera>_<lần>.ext"""
+    parts = key.split("/")
+    if len(parts) != 3 or parts[0] not in PICTURE_TYPES or not _DATE_FOLDER.match(parts[1]):
+        return None
+    info = parse_filename(parts[2])
+    if info is None:
+        return None
+    try:
+        picture_date = datetime.strptime(parts[1], "%Y-%m-%d").date()
+    except ValueError:
+        return None
+    return {**info, "picture_type": parts[0], "picture_date": picture_date, "filename": parts[2]}
+
+
+def guess_content_type(filename: str) -> str:
+    content_type, _ = mimetypes.guess_type(filename)
+    return content_type or "application/octet-stream"
+
+
+def content_key(content_hash: str) -> str:
+    """Khóa nội dung theo hash, chia thư mục 2 cấp để mỗi thư mục không quá nhiều file: cas/ab/cd/abcd..."""
+    return f"{CAS_PREFIX}{content_hash[:2]}/{content_hash[2:4]}/{content_hash}"
+
+
+def trash_key(blob_key: str) -> str:
+    """Khóa tạm của blob trong lúc sweep_blobs kiểm tra lại tham chiếu"""
+    return f"{CAS_TRASH_PREFIX}{blob_key.rsplit('/', 1)[-1]}.{int(time.time())}.{uuid.uuid4().hex[:8]}"
+
+
+def parse_trash_key(key: str) -> Optional[Tuple[str, float]]:
+    """(blob_key gốc, thời điểm chuyển vào thùng rác) hoặc None nếu không phải khóa thùng rác"""
+    if not key.startswith(CAS_TRASH_PREFIX):
+        return None
+    parts = key[len(CAS_TRASH_PREFIX):].split(".")
+    if len(parts) != 3 or not parts[1].isdigit():
+        return None
+    return content_key(parts[0]), float(parts[1])
+
+
+class _HashingReader:
+    """Bọc stream upload: tính SHA-256 trong lúc backend đọc để ghi, không phải đọc file hai lần"""
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.sha256.update(data)
+        return data
+
+    def hexdigest(self) -> str:
+        return self.sha256.hexdigest()
+
+
+class LocalPictureStorage:
+    """Lưu hình trong thư mục cục bộ (hoặc thư mục mạng dùng chung): <base_path>/<loại>/<ngày>/<tên file>"""
+
+    name = "local"
+
+    def __init__(self, base_path: str):
+        self.base_path = base_path
+
+    def _path(self, key: str) -> str:
+        root = os.path.realpath(self.base_path)
+        path = os.path.realpath(os.path.join(root, *key.split("/")))
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError(f"Khóa hình ảnh không hợp lệ: {key}")
+        return path
+
+    def location(self, key: str) -> str:
+        """Đường dẫn hiển thị cho client (trường file_path của API)"""
+        return os.path.join(self.base_path, *key.split("/")) if key else self.base_path
+
+    def key_from_location(self, location: str) -> Optional[str]:
+        """Khóa storage từ đường dẫn đầy đủ hoặc khóa tương đối, None nếu nằm ngoài thư mục hình ảnh"""
+        root = os.path.realpath(self.base_path)
+        path = os.path.realpath(location if os.path.isabs(location) else os.path.join(root, location))
+        if os.path.commonpath([root, path]) != root or path == root:
+            return None
+        return os.path.relpath(path, root).replace(os.sep, "/")
+
+    def save(self, key: str, stream: BinaryIO, content_type: str) -> int:
+        """Ghi stream vào file theo từng khối (không đọc cả file vào bộ nhớ), trả về số bytes"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            # "x": không ghi đè khi hai request upload cùng tên file
+            with open(path, "xb") as f:
+                shutil.copyfileobj(stream, f, CHUNK_SIZE)
+                return f.tell()
+        except FileExistsError:
+            raise PictureExists(f"File đã tồn tại: {os.path.basename(path)}")
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+
+    def link(self, source: str, target: str) -> bool:
+        """
+        Lưu nội dung của source tại target nếu target chưa có (hard link, không chép dữ liệu)
+        Returns:
+            bool: False nếu target đã tồn tại
+        """
+        source_path, target_path = self._path(source), self._path(target)
+        if os.path.exists(target_path):
+            return False
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        try:
+            os.link(source_path, target_path)
+        except FileExistsError:
+            return False
+        except OSError:
+            # Ổ không hỗ trợ hard link (một số thư mục mạng): chép ra file tạm rồi đổi tên
+            temp_path = f"{target_path}.{uuid.uuid4().hex}.tmp"
+            shutil.copyfile(source_path, temp_path)
+            os.replace(temp_path, target_path)
+        return True
+
+    def stat(self, key: str) -> Optional[Tuple[int, float]]:
+        """(kích thước, thời điểm sửa) hoặc None nếu không tồn tại"""
+        try:
+            path = self._path(key)
+            if not os.path.isfile(path):
+                return None
+            file_stat = os.stat(path)
+            return file_stat.st_size, file_stat.st_mtime
+        except (OSError, ValueError):
+            return None
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Đường dẫn file để trả bằng FileResponse"""
+        return self._path(key)
+
+    def iter_chunks(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        with open(self._path(key), "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def delete(self, key: str) -> bool:
+        try:
+            os.remove(self._path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def list(self, prefix: str = "") -> Iterator[Tuple[str, int, float]]:
+        """Mọi file dưới prefix: (khóa, kích thước, thời điểm sửa)"""
+        root = os.path.realpath(self.base_path)
+        start = self._path(prefix) if prefix else root
+        for folder, _, filenames in os.walk(start):
+            count_files(len(filenames))
+            for filename in filenames:
+                path = os.path.join(folder, filename)
+                try:
+                    file_stat = os.stat(path)
+                except OSError:
+                    continue
+                yield os.path.relpath(path, root).replace(os.sep, "/"), file_stat.st_size, file_stat.st_mtime
+
+
+class S3PictureStorage:
+    """
+    Lưu hình trong bucket S3 hoặc dịch vụ tương thích S3 (MinIO chạy cục bộ), khóa object: <prefix><loại>/<ngày>/<tên file>.
+    Nhiều API node dùng chung một bucket.
+    """
+
+    name = "s3"
+
+    def __init__(self, client, bucket: str, prefix: str = ""):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+
+    def _object(self, key: str) -> str:
+        return self.prefix + key
+
+    def location(self, key: str) -> str:
+        return f"s3://{self.bucket}/{self._object(key)}"
+
+    def key_from_location(self, location: str) -> Optional[str]:
+        root = f"s3://{self.bucket}/{self.prefix}"
+        if location.startswith(root):
+            location = location[len(root):]
+        elif location.startswith("s3://"):
+            return None
+        key = location.strip("/")
+        return key if key and ".." not in key.split("/") else None
+
+    def save(self, key: str, stream: BinaryIO, content_type: str) -> int:
+        if self.stat(key) is not None:
+            raise PictureExists(f"File đã tồn tại: {key.rsplit('/', 1)[-1]}")
+        # upload_fileobj gửi theo từng phần (multipart) với file lớn
+        self.client.upload_fileobj(stream, self.bucket, self._object(key), ExtraArgs={"ContentType": content_type})
+        return self.stat(key)[0]
+
+    def link(self, source: str, target: str) -> bool:
+        """Chép object source sang target ở phía S3 (không tải về) nếu target chưa có"""
+        if self.stat(target) is not None:
+            return False
+        self.client.copy_object(Bucket=self.bucket, Key=self._object(target), CopySource={"Bucket": self.bucket, "Key": self._object(source)})
+        return True
+
+    def stat(self, key: str) -> Optional[Tuple[int, float]]:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._object(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return head["ContentLength"], head["LastModified"].timestamp()
+
+    def local_path(self, key: str) -> Optional[str]:
+        return None
+
+    def iter_chunks(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        body = self.client.get_object(Bucket=self.bucket, Key=self._object(key))["Body"]
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def delete(self, key: str) -> bool:
+        if self.stat(key) is None:
+            return False
+        self.client.delete_object(Bucket=self.bucket, Key=self._object(key))
+        return True
+
+    def list(self, prefix: str = "") -> Iterator[Tuple[str, int, float]]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._object(prefix)):
+            contents = page.get("Contents", [])
+            count_files(len(contents))
+            for item in contents:
+                yield item["Key"][len(self.prefix):], item["Size"], item["LastModified"].timestamp()
+
+
+class PictureStore:
+    """
+    Hình ảnh = object trong storage + một dòng picture_catalog (loại, ngày, số phiếu, camera, lần chụp, kích thước, content type).
+    Tra cứu, liệt kê và metadata đọc từ catalog (có index), chỉ nội dung hình mới đọc từ storage.
+    Với dedup=True nội dung lưu một lần theo SHA-256 (content_key), nhiều dòng catalog cùng trỏ tới một blob_key.
+    Hình ghi thẳng vào storage (không qua API) được thêm vào catalog bởi reindex và sync_folder.
+    remove chỉ xóa dòng catalog, blob không còn tham chiếu do sweep_blobs xóa. Không dùng khóa trong tiến trình:
+    put/deduplicate commit tham chiếu rồi mới kiểm tra blob, sweep_blobs chuyển blob đi rồi mới kiểm tra tham chiếu,
+    nên đúng cả khi nhiều tiến trình API, lệnh dedup và nhiều node S3 dùng chung storage.
+    """
+
+    def __init__(self, storage, dedup: bool = False, folder_sync_interval: float = 10, blob_grace_seconds: float = 3600):
+        self.storage = storage
+        self.dedup = dedup
+        self.folder_sync_interval = folder_sync_interval
+        self.blob_grace_seconds = blob_grace_seconds
+        # Thư mục <loại>/<ngày>/ -> thời điểm (monotonic) đồng bộ gần nhất
+        self._folder_synced: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def blob_key(row: PictureCatalog) -> str:
+        """Khóa storage chứa nội dung của hình (blob theo hash hoặc chính khóa của hình)"""
+        return row.blob_key or row.storage_key
+
+    def put(self, db: Session, picture_type: str, picture_date: str, filename: str, stream: BinaryIO, content_type: Optional[str] = None) -> PictureCatalog:
+        """
+        Lưu hình và thêm vào catalog
+        Raises:
+            PictureExists: Đã có hình cùng khóa
+            ValueError: Tên file không đúng định dạng [Số phiếu]-CMR[Camera]_[Sequence]
+        """
+        key = picture_key(picture_type, picture_date, filename)
+        info = parse_picture_key(key)
+        if info is None:
+            raise ValueError(f"Tên file không hợp lệ: {filename}")
+        if db.get(PictureCatalog, key) is not None:
+            raise PictureExists(f"File đã tồn tại: {filename}")
+
+        content_type = content_type or guess_content_type(filename)
+        reader = _HashingReader(stream)
+        # Lưu theo nội dung: ghi ra file tạm vì chỉ biết hash sau khi đọc hết stream
+        written_key = f"{CAS_TEMP_PREFIX}{uuid.uuid4().hex}" if self.dedup else key
+        size = self.storage.save(written_key, reader, content_type)
+        content_hash = reader.hexdigest()
+        blob_key = content_key(content_hash) if self.dedup else None
+        row = PictureCatalog(
+            storage_key=key, file_size=size, content_type=content_type, created_at=datetime.now(),
+            content_hash=content_hash, blob_key=blob_key, **info
+        )
+        db.add(row)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            if self.dedup:
+                self.storage.delete(written_key)
+                raise PictureExists(f"File đã tồn tại: {filename}")
+            # File vừa ghi đã được sync_folder/reindex thêm vào catalog trước khi commit: cập nhật dòng đó
+            row = db.get(PictureCatalog, key)
+            if row is None:
+                raise
+            row.file_size, row.content_type, row.content_hash = size, content_type, content_hash
+            db.commit()
+            return row
+        except BaseException:
+            db.rollback()
+            self.storage.delete(written_key)
+            raise
+
+        if self.dedup:
+            # Dòng catalog đã commit trước khi đặt blob: sweep_blobs đang xóa blob này hoặc kiểm tra lại tham chiếu
+            # sau commit (thấy dòng này, trả blob lại), hoặc đã chuyển blob đi trước link (link đặt lại blob)
+            try:
+                self.storage.link(written_key, blob_key)
+            except BaseException:
+                db.delete(row)
+                db.commit()
+                raise
+            finally:
+                self.storage.delete(written_key)
+        return row
+
+    def get(self, db: Session, key: str) -> Optional[PictureCatalog]:
+        """Dòng catalog của hình; hình có trong storage nhưng chưa có trong catalog (chép thẳng vào thư mục) được thêm vào"""
+        row = db.get(PictureCatalog, key)
+        if row is not None:
+            return row
+        info = parse_picture_key(key)
+        found = self.storage.stat(key) if info is not None else None
+        if found is None:
+            return None
+        size, modified = found
+        row = PictureCatalog(
+            storage_key=key, file_size=size, content_type=guess_content_type(info["filename"]),
+            created_at=datetime.fromtimestamp(modified), **info
+        )
+        db.add(row)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            row = db.get(PictureCatalog, key)
+        return row
+
+    def find(
+        self,
+        db: Session,
+        ticket_number: Optional[str] = None,
+        picture_type: Optional[str] = None,
+        picture_date: Optional[date] = None,
+        camera_number: Optional[int] = None,
+        sequence: Optional[int] = None,
+        limit: Optional[int] = None,
+        newest_first: bool = False
+    ) -> List[PictureCatalog]:
+        """Tìm hình trong catalog, sắp xếp theo ngày và tên file"""
+        query = select(PictureCatalog)
+        if ticket_number:
+            query = query.where(PictureCatalog.ticket_number == ticket_number)
+        if picture_type:
+            query = query.where(PictureCatalog.picture_type == picture_type)
+        if picture_date:
+            query = query.where(PictureCatalog.picture_date == picture_date)
+        if camera_number:
+            query = query.where(PictureCatalog.camera_number == camera_number)
+        if sequence:
+            query = query.where(PictureCatalog.sequence == sequence)
+        if newest_first:
+            query = query.order_by(PictureCatalog.picture_date.desc(), PictureCatalog.filename)
+        else:
+            query = query.order_by(PictureCatalog.picture_date, PictureCatalog.filename)
+        if limit:
+            query = query.limit(limit)
+        return list(db.execute(query).scalars())
+
+    def dates(self, db: Session) -> Dict[str, List[str]]:
+        """Các ngày có hình của từng loại phiếu (mới nhất trước)"""
+        result = {picture_type: [] for picture_type in PICTURE_TYPES}
+        rows = db.execute(
+            select(PictureCatalog.picture_type, PictureCatalog.picture_date)
+            .distinct()
+            .order_by(PictureCatalog.picture_type, PictureCatalog.picture_date.desc())
+        ).all()
+        for picture_type, picture_date in rows:
+            if picture_type in result:
+                result[picture_type].append(picture_date.isoformat())
+        return result
+
+    def remove(self, db: Session, key: str) -> bool:
+        """
+        Xóa hình khỏi catalog và file theo tên của hình. Blob theo hash không bị xóa ở đây
+        (hình khác có thể dùng chung): sweep_blobs xóa blob không còn tham chiếu.
+        Raises:
+            ValueError: Khóa là nội dung lưu theo hash (cas/...), không phải hình
+        """
+        if key.startswith(CAS_PREFIX):
+            raise ValueError(f"Không xóa trực tiếp nội dung lưu theo hash: {key}")
+        row = db.get(PictureCatalog, key)
+        if row is None:
+            # Hình chưa có trong catalog: chỉ xóa file đúng cấu trúc <loại>/<ngày>/<tên hình>
+            return parse_picture_key(key) is not None and self.storage.delete(key)
+        db.delete(row)
+        db.commit()
+        # File theo tên (với hình lưu theo nội dung: file còn sót do chép thẳng vào thư mục sau khi chạy dedup)
+        self.storage.delete(key)
+        return True
+
+    @staticmethod
+    def _referenced(db: Session, blob_keys: List[str]) -> set:
+        """Các blob_key còn dòng catalog tham chiếu"""
+        referenced = set()
+        for start in range(0, len(blob_keys), 500):
+            referenced.update(db.execute(
+                select(PictureCatalog.blob_key).where(PictureCatalog.blob_key.in_(blob_keys[start:start + 500])).distinct()
+            ).scalars())
+        return referenced
+
+    def sweep_blobs(self, db: Session, grace_seconds: Optional[float] = None) -> dict:
+        """
+        Xóa blob theo hash không còn dòng catalog nào tham chiếu, cùng file tạm của upload bị bỏ dở.
+        Chỉ xét blob cũ hơn grace_seconds giây (mặc định blob_grace_seconds). Mỗi blob được chuyển sang cas/trash/
+        rồi mới kiểm tra lại tham chiếu: upload/dedup commit tham chiếu trước đó thì blob được trả lại,
+        commit sau đó thì chính upload/dedup đặt lại blob (thấy blob không còn).
+        Blob còn trong thùng rác (sweep bị dừng giữa chừng) được xử lý lại sau grace_seconds.
+        """
+        grace = self.blob_grace_seconds if grace_seconds is None else grace_seconds
+        cutoff = time.time() - grace
+        blobs, trash = [], []
+        scanned = temp_deleted = 0
+        for key, size, modified in list(self.storage.list(CAS_PREFIX)):
+            if key.startswith(CAS_TEMP_PREFIX):
+                if modified < cutoff and self.storage.delete(key):
+                    temp_deleted += 1
+            elif key.startswith(CAS_TRASH_PREFIX):
+                parsed = parse_trash_key(key)
+                if parsed is not None and parsed[1] < cutoff:
+                    trash.append((key, parsed[0], size))
+            else:
+                scanned += 1
+                if modified < cutoff:
+                    blobs.append((key, size))
+
+        referenced = self._referenced(db, [key for key, _ in blobs])
+        for blob_key, size in blobs:
+            if blob_key in referenced:
+                continue
+            moved = trash_key(blob_key)
+            if self.storage.link(blob_key, moved):
+                self.storage.delete(blob_key)
+                trash.append((moved, blob_key, size))
+
+        # Đọc lại catalog sau khi đã chuyển blob đi (transaction mới)
+        db.commit()
+        referenced = self._referenced(db, [blob_key for _, blob_key, _ in trash])
+        deleted = restored = reclaimed = 0
+        for moved, blob_key, size in trash:
+            if blob_key in referenced:
+                self.storage.link(moved, blob_key)
+                restored += 1
+            else:
+                deleted += 1
+                reclaimed += size
+            self.storage.delete(moved)
+        return {
+            "scanned": scanned, "deleted": deleted, "restored": restored,
+            "temp_deleted": temp_deleted, "reclaimed_bytes": reclaimed
+        }
+
+    @staticmethod
+    def _insert_missing(db: Session, rows: List[dict]) -> int:
+        """
+        Thêm các dòng catalog và commit; dòng đã được thêm cùng lúc (upload, đồng bộ khác) thì bỏ qua
+        Returns:
+            int: Số dòng đã thêm
+        """
+        # Commit các thay đổi trước đó để rollback lô bị trùng không làm mất chúng
+        db.commit()
+        if not rows:
+            return 0
+        try:
+            db.execute(insert(PictureCatalog), rows)
+            db.commit()
+            return len(rows)
+        except IntegrityError:
+            db.rollback()
+        added = 0
+        for row in rows:
+            try:
+                db.execute(insert(PictureCatalog), [row])
+                db.commit()
+                added += 1
+            except IntegrityError:
+                db.rollback()
+        return added
+
+    def sync_folder(self, db: Session, picture_type: str, picture_date: str) -> int:
+        """
+        Thêm vào catalog các hình có trong thư mục <loại>/<ngày> của storage nhưng chưa có trong catalog
+        (trạm cân ghi thẳng vào thư mục). Mỗi thư mục đồng bộ tối đa một lần mỗi folder_sync_interval giây.
+        Returns:
+            int: Số hình đã thêm
+        """
+        prefix = f"{picture_type}/{picture_date}/"
+        now = time.monotonic()
+        with self._lock:
+            synced = self._folder_synced.get(prefix)
+            if synced is not None and now - synced < self.folder_sync_interval:
+                return 0
+            self._folder_synced[prefix] = now
+
+        existing = set(db.execute(select(PictureCatalog.storage_key).where(PictureCatalog.storage_key.like(f"{prefix}%"))).scalars())
+        rows = []
+        for key, size, modified in self.storage.list(prefix):
+            info = parse_picture_key(key) if key not in existing else None
+            if info is not None:
+                rows.append({
+                    "storage_key": key, "file_size": size, "content_type": guess_content_type(info["filename"]),
+                    "created_at": datetime.fromtimestamp(modified), **info
+                })
+        return self._insert_missing(db, rows)
+
+    @staticmethod
+    def _listed_blob(key: str) -> str:
+        """blob_key gốc của khóa trong thùng rác, các khóa khác giữ nguyên"""
+        parsed = parse_trash_key(key)
+        return parsed[0] if parsed is not None else key
+
+    def reindex(self, db: Session, picture_type: Optional[str] = None, picture_date: Optional[str] = None, batch_size: int = 1000, remove_stale: bool = True) -> dict:
+        """
+        Đồng bộ catalog với storage (toàn bộ hoặc một loại/ngày):
+        thêm hình chưa có, cập nhật kích thước đã đổi, bỏ dòng catalog của hình (hoặc blob theo hash) không còn trong storage.
+        Commit theo từng lô để không giữ khóa bảng catalog lâu (upload vẫn chạy trong lúc reindex).
+        Args:
+            remove_stale: False thì chỉ thêm/cập nhật (storage tạm thời không truy cập được không làm mất catalog)
+        """
+        prefix = ""
+        query = select(PictureCatalog.storage_key, PictureCatalog.file_size, PictureCatalog.blob_key)
+        if picture_type:
+            prefix = f"{picture_type}/" + (f"{picture_date}/" if picture_date else "")
+            query = query.where(PictureCatalog.storage_key.like(f"{prefix}%"))
+        existing = {key: (size, blob_key) for key, size, blob_key in db.execute(query).all()}
+
+        scanned = added = updated = skipped = 0
+        seen = set()
+        blobs = set()
+        batch = []
+        for key, size, modified in self.storage.list(prefix):
+            if key.startswith(CAS_PREFIX):
+                # Nội dung theo hash: chỉ dùng để kiểm tra blob của các dòng catalog (blob đang được sweep kiểm tra vẫn tính)
+                blobs.add(self._listed_blob(key))
+                continue
+            scanned += 1
+            info = parse_picture_key(key)
+            if info is None:
+                skipped += 1
+                continue
+            seen.add(key)
+            if key in existing:
+                if existing[key][1] is None and existing[key][0] != size:
+                    db.execute(update(PictureCatalog).where(PictureCatalog.storage_key == key).values(file_size=size))
+                    updated += 1
+                continue
+            batch.append({
+                "storage_key": key, "file_size": size, "content_type": guess_content_type(info["filename"]),
+                "created_at": datetime.fromtimestamp(modified), **info
+            })
+            if len(batch) >= batch_size:
+                added += self._insert_missing(db, batch)
+                batch = []
+        added += self._insert_missing(db, batch)
+
+        if not remove_stale:
+            db.commit()
+            return {"scanned": scanned, "added": added, "updated": updated, "removed": 0, "skipped": skipped}
+        if prefix and any(blob_key for _, blob_key in existing.values()):
+            blobs = {self._listed_blob(key) for key, _, _ in self.storage.list(CAS_PREFIX)}
+        stale = [key for key, (_, blob_key) in existing.items() if (blob_key not in blobs if blob_key else key not in seen)]
+        for start in range(0, len(stale), 500):
+            db.execute(delete(PictureCatalog).where(PictureCatalog.storage_key.in_(stale[start:start + 500])))
+        db.commit()
+        return {"scanned": scanned, "added": added, "updated": updated, "removed": len(stale), "skipped": skipped}
+
+    def reindex_in_background(self, session_factory: Callable[[], Session]):
+        """Thêm vào catalog các hình đã có trong storage (thread nền khi khởi động API), không bỏ dòng catalog nào"""
+        def run():
+            db = session_factory()
+            try:
+                result = self.reindex(db, remove_stale=False)
+                if result["added"]:
+                    print(f"🖼️ Danh mục hình ảnh: đã thêm {result['added']} hình có sẵn trong storage")
+            except Exception as e:
+                print(f"⚠️ Lỗi khi đồng bộ danh mục hình ảnh: {e}")
+            finally:
+                db.close()
+        threading.Thread(target=run, name="picture-reindex", daemon=True).start()
+
+    def _hash(self, key: str) -> str:
+        sha256 = hashlib.sha256()
+        for chunk in self.storage.iter_chunks(key):
+            sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def deduplicate(self, db: Session, picture_type: Optional[str] = None, picture_date: Optional[str] = None) -> dict:
+        """
+        Chuyển hình đang lưu theo tên sang lưu theo nội dung: đặt blob theo hash (nếu chưa có), cập nhật catalog,
+        kiểm tra lại blob rồi xóa file theo tên. Thứ tự này an toàn khi bị dừng giữa chừng (hình luôn đọc được qua blob
+        hoặc qua file theo tên) và khi sweep_blobs chạy cùng lúc ở tiến trình khác (blob bị chuyển đi trước commit được đặt lại).
+        """
+        query = select(PictureCatalog.storage_key).where(PictureCatalog.blob_key.is_(None)).order_by(PictureCatalog.storage_key)
+        if picture_type:
+            prefix = f"{picture_type}/" + (f"{picture_date}/" if picture_date else "")
+            query = query.where(PictureCatalog.storage_key.like(f"{prefix}%"))
+        keys = list(db.execute(query).scalars())
+
+        converted = duplicates = missing = reclaimed = 0
+        for key in keys:
+            found = self.storage.stat(key)
+            if found is None:
+                missing += 1
+                continue
+            content_hash = self._hash(key)
+            blob_key = content_key(content_hash)
+            if not self.storage.link(key, blob_key):
+                duplicates += 1
+                reclaimed += found[0]
+            db.execute(
+                update(PictureCatalog).where(PictureCatalog.storage_key == key)
+                .values(content_hash=content_hash, blob_key=blob_key, file_size=found[0])
+            )
+            db.commit()
+            # sweep_blobs đã chuyển blob đi trước khi thấy tham chiếu vừa commit: đặt lại từ file theo tên
+            if self.storage.stat(blob_key) is None:
+                self.storage.link(key, blob_key)
+            self.storage.delete(key)
+            converted += 1
+        return {"converted": converted, "duplicates": duplicates, "missing": missing, "reclaimed_bytes": reclaimed}
+
+    def report(self, db: Session, top: int = 10) -> dict:
+        """Dung lượng hình theo tên (logical) so với dung lượng lưu thật (mỗi blob một lần) và các blob dùng chung nhiều nhất"""
+        pictures, logical_bytes = db.execute(select(func.count(), func.coalesce(func.sum(PictureCatalog.file_size), 0))).one()
+
+        blob = func.coalesce(PictureCatalog.blob_key, PictureCatalog.storage_key)
+        stored = select(blob.label("blob"), func.max(PictureCatalog.file_size).label("size")).group_by(blob).subquery()
+        blobs, stored_bytes = db.execute(select(func.count(), func.coalesce(func.sum(stored.c.size), 0))).one()
+
+        # Hình trùng nội dung nhưng vẫn lưu theo tên (upload khi chưa bật PICTURE_DEDUP): tiết kiệm được khi chạy dedup
+        plain = (
+            select(func.count().label("copies"), func.max(PictureCatalog.file_size).label("size"))
+            .where(PictureCatalog.blob_key.is_(None), PictureCatalog.content_hash.is_not(None))
+            .group_by(PictureCatalog.content_hash)
+            .having(func.count() > 1)
+            .subquery()
+        )
+        dedupable_bytes = db.execute(select(func.coalesce(func.sum((plain.c.copies - 1) * plain.c.size), 0))).scalar()
+        not_hashed = db.execute(select(func.count()).where(PictureCatalog.content_hash.is_(None))).scalar()
+
+        references = func.count().label("references")
+        shared = db.execute(
+            select(PictureCatalog.blob_key, references, func.max(PictureCatalog.file_size), func.min(PictureCatalog.storage_key))
+            .where(PictureCatalog.blob_key.is_not(None))
+            .group_by(PictureCatalog.blob_key)
+            .having(func.count() > 1)
+            .order_by(references.desc())
+            .limit(top)
+        ).all()
+
+        reclaimed = int(logical_bytes) - int(stored_bytes)
+        return {
+            "dedup_enabled": self.dedup,
+            "pictures": pictures,
+            "logical_bytes": int(logical_bytes),
+            "blobs": blobs,
+            "stored_bytes": int(stored_bytes),
+            "reclaimed_bytes": reclaimed,
+            "reclaimed_percent": round(reclaimed * 100 / logical_bytes, 2) if logical_bytes else 0.0,
+            "dedupable_bytes": int(dedupable_bytes),
+            "not_hashed": not_hashed,
+            "top_shared": [
+                {"blob_key": blob_key, "references": count, "size": size, "reclaimed_bytes": (count - 1) * size, "example": example}
+                for blob_key, count, size, example in shared
+            ]
+        }
+
+
+def create_picture_storage():
+    """
+    Tạo backend lưu hình theo PICTURE_STORAGE:
+    - local (mặc định): thư mục PICTURE_BASE_PATH
+    - s3: bucket PICTURE_S3_BUCKET (PICTURE_S3_PREFIX, PICTURE_S3_ENDPOINT cho MinIO, PICTURE_S3_REGION,
+      khóa truy cập PICTURE_S3_ACCESS_KEY/PICTURE_S3_SECRET_KEY hoặc cấu hình AWS chuẩn)
+    """
+    backend = os.getenv("PICTURE_STORAGE", "local").lower()
+    if backend == "s3":
+        if boto3 is None:
+            raise RuntimeError("PICTURE_STORAGE=s3 cần thư viện boto3 (pip install boto3)")
+        bucket = os.getenv("PICTURE_S3_BUCKET")
+        if not bucket:
+            raise RuntimeError("Chưa cấu hình PICTURE_S3_BUCKET")
+        client = boto3.client(
+            "s3",
+            endpoint_url=os.getenv("PICTURE_S3_ENDPOINT") or None,
+            region_name=os.getenv("PICTURE_S3_REGION") or None,
+            aws_access_key_id=os.getenv("PICTURE_S3_ACCESS_KEY") or None,
+            aws_secret_access_key=os.getenv("PICTURE_S3_SECRET_KEY") or None
+        )
+        print(f"🪣 Lưu hình ảnh trên S3: {bucket}")
+        return S3PictureStorage(client, bucket, os.getenv("PICTURE_S3_PREFIX", ""))
+    return LocalPictureStorage(os.getenv("PICTURE_BASE_PATH", r"D:\Picture"))
+
+
+def create_picture_store() -> PictureStore:
+    """
+    PictureStore với backend theo PICTURE_STORAGE, lưu theo nội dung khi PICTURE_DEDUP=true,
+    đồng bộ thư mục đang tra cứu tối đa một lần mỗi PICTURE_FOLDER_SYNC_SECONDS giây,
+    sweep chỉ xóa blob cũ hơn PICTURE_BLOB_GRACE_SECONDS giây
+    """
+    dedup = os.getenv("PICTURE_DEDUP", "false").lower() == "true"
+    if dedup:
+        print("♻️ Lưu hình theo nội dung (PICTURE_DEDUP): hình trùng chỉ lưu một lần")
+    return PictureStore(
+        create_picture_storage(),
+        dedup=dedup,
+        folder_sync_interval=float(os.getenv("PICTURE_FOLDER_SYNC_SECONDS", "10")),
+        blob_grace_seconds=float(os.getenv("PICTURE_BLOB_GRACE_SECONDS", "3600"))
+    )
+
+
+if __name__ == "__main__":
+    from database import SessionLocal, create_tables
+    from migrations import run_migrations
+
+    parser = argparse.ArgumentParser(description="Đồng bộ danh mục hình ảnh với storage, lưu hình theo nội dung")
+    parser.add_argument("command", choices=["reindex", "dedup", "report", "sweep"])
+    parser.add_argument("--type", choices=list(PICTURE_TYPES.keys()), help="Chỉ một loại phiếu")
+    parser.add_argument("--date", help="Chỉ một ngày (YYYY-MM-DD, cần --type)")
+    args = parser.parse_args()
+
+    create_tables()
+    run_migrations()
+    store = create_picture_store()
+    db = SessionLocal()
+    try:
+        if args.command == "reindex":
+            result = store.reindex(db, args.type, args.date)
+        elif args.command == "dedup":
+            result = store.deduplicate(db, args.type, args.date)
+        elif args.command == "sweep":
+            result = store.sweep_blobs(db)
+        else:
+            result = store.report(db)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    finally:
+        db.close()
@@ -0,0 +1,495 @@
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import func, or_, select, text
+from sqlalchemy.orm import Session
+
+from change_token import ChangeTokens, bucket_checksums
+from text_utils import normalize_plate
+
+# 4 cột biển số của phiếu cân (xe và rơ-moóc, biển số thứ 2)
+PLATE_COLUMNS = ["bienso1_1", "bienso1_2", "bienso2_1", "bienso2_2"]
+
+# Các cột cần đọc từ bảng phiếu để dựng hồ sơ xe và chỉ mục biển số
+PROFILE_COLUMNS = [
+    "sophieu", "ngaycan", "bienso1_1", "bienso1_2", "bienso2_1", "bienso2_2",
+    "khachhang", "loaihang", "laixe", "khoiluonglan1", "khoiluonglan2", "lancan",
+    "thoigiancanlan1", "thoigiancanlan2", "xoaphieu"
+]
+
+# Số phiếu tối đa mỗi câu lệnh IN (SQL Server giới hạn 2100 tham số)
+LOAD_CHUNK = 2000
+
+
+def _recency(table: str, row) -> tuple:
+    """Khóa sắp xếp độ mới của phiếu: ngày cân, giờ cân, số phiếu"""
+    return (
+        row.ngaycan or date.min,
+        row.thoigiancanlan2 or row.thoigiancanlan1 or "",
+        row.sophieu,
+        table
+    )
+
+
+def _tare_weight(row):
+    """Khối lượng bì = lần cân nhỏ hơn của phiếu đã cân đủ 2 lần"""
+    if row.lancan != 2 or not row.khoiluonglan1 or not row.khoiluonglan2:
+        return None
+    return min(row.khoiluonglan1, row.khoiluonglan2)
+
+
+def plate_sql_match(model, value, exact: bool = False):
+    """
+    Điều kiện SQL so biển số đã chuẩn hóa trên cả 4 cột với value
+    (biển số đã chuẩn hóa nếu exact, mẫu LIKE "<biển số>%" nếu không; giá trị hoặc bind parameter)
+    """
+    conditions = []
+    for name in PLATE_COLUMNS:
+        column = func.upper(func.replace(func.replace(func.replace(getattr(model, name), "-", ""), ".", ""), " ", ""))
+        conditions.append(column == value if exact else column.like(value))
+    return or_(*conditions)
+
+
+def plate_sql_pattern(plate: str, exact: bool = False) -> str:
+    """Giá trị so sánh của plate_sql_match cho biển số plate"""
+    key = normalize_plate(plate)
+    return key if exact else f"{key}%"
+
+
+def plate_sql_filter(model, plate: str, exact: bool = False):
+    """
+    Điều kiện SQL tìm biển số đã chuẩn hóa trên cả 4 cột (quét bảng, dùng khi không dùng được chỉ mục)
+    """
+    return plate_sql_match(model, plate_sql_pattern(plate, exact), exact)
+
+
+class _Snapshot:
+    """Trạng thái của chỉ mục; rebuild dựng snapshot mới rồi thay nguyên khối, refresh cập nhật tại chỗ"""
+
+    def __init__(self):
+        # Biển số đã chuẩn hóa (bienso1_1) -> hồ sơ
+        self.profiles: Dict[str, dict] = {}
+        # Biển số đã chuẩn hóa -> {bảng: tập số phiếu}
+        self.postings: Dict[str, Dict[str, set]] = {}
+        self.plate_keys: List[str] = []
+        # (bảng, số phiếu) -> (dấu vân tay, ngày cân, biển số hồ sơ, các biển số) của phiếu gần đây
+        self.recent: Dict[tuple, tuple] = {}
+        self.recent_start: Optional[date] = None
+        self.high_water: Dict[str, int] = {}
+        # Token thay đổi của bảng ở lần đọc gần nhất
+        self.tokens: Dict[str, str] = {}
+        # Phiên bản Change Tracking đã đọc đến (SQL Server)
+        self.ct_versions: Dict[str, int] = {}
+        # Bảng -> {nhóm số phiếu: checksum} của các phiếu cũ (ngoài khoảng gần đây)
+        self.buckets: Dict[str, Dict[int, int]] = {}
+        self.buckets_start: Optional[date] = None
+        self.stale = False
+        self.built_at = self.refreshed_at = self.verified_at = time.monotonic()
+
+
+class PlateIndex:
+    """
+    Chỉ mục biển số -> thuộc tính của phiếu gần nhất (khách hàng, loại hàng, lái xe, khối lượng bì),
+    kèm chỉ mục biển số đã chuẩn hóa -> số phiếu trên cả 4 cột biển số của mỗi bảng.
+
+    - Dựng toàn bộ lần đầu; mỗi rebuild_interval giây dựng lại trong thread nền,
+      request vẫn đọc snapshot cũ đến khi snapshot mới sẵn sàng
+    - Mỗi refresh_interval giây (khi token thay đổi của bảng đã đổi) cập nhật các phiếu thêm, sửa, xóa:
+      * Change Tracking (SQL Server, migration 0005): đọc các số phiếu đã thay đổi
+      * Nếu không: đọc phiếu mới (sophieu lớn hơn mốc đã đọc) và phiếu của recent_days ngày gần đây
+        (so dấu vân tay), mỗi verify_interval giây so checksum theo nhóm bucket_size số phiếu
+        của các phiếu cũ để bắt phiếu cũ bị sửa biển số hoặc bị xóa
+    - Phiếu bị sửa/xóa là nguồn của hồ sơ thì hồ sơ được tính lại từ các phiếu còn lại của biển số
+    - Tra cứu hồ sơ là một lần truy cập dict theo biển số đã chuẩn hóa
+    - Tìm phiếu theo biển số: chính xác qua dict, tiền tố qua bisect trên mảng biển số đã sắp xếp
+    """
+
+    def __init__(
+        self,
+        models: Dict[str, object],
+        change_tokens: ChangeTokens,
+        refresh_interval: float = 5,
+        rebuild_interval: float = 3600,
+        recent_days: int = 2,
+        verify_interval: float = 60,
+        bucket_size: int = 1000
+    ):
+        self.models = models
+        self.change_tokens = change_tokens
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.recent_days = recent_days
+        self.verify_interval = verify_interval
+        self.bucket_size = bucket_size
+        self.xe_by_plate: Dict[str, dict] = {}
+        self._snapshot: Optional[_Snapshot] = None
+        self._rebuilding: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def on_master_reload(self, table: str, old_rows: List[dict], new_rows: List[dict]):
+        """Callback của MasterDataCache: dựng lại map biển số -> dòng bảng xe"""
+        if table != "xe":
+            return
+        xe_by_plate = {}
+        for row in new_rows:
+            key = normalize_plate(row.get("blenso_xe"))
+            if key:
+                xe_by_plate[key] = row
+        self.xe_by_plate = xe_by_plate
+
+    # ==== Cập nhật snapshot ====
+
+    def _columns(self, model):
+        return [getattr(model, name) for name in PROFILE_COLUMNS]
+
+    def _index_row(self, snap: _Snapshot, table: str, row, sort_keys: bool):
+        """Thêm posting biển số -> số phiếu cho cả 4 cột biển số, ghi nhận phiếu gần đây"""
+        keys = tuple(sorted({normalize_plate(getattr(row, name)) for name in PLATE_COLUMNS} - {""}))
+        if row.ngaycan is not None and row.ngaycan >= snap.recent_start:
+            snap.recent[(table, row.sophieu)] = (hash(tuple(row)), row.ngaycan, normalize_plate(row.bienso1_1), keys)
+        for key in keys:
+            by_table = snap.postings.get(key)
+            if by_table is None:
+                by_table = snap.postings[key] = {}
+                if sort_keys:
+                    insort(snap.plate_keys, key)
+            by_table.setdefault(table, set()).add(row.sophieu)
+
+    def _apply(self, profiles: Dict[str, dict], table: str, row):
+        """Cập nhật hồ sơ biển số từ một dòng phiếu"""
+        key = normalize_plate(row.bienso1_1)
+        if not key:
+            return
+
+        profile = profiles.get(key)
+        if profile is None:
+            profile = profiles[key] = {"recency": None, "source": None, "tare_recency": None, "tare_source": None}
+
+        recency = _recency(table, row)
+        source = (table, row.sophieu)
+        deleted = row.xoaphieu == 1
+
+        if not deleted and (profile["recency"] is None or recency >= profile["recency"]):
+            profile.update(
+                recency=recency,
+                source=source,
+                khachhang=row.khachhang,
+                loaihang=row.loaihang,
+                laixe=row.laixe,
+                bang=table,
+                sophieu=row.sophieu,
+                ngaycan=row.ngaycan
+            )
+
+        tare = None if deleted else _tare_weight(row)
+        if tare is not None and (profile["tare_recency"] is None or recency >= profile["tare_recency"]):
+            profile.update(tare_recency=recency, tare_source=source, khoiluongbi=tare, ngaycan_bi=row.ngaycan)
+
+    def _load(self, db: Session, table: str, ids: Iterable[int]) -> list:
+        """Đọc các phiếu theo số phiếu"""
+        model = self.models[table]
+        ids = sorted(ids)
+        rows = []
+        for start in range(0, len(ids), LOAD_CHUNK):
+            chunk = ids[start:start + LOAD_CHUNK]
+            rows.extend(db.execute(select(*self._columns(model)).where(model.sophieu.in_(chunk))).all())
+        return rows
+
+    def _replace(self, snap: _Snapshot, table: str, ids: Set[int], rows: list) -> Set[str]:
+        """
+        Gỡ posting cũ của các phiếu ids (đã sửa/xóa/mới) rồi index lại các dòng hiện tại rows
+        Returns:
+            Các biển số có hồ sơ lấy từ phiếu đã sửa/xóa (cần tính lại)
+        """
+        dirty = set()
+        old_ids = set()
+        for sophieu in ids:
+            ticket = (table, sophieu)
+            recent = snap.recent.pop(ticket, None)
+            if recent is not None:
+                _, _, profile_key, keys = recent
+                for key in keys:
+                    snap.postings[key][table].discard(sophieu)
+                profile = snap.profiles.get(profile_key)
+                if profile is not None and ticket in (profile["source"], profile["tare_source"]):
+                    dirty.add(profile_key)
+            elif sophieu <= snap.high_water.get(table, 0):
+                old_ids.add(sophieu)
+
+        if old_ids:
+            # Phiếu cũ không giữ biển số đã index: gỡ khỏi mọi posting của bảng (ít xảy ra)
+            for by_table in snap.postings.values():
+                tickets = by_table.get(table)
+                if tickets:
+                    tickets.difference_update(old_ids)
+            for key, profile in snap.profiles.items():
+                for source in (profile["source"], profile["tare_source"]):
+                    if source is not None and source[0] == table and source[1] in old_ids:
+                        dirty.add(key)
+
+        for row in rows:
+            self._index_row(snap, table, row, sort_keys=True)
+            self._apply(snap.profiles, table, row)
+            snap.high_water[table] = max(snap.high_water.get(table, 0), row.sophieu or 0)
+        return dirty
+
+    def _recompute_profiles(self, snap: _Snapshot, db: Session, keys: Set[str]):
+        """Tính lại hồ sơ của các biển số từ các phiếu còn lại (tìm qua posting)"""
+        for key in keys:
+            profile: Dict[str, dict] = {}
+            for table, tickets in snap.postings.get(key, {}).items():
+                for row in self._load(db, table, tickets):
+                    if normalize_plate(row.bienso1_1) == key:
+                        self._apply(profile, table, row)
+            if key in profile:
+                snap.profiles[key] = profile[key]
+            else:
+                snap.profiles.pop(key, None)
+
+    def _uses_change_tracking(self, db: Session, table: str) -> bool:
+        return db.bind.dialect.name == "mssql" and self.change_tokens.uses_change_tracking(db, table)
+
+    def _bucket_checksums(self, db: Session, table: str, recent_start: date) -> Dict[int, int]:
+        """Checksum mọi cột của các phiếu cũ (ngày cân trước khoảng gần đây) theo nhóm số phiếu"""
+        model = self.models[table]
+        return bucket_checksums(db, model, self.bucket_size, or_(model.ngaycan < recent_start, model.ngaycan.is_(None)))
+
+    def _build(self, db: Session) -> _Snapshot:
+        """Dựng snapshot mới từ toàn bộ các bảng phiếu"""
+        snap = _Snapshot()
+        snap.recent_start = snap.buckets_start = date.today() - timedelta(days=self.recent_days)
+        for table, model in self.models.items():
+            # Đọc mốc thay đổi trước khi quét: thay đổi xảy ra trong lúc quét được đọc lại ở lần refresh sau
+            snap.tokens[table] = self.change_tokens.token(db, table)[0]
+            if self._uses_change_tracking(db, table):
+                snap.ct_versions[table] = db.execute(text("SELECT CHANGE_TRACKING_CURRENT_VERSION()")).scalar() or 0
+            else:
+                snap.buckets[table] = self._bucket_checksums(db, table, snap.recent_start)
+            top = 0
+            for row in db.execute(select(*self._columns(model)).execution_options(yield_per=5000)):
+                self._apply(snap.profiles, table, row)
+                self._index_row(snap, table, row, sort_keys=False)
+                top = max(top, row.sophieu or 0)
+            snap.high_water[table] = top
+        snap.plate_keys = sorted(snap.postings)
+        snap.built_at = snap.refreshed_at = snap.verified_at = time.monotonic()
+        return snap
+
+    def _refresh_change_tracking(self, snap: _Snapshot, db: Session, table: str) -> Set[str]:
+        since = snap.ct_versions.get(table, 0)
+        current = db.execute(text("SELECT CHANGE_TRACKING_CURRENT_VERSION()")).scalar() or 0
+        min_valid = db.execute(text("SELECT CHANGE_TRACKING_MIN_VALID_VERSION(OBJECT_ID(:table))"), {"table": table}).scalar()
+        if min_valid is None or since < min_valid:
+            # Đã mất lịch sử thay đổi: dựng lại toàn bộ
+            snap.stale = True
+            return set()
+        ids = set(db.execute(text(f"SELECT c.sophieu FROM CHANGETABLE(CHANGES [{table}], :since) AS c"), {"since": since}).scalars())
+        snap.ct_versions[table] = current
+        return self._replace(snap, table, ids, self._load(db, table, ids))
+
+    def _refresh_scan(self, snap: _Snapshot, db: Session, table: str, verify: bool) -> Set[str]:
+        """Phiếu mới và phiếu gần đây (so dấu vân tay), phiếu cũ theo checksum nhóm khi verify"""
+        model = self.models[table]
+        top = snap.high_water.get(table, 0)
+        changed = {}
+        seen = set()
+        for row in db.execute(select(*self._columns(model)).where(or_(model.sophieu > top, model.ngaycan >= snap.recent_start))):
+            seen.add(row.sophieu)
+            recent = snap.recent.get((table, row.sophieu))
+            if recent is None or recent[0] != hash(tuple(row)):
+                changed[row.sophieu] = row
+        # Phiếu gần đây không còn trong khoảng đọc: bị xóa, bị lưu trữ hoặc sửa ngày cân về trước
+        missing = [
+            ticket[1] for ticket, (_, ngaycan, _, _) in snap.recent.items()
+            if ticket[0] == table and ticket[1] not in seen and ngaycan >= snap.recent_start
+        ]
+        ids = set(changed) | set(missing)
+        rows = list(changed.values()) + self._load(db, table, missing)
+
+        if verify:
+            buckets = self._bucket_checksums(db, table, snap.recent_start)
+            if snap.buckets_start == snap.recent_start:
+                previous = snap.buckets.get(table, {})
+                stale_buckets = {number for number in buckets.keys() | previous.keys() if buckets.get(number) != previous.get(number)}
+                if stale_buckets:
+                    bucket_ids = {
+                        sophieu for by_table in snap.postings.values() for sophieu in by_table.get(table, ())
+                        if sophieu // self.bucket_size in stale_buckets and (table, sophieu) not in snap.recent
+                    }
+                    bucket_ids -= ids
+                    bucket_rows = [
+                        row for row in self._load_buckets(db, table, stale_buckets, snap.recent_start)
+                        if row.sophieu not in ids and (table, row.sophieu) not in snap.recent
+                    ]
+                    ids |= bucket_ids | {row.sophieu for row in bucket_rows}
+                    rows.extend(bucket_rows)
+            snap.buckets[table] = buckets
+        return self._replace(snap, table, ids, rows)
+
+    def _load_buckets(self, db: Session, table: str, buckets: Set[int], recent_start: date) -> list:
+        """Đọc các phiếu cũ thuộc các nhóm số phiếu"""
+        model = self.models[table]
+        rows = []
+        for number in sorted(buckets):
+            start = number * self.bucket_size
+            rows.extend(db.execute(
+                select(*self._columns(model))
+                .where(model.sophieu >= start, model.sophieu < start + self.bucket_size)
+                .where(or_(model.ngaycan < recent_start, model.ngaycan.is_(None)))
+            ).all())
+        return rows
+
+    def _refresh(self, snap: _Snapshot, db: Session):
+        """Cập nhật snapshot với các phiếu đã thêm, sửa, xóa của các bảng có token thay đổi"""
+        now = time.monotonic()
+        recent_start = date.today() - timedelta(days=self.recent_days)
+        if recent_start != snap.recent_start:
+            # Sang ngày mới: bỏ các phiếu đã ra khỏi khoảng gần đây (posting vẫn đúng)
+            snap.recent = {ticket: value for ticket, value in snap.recent.items() if value[1] >= recent_start}
+            snap.recent_start = recent_start
+        verify = now - snap.verified_at >= self.verify_interval
+        dirty: Set[str] = set()
+        for table in self.models:
+            token = self.change_tokens.token(db, table)[0]
+            if token == snap.tokens.get(table) and snap.buckets_start == recent_start:
+                continue
+            if self._uses_change_tracking(db, table):
+                dirty |= self._refresh_change_tracking(snap, db, table)
+            else:
+                dirty |= self._refresh_scan(snap, db, table, verify)
+                if not verify:
+                    # Còn phiếu cũ chưa so checksum: giữ token cũ để lần verify sau vẫn quét
+                    continue
+            snap.tokens[table] = token
+        self._recompute_profiles(snap, db, dirty)
+        if verify:
+            snap.verified_at = now
+            snap.buckets_start = recent_start
+        snap.refreshed_at = now
+
+    # ==== API ====
+
+    def rebuild(self, db: Session):
+        """Dựng lại toàn bộ chỉ mục (đồng bộ)"""
+        snap = self._build(db)
+        with self._lock:
+            self._snapshot = snap
+
+    def refresh(self, db: Session):
+        """Cập nhật chỉ mục với các phiếu đã thêm, sửa, xóa"""
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = self._build(db)
+            else:
+                self._refresh(self._snapshot, db)
+
+    def _rebuild_in_background(self, bind):
+        try:
+            with Session(bind) as db:
+                snap = self._build(db)
+                with self._lock:
+                    # Bắt kịp các thay đổi trong lúc dựng rồi thay snapshot
+                    self._refresh(snap, db)
+                    self._snapshot = snap
+        except Exception as e:
+            print(f"⚠️ Lỗi khi dựng lại chỉ mục biển số: {e}")
+        finally:
+            self._rebuilding = None
+
+    def ensure_fresh(self, db: Session):
+        """
+        Dựng lần đầu (đồng bộ), dựng lại định kỳ trong thread nền, cập nhật tăng dần nếu đã quá hạn.
+        Chạy truy vấn database: gọi từ thread pool (endpoint def hoặc run_in_threadpool), không gọi trực tiếp trên event loop.
+        """
+        with self._lock:
+            snap = self._snapshot
+            if snap is None:
+                self._snapshot = self._build(db)
+                return
+            now = time.monotonic()
+            if (snap.stale or now - snap.built_at >= self.rebuild_interval) and self._rebuilding is None:
+                self._rebuilding = threading.Thread(target=self._rebuild_in_background, args=(db.get_bind(),), name="plate-index-rebuild", daemon=True)
+                self._rebuilding.start()
+            if now - snap.refreshed_at >= self.refresh_interval:
+                self._refresh(snap, db)
+
+    def high_water(self, table: str) -> int:
+        """Số phiếu lớn nhất đã đọc vào chỉ mục của bảng"""
+        snap = self._snapshot
+        return snap.high_water.get(table, 0) if snap is not None else 0
+
+    def find_tickets(self, db: Session, table: str, plate: str, exact: bool = False, max_results: Optional[int] = None) -> Optional[List[int]]:
+        """
+        Tìm số phiếu của bảng có một trong 4 cột biển số khớp biển số đã chuẩn hóa
+        Args:
+            exact: True - khớp chính xác, False - khớp tiền tố
+            max_results: Trả về None nếu số phiếu vượt quá giới hạn này
+        Returns:
+            list[int]: Số phiếu đã sắp xếp, hoặc None nếu quá nhiều kết quả
+        """
+        key = normalize_plate(plate)
+        if not key:
+            return []
+        self.ensure_fresh(db)
+
+        with self._lock:
+            snap = self._snapshot
+            if exact:
+                keys = [key] if key in snap.postings else []
+            else:
+                # Duyệt theo chỉ số từ vị trí bisect (không chép phần đuôi của mảng), dừng ở biển số đầu tiên không khớp
+                keys = []
+                index = bisect_left(snap.plate_keys, key)
+                while index < len(snap.plate_keys) and snap.plate_keys[index].startswith(key):
+                    keys.append(snap.plate_keys[index])
+                    index += 1
+
+            tickets = set()
+            for candidate in keys:
+                tickets.update(snap.postings[candidate].get(table, ()))
+                if max_results is not None and len(tickets) > max_results:
+                    return None
+        return sorted(tickets)
+
+    def profile(self, db: Session, plate: str) -> Optional[dict]:
+        """
+        Tra cứu hồ sơ theo biển số
+        Returns:
+            dict (các trường của XeProfileResponse) hoặc None nếu biển số rỗng
+        """
+        key = normalize_plate(plate)
+        if not key:
+            return None
+        self.ensure_fresh(db)
+
+        profile = self._snapshot.profiles.get(key) or {}
+        xe = self.xe_by_plate.get(key)
+        return {
+            "bienso": key,
+            "found": bool(xe or profile.get("source")),
+            "xe": xe,
+            "khachhang": profile.get("khachhang"),
+            "loaihang": profile.get("loaihang"),
+            "laixe": profile.get("laixe"),
+            "bang": profile.get("bang"),
+            "sophieu": profile.get("sophieu"),
+            "ngaycan": profile.get("ngaycan"),
+            "khoiluongbi": profile.get("khoiluongbi"),
+            "ngaycan_bi": profile.get("ngaycan_bi")
+        }
+
+
+def create_plate_index(models: Dict[str, object], change_tokens: ChangeTokens) -> PlateIndex:
+    """Tạo PlateIndex với cấu hình từ environment"""
+    return PlateIndex(
+        models,
+        change_tokens,
+        refresh_interval=float(os.getenv("PLATE_INDEX_REFRESH", "5")),
+        rebuild_interval=float(os.getenv("PLATE_INDEX_REBUILD", "3600")),
+        recent_days=int(os.getenv("PLATE_INDEX_RECENT_DAYS", "2")),
+        verify_interval=float(os.getenv("PLATE_INDEX_VERIFY", "60"))
+    )
@@ -0,0 +1,245 @@
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextvars import Context, ContextVar
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+# Hàm lá của thread đang rảnh (chờ việc, chờ socket của event loop): bỏ khỏi profile toàn tiến trình mặc định
+IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("base_events.py", "_run_once")
+}
+
+
+class ProfilerBusy(Exception):
+    """Đang có một phiên profile toàn tiến trình khác"""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    marker = filename.rfind("site-packages")
+    filename = filename[marker + 14:] if marker >= 0 else os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ",")
+
+
+def _collapse(frames: List[object], max_depth: int) -> str:
+    """Stack dạng collapsed (gốc trước, lá sau, phân cách bằng ;) như flamegraph.pl/speedscope đọc được"""
+    if len(frames) > max_depth:
+        frames = frames[-max_depth:]
+    return ";".join(_frame_label(frame) for frame in frames)
+
+
+def _stack(frame, stop=None) -> List[object]:
+    """Các frame từ gốc đến lá, dừng (không gồm) tại frame stop"""
+    frames = []
+    while frame is not None and frame is not stop:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _is_idle(frame) -> bool:
+    return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_LEAVES
+
+
+def format_collapsed(counts: Dict[str, int]) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items(), key=lambda item: -item[1]))
+
+
+class RequestProfile:
+    """Profile của một request: các mẫu stack của event loop (khi đang chạy task của request) và của thread worker"""
+
+    def __init__(self, profile_id: str, method: str, path: str):
+        self.id = profile_id
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.duration = None
+        self.samples = 0
+        self.counts: Dict[str, int] = {}
+        # Frame của ProfilerMiddleware trong task của request (chỉ lấy phần stack phía trên frame này)
+        self.frame = None
+        self.loop_thread = None
+
+    def add(self, stack: str):
+        self.counts[stack] = self.counts.get(stack, 0) + 1
+        self.samples += 1
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "at": datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "samples": self.samples
+        }
+
+
+# Request đang được profile; run_in_threadpool sao chép context nên thread worker của request cũng thấy giá trị này
+_profiled: ContextVar[Optional[RequestProfile]] = ContextVar("profiled_request", default=None)
+
+
+def _worker_context(frames: List[object]):
+    """
+    Context của việc đang chạy trong thread worker của anyio (run_in_threadpool):
+    WorkerThread.run gọi context.run(func), nên frame run giữ biến context
+    """
+    for index, frame in enumerate(frames):
+        if frame.f_code.co_name == "run" and "anyio" in frame.f_code.co_filename:
+            context = frame.f_locals.get("context")
+            if isinstance(context, Context):
+                return context, index + 1
+    return None, 0
+
+
+class Profiler:
+    """
+    Profiler lấy mẫu stack trong tiến trình (sys._current_frames), không cần khởi động lại API:
+    - profile_process: lấy mẫu mọi thread trong một khoảng thời gian giới hạn
+    - Profile từng request (ProfilerMiddleware): chỉ lấy mẫu event loop khi đang chạy task của request
+      và các thread worker đang chạy việc của request, kết quả lấy lại theo id
+    Kết quả ở dạng collapsed stack (flamegraph.pl, speedscope, inferno).
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 96, max_seconds: float = 120, keep_requests: int = 50):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.max_seconds = max_seconds
+        self.keep_requests = keep_requests
+        self._process_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._active: Dict[str, RequestProfile] = {}
+        self._finished: "OrderedDict[str, RequestProfile]" = OrderedDict()
+        self._sampler: Optional[threading.Thread] = None
+        self._ids = itertools.count(1)
+
+    def profile_process(self, seconds: float, interval: Optional[float] = None, include_idle: bool = False) -> Dict[str, int]:
+        """
+        Lấy mẫu stack của mọi thread trong seconds giây (chặn thread gọi)
+        Raises:
+            ProfilerBusy: Đang có phiên profile toàn tiến trình khác
+        """
+        if not self._process_lock.acquire(blocking=False):
+            raise ProfilerBusy("Đang có phiên profile khác, vui lòng thử lại sau")
+        try:
+            interval = interval or self.interval
+            deadline = time.monotonic() + min(seconds, self.max_seconds)
+            own = threading.get_ident()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            counts: Dict[str, int] = {}
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == own or (not include_idle and _is_idle(frame)):
+                        continue
+                    if ident not in names:
+                        names = {thread.ident: thread.name for thread in threading.enumerate()}
+                    stack = names.get(ident, str(ident)) + ";" + _collapse(_stack(frame), self.max_depth)
+                    counts[stack] = counts.get(stack, 0) + 1
+                time.sleep(interval)
+            return counts
+        finally:
+            self._process_lock.release()
+
+    def start_request(self, method: str, path: str, frame) -> RequestProfile:
+        profile = RequestProfile(f"{int(time.time())}-{next(self._ids)}", method, path)
+        profile.frame = frame
+        profile.loop_thread = threading.get_ident()
+        with self._lock:
+            self._active[profile.id] = profile
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_requests, name="request-profiler", daemon=True)
+                self._sampler.start()
+        return profile
+
+    def finish_request(self, profile: RequestProfile):
+        profile.duration = time.time() - profile.started_at
+        with self._lock:
+            self._active.pop(profile.id, None)
+            self._finished[profile.id] = profile
+            while len(self._finished) > self.keep_requests:
+                self._finished.popitem(last=False)
+
+    def _sample_requests(self):
+        """Thread lấy mẫu chạy khi có request đang được profile"""
+        while True:
+            with self._lock:
+                active = list(self._active.values())
+                if not active:
+                    self._sampler = None
+                    return
+            frames = sys._current_frames()
+            for ident, frame in frames.items():
+                stack = _stack(frame)
+                for profile in active:
+                    if ident == profile.loop_thread:
+                        # Event loop: chỉ khi task của request đang chạy (frame của middleware nằm trong stack)
+                        if any(entry is profile.frame for entry in stack):
+                            request_stack = stack[next(i for i, entry in enumerate(stack) if entry is profile.frame):]
+                            profile.add(_collapse(request_stack, self.max_depth))
+                        continue
+                    context, start = _worker_context(stack)
+                    if context is not None and context.get(_profiled) is profile:
+                        profile.add("[threadpool];" + _collapse(stack[start:], self.max_depth))
+            time.sleep(self.interval)
+
+    def request_profile(self, profile_id: str) -> Optional[RequestProfile]:
+        with self._lock:
+            return self._finished.get(profile_id) or self._active.get(profile_id)
+
+    def request_profiles(self) -> List[dict]:
+        with self._lock:
+            return [profile.summary() for profile in reversed(self._finished.values())]
+
+
+class ProfilerMiddleware:
+    """
+    ASGI middleware profile một request khi có header X-Profile: 1 (và authorize(headers) cho phép).
+    Response có header X-Profile-Id để lấy kết quả qua API quản trị.
+    """
+
+    def __init__(self, app, profiler: Profiler, authorize: Callable[[Dict[bytes, bytes]], bool]):
+        self.app = app
+        self.profiler = profiler
+        self.authorize = authorize
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        if headers.get(b"x-profile") not in (b"1", b"true") or not self.authorize(headers):
+            await self.app(scope, receive, send)
+            return
+
+        profile = self.profiler.start_request(scope["method"], scope["path"], sys._getframe())
+        token = _profiled.set(profile)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-profile-id", profile.id.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _profiled.reset(token)
+            self.profiler.finish_request(profile)
+
+
+def create_profiler() -> Profiler:
+    """Tạo Profiler với cấu hình từ environment (PROFILER_INTERVAL_MS, PROFILER_MAX_SECONDS)"""
+    return Profiler(
+        interval=float(os.getenv("PROFILER_INTERVAL_MS", "5")) / 1000,
+        max_seconds=float(os.getenv("PROFILER_MAX_SECONDS", "120"))
+    )
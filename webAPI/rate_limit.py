@@ -0,0 +1,213 @@
+import json
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs
+
+
+class RouteClass:
+    """
+    Ngân sách của một nhóm route
+    Args:
+        rate: Số request mỗi giây được nạp lại cho mỗi client
+        burst: Dung lượng bucket (số request liên tiếp tối đa)
+        max_concurrency: Số request đang xử lý cùng lúc tối đa của cả nhóm (mọi client)
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, max_concurrency: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.limited = 0
+        self.overloaded = 0
+
+
+# Ngân sách mặc định: rate/giây, burst, số request đồng thời
+DEFAULT_ROUTE_CLASSES = {
+    "realtime": (20, 40, 64),              # /realtime/data, /realtime/update
+    "stream": (1, 5, 50),                  # /realtime/stream (kết nối giữ lâu)
+    "auth": (2, 60, 32),                   # /auth/* theo IP (nhiều máy đổi ca cùng lúc sau NAT dùng chung IP)
+    "login": (0.1, 5, 32),                 # /auth/login theo iduser (chống dò mật khẩu từng tài khoản)
+    "tickets": (5, 20, 8),                 # Danh sách phiếu, /logistics/all có tu_ngay, /sync
+    "logistics_unbounded": (0.2, 2, 2),    # /logistics/all không có tu_ngay
+    "picture": (10, 30, 16),               # Xem/tải hình ảnh, danh sách hình theo ngày
+    "picture_scan": (0.1, 2, 1),           # /picture/list không có date/ticket_number (quét toàn bộ danh mục)
+    "default": (10, 40, 32)
+}
+
+TICKET_PATHS = ("/nhapkho", "/xuatkho", "/canthue", "/nhaptau", "/sync/")
+
+
+def classify_route(path: str, query: Dict[str, list]) -> Optional[str]:
+    """Nhóm route của request, None nếu không giới hạn"""
+    if path.startswith(("/webapp", "/docs", "/redoc", "/openapi.json")):
+        return None
+    if path.startswith("/realtime/stream"):
+        return "stream"
+    if path.startswith("/realtime/"):
+        return "realtime"
+    if path.startswith("/auth/"):
+        return "auth"
+    if path.startswith("/logistics/all"):
+        return "tickets" if query.get("tu_ngay") else "logistics_unbounded"
+    if path.startswith("/picture/list"):
+        # Lọc theo ngày hoặc số phiếu dùng index của danh mục hình ảnh
+        return "picture" if query.get("date") or query.get("ticket_number") else "picture_scan"
+    if path.startswith("/picture/"):
+        return "picture"
+    if path.startswith(TICKET_PATHS):
+        return "tickets"
+    return "default"
+
+
+class RateLimiter:
+    """
+    Giới hạn request trong tiến trình:
+    - Token bucket theo (client, nhóm route): vượt ngân sách -> 429 + Retry-After
+    - Giới hạn số request đồng thời của mỗi nhóm route: vượt -> 503 ngay, không xếp hàng
+    """
+
+    def __init__(self, route_classes: Dict[str, RouteClass], classify: Callable[[str, Dict[str, list]], Optional[str]] = classify_route, max_buckets: int = 10000):
+        self.route_classes = route_classes
+        self.classify = classify
+        self.max_buckets = max_buckets
+        # (client, nhóm) -> [số token còn lại, thời điểm cập nhật]
+        self._buckets: Dict[Tuple[str, str], list] = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        """Bỏ các bucket đã đầy lại (client không còn gửi request)"""
+        for key, (tokens, updated) in list(self._buckets.items()):
+            route_class = self.route_classes[key[1]]
+            if tokens + (now - updated) * route_class.rate >= route_class.burst:
+                del self._buckets[key]
+
+    def take(self, client: str, route_class: RouteClass) -> float:
+        """
+        Lấy một token của client cho nhóm route
+        Returns:
+            float: 0 nếu được phép, ngược lại số giây cần chờ
+        """
+        now = time.monotonic()
+        key = (client, route_class.name)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_buckets:
+                    self._prune(now)
+                bucket = self._buckets[key] = [route_class.burst, now]
+            tokens = min(route_class.burst, bucket[0] + (now - bucket[1]) * route_class.rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0.0
+            bucket[0] = tokens
+            return (1 - tokens) / route_class.rate if route_class.rate > 0 else 60.0
+
+    def take_login(self, iduser: str) -> float:
+        """Lấy một token đăng nhập của tài khoản (nhóm "login"), trả về số giây cần chờ như take()"""
+        route_class = self.route_classes["login"]
+        wait = self.take(f"login:{iduser}", route_class)
+        if wait > 0:
+            route_class.limited += 1
+        return wait
+
+    def stats(self) -> dict:
+        return {
+            "buckets": len(self._buckets),
+            "classes": {
+                name: {
+                    "in_flight": route_class.in_flight,
+                    "limited": route_class.limited,
+                    "overloaded": route_class.overloaded
+                }
+                for name, route_class in self.route_classes.items()
+            }
+        }
+
+
+def retry_after(wait: float) -> str:
+    """Giá trị header Retry-After (số giây nguyên, tối thiểu 1)"""
+    return str(max(1, math.ceil(wait)))
+
+
+def client_key(scope, trust_proxy: bool = False) -> str:
+    """Khóa client: user của access token, hoặc địa chỉ IP (X-Forwarded-For nếu đứng sau proxy tin cậy)"""
+    user = scope.get("state", {}).get("user")
+    if user:
+        return f"user:{user['sub']}"
+    if trust_proxy:
+        for key, value in scope["headers"]:
+            if key == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class RateLimitMiddleware:
+    """ASGI middleware áp dụng RateLimiter cho mọi request HTTP"""
+
+    def __init__(self, app, limiter: RateLimiter, trust_proxy: bool = False):
+        self.app = app
+        self.limiter = limiter
+        self.trust_proxy = trust_proxy
+
+    async def _reject(self, send, status: int, detail: str, wait: float):
+        body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"retry-after", retry_after(wait).encode("latin-1"))
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        name = self.limiter.classify(scope["path"], query)
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+        route_class = self.limiter.route_classes[name]
+
+        wait = self.limiter.take(client_key(scope, self.trust_proxy), route_class)
+        if wait > 0:
+            route_class.limited += 1
+            await self._reject(send, 429, "Quá nhiều request, vui lòng thử lại sau", wait)
+            return
+
+        if route_class.in_flight >= route_class.max_concurrency:
+            route_class.overloaded += 1
+            await self._reject(send, 503, "Hệ thống đang bận, vui lòng thử lại sau", 1)
+            return
+
+        route_class.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route_class.in_flight -= 1
+
+
+def create_rate_limiter() -> RateLimiter:
+    """
+    Tạo RateLimiter; ghi đè ngân sách từng nhóm bằng RATE_LIMIT_<NHÓM>="rate,burst,concurrency"
+    (vd. RATE_LIMIT_PICTURE_SCAN="0.05,1,1")
+    """
+    route_classes = {}
+    for name, (rate, burst, concurrency) in DEFAULT_ROUTE_CLASSES.items():
+        override = os.getenv(f"RATE_LIMIT_{name.upper()}")
+        if override:
+            rate, burst, concurrency = override.split(",")
+        route_classes[name] = RouteClass(name, float(rate), float(burst), int(concurrency))
+    return RateLimiter(route_classes)
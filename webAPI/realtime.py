@@ -0,0 +1,222 @@
+import asyncio
+import os
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+
+def _env_float(name: str, default: float) -> float:
+    """Đọc số thực từ environment variable, dùng giá trị mặc định nếu không hợp lệ"""
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_int(name: str, default: int) -> int:
+    """Đọc số nguyên từ environment variable, dùng giá trị mặc định nếu không hợp lệ"""
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_weight(value: str) -> Optional[float]:
+    """
+    Chuyển WeightValue (chuỗi từ VB App) sang số thực
+    Returns:
+        float hoặc None nếu không đọc được
+    """
+    if value is None:
+        return None
+    try:
+        return float(str(value).strip().replace(",", ""))
+    except ValueError:
+        return None
+
+
+class StabilityDetector:
+    """
+    Phát hiện cân đã ổn định dựa trên N lần đọc gần nhất.
+
+    Duy trì các tổng trượt (sum y, sum y^2, sum x*y) trên cửa sổ để tính
+    phương sai và độ dốc (hồi quy tuyến tính theo thứ tự mẫu) với chi phí
+    O(1) cho mỗi lần cập nhật. Cân được coi là ổn định khi cửa sổ đầy,
+    độ lệch chuẩn <= max_stddev và |độ dốc| <= max_slope (đơn vị cân / mẫu).
+    """
+
+    def __init__(self, window: int = 10, max_stddev: float = 10.0, max_slope: float = 5.0):
+        self.window = max(2, window)
+        self.max_stddev = max_stddev
+        self.max_slope = max_slope
+        self.reset()
+
+    def reset(self):
+        """Xóa toàn bộ cửa sổ (ví dụ khi nhận giá trị không đọc được)"""
+        self._values = deque()
+        # Các tổng được tính trên (y - offset) để tránh mất chính xác với khối lượng lớn
+        self._offset = 0.0
+        self._sum_y = 0.0
+        self._sum_yy = 0.0
+        self._sum_xy = 0.0
+        self._updates_since_rebuild = 0
+        self.stable = False
+        self.stable_since: Optional[str] = None
+        self.settled_weight: Optional[float] = None
+        self.stddev: Optional[float] = None
+        self.slope: Optional[float] = None
+
+    def _rebuild_sums(self):
+        """Tính lại các tổng từ đầu để loại bỏ sai số tích lũy do cộng/trừ liên tục"""
+        self._sum_y = 0.0
+        self._sum_yy = 0.0
+        self._sum_xy = 0.0
+        for x, value in enumerate(self._values):
+            y = value - self._offset
+            self._sum_y += y
+            self._sum_yy += y * y
+            self._sum_xy += x * y
+        self._updates_since_rebuild = 0
+
+    def update(self, value: Optional[float], timestamp: str) -> bool:
+        """
+        Thêm một lần đọc mới và cập nhật trạng thái ổn định
+        Args:
+            value: Khối lượng đọc được (None nếu không hợp lệ)
+            timestamp: Thời điểm đọc (ISO format)
+        Returns:
+            bool: Trạng thái ổn định sau khi cập nhật
+        """
+        if value is None:
+            self.reset()
+            return False
+
+        if not self._values:
+            self._offset = value
+
+        y = value - self._offset
+
+        if len(self._values) == self.window:
+            # Bỏ mẫu cũ nhất (x = 0), các mẫu còn lại lùi x đi 1
+            oldest = self._values.popleft() - self._offset
+            self._sum_y -= oldest
+            self._sum_yy -= oldest * oldest
+            self._sum_xy -= self._sum_y
+
+        # Thêm mẫu mới ở vị trí x = n
+        n = len(self._values)
+        self._values.append(value)
+        self._sum_y += y
+        self._sum_yy += y * y
+        self._sum_xy += n * y
+
+        self._updates_since_rebuild += 1
+        if self._updates_since_rebuild >= self.window * 100:
+            self._rebuild_sums()
+
+        self._evaluate(timestamp)
+        return self.stable
+
+    def _evaluate(self, timestamp: str):
+        """Tính phương sai, độ dốc và cập nhật trạng thái ổn định"""
+        n = len(self._values)
+        mean_y = self._sum_y / n
+        variance = max(self._sum_yy / n - mean_y * mean_y, 0.0)
+        self.stddev = variance ** 0.5
+
+        if n >= 2:
+            # Tổng x và x^2 với x = 0..n-1 có công thức đóng
+            sum_x = n * (n - 1) / 2
+            sum_xx = (n - 1) * n * (2 * n - 1) / 6
+            denominator = n * sum_xx - sum_x * sum_x
+            self.slope = (n * self._sum_xy - sum_x * self._sum_y) / denominator
+        else:
+            self.slope = 0.0
+
+        is_stable = (
+            n == self.window
+            and self.stddev <= self.max_stddev
+            and abs(self.slope) <= self.max_slope
+        )
+
+        if is_stable:
+            if not self.stable:
+                self.stable_since = timestamp
+            self.settled_weight = mean_y + self._offset
+        else:
+            self.stable_since = None
+            self.settled_weight = None
+        self.stable = is_stable
+
+
+class RealtimeHub:
+    """
+    Lưu trữ dữ liệu realtime mới nhất từ VB App và phát cho các client đang lắng nghe
+    """
+
+    def __init__(self, detector: StabilityDetector):
+        self.detector = detector
+        self.data = {
+            "WeightValue": "0.00",
+            "StatusCam1": "Offline",
+            "StatusCam2": "Offline",
+            "StatusCam3": "Offline",
+            "timestamp": datetime.now().isoformat()
+        }
+        self.version = 0
+        self._changed = asyncio.Event()
+
+    def publish(self, weight_value: str, status_cam1: str, status_cam2: str, status_cam3: str) -> str:
+        """
+        Cập nhật dữ liệu realtime, chạy bộ phát hiện ổn định và đánh thức các client stream
+        Returns:
+            str: Timestamp của lần cập nhật
+        """
+        current_time = datetime.now().isoformat()
+        self.detector.update(parse_weight(weight_value), current_time)
+        self.data = {
+            "WeightValue": weight_value,
+            "StatusCam1": status_cam1,
+            "StatusCam2": status_cam2,
+            "StatusCam3": status_cam3,
+            "timestamp": current_time
+        }
+        self.version += 1
+
+        # Đánh thức tất cả client đang chờ rồi tạo event mới cho lần cập nhật sau
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+        return current_time
+
+    def snapshot(self) -> dict:
+        """Dữ liệu realtime hiện tại kèm tín hiệu ổn định"""
+        settled_weight = self.detector.settled_weight
+        return {
+            **self.data,
+            "stable": self.detector.stable,
+            "stable_since": self.detector.stable_since,
+            "settled_weight": f"{settled_weight:.2f}" if settled_weight is not None else None
+        }
+
+    async def wait_for_update(self, timeout: float) -> bool:
+        """
+        Chờ lần cập nhật tiếp theo
+        Returns:
+            bool: True nếu có dữ liệu mới, False nếu hết thời gian chờ
+        """
+        changed = self._changed
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+def create_realtime_hub() -> RealtimeHub:
+    """Tạo RealtimeHub với cấu hình bộ phát hiện ổn định từ environment"""
+    detector = StabilityDetector(
+        window=_env_int("REALTIME_STABLE_WINDOW", 10),
+        max_stddev=_env_float("REALTIME_STABLE_MAX_STDDEV", 10.0),
+        max_slope=_env_float("REALTIME_STABLE_MAX_SLOPE", 5.0)
+    )
+    return RealtimeHub(detector)
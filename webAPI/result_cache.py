@@ -0,0 +1,136 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+
+class ResultCache:
+    """
+    Cache kết quả truy vấn đã serialize sẵn (JSON bytes), giới hạn theo tổng dung lượng, loại bỏ LRU.
+
+    - Khóa: dạng chuẩn hóa của truy vấn (route, bộ lọc, sắp xếp, phân trang)
+    - Mỗi mục gắn phiên bản (ETag tính từ token thay đổi của các bảng); phiên bản khác là hết hạn
+    - Nhiều request giống nhau cùng lúc chỉ chạy một truy vấn (single-flight), các request còn lại chờ kết quả
+    - Bản nén (gzip/br/zstd) được lưu cùng mục, cache hit không phải nén lại
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_entry_bytes: int = None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 4
+        # Khóa -> (phiên bản, {encoding: bytes}), encoding "identity" là JSON gốc
+        self._entries: "OrderedDict[str, Tuple[str, Dict[str, bytes]]]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.encoded_hits = 0
+
+    def get(self, key: str, version: str):
+        """Lấy bytes đã cache, None nếu chưa có hoặc đã khác phiên bản"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != version:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]["identity"]
+
+    def put(self, key: str, version: str, body: bytes):
+        if len(body) > self.max_entry_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (version, {"identity": body})
+            self._bytes += len(body)
+            self._evict()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, variants = self._entries.pop(key)
+        self._bytes -= sum(len(body) for body in variants.values())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    async def _compute(self, key: str, version: str, compute: Callable[[], bytes]) -> bytes:
+        try:
+            body = await run_in_threadpool(compute)
+            self.put(key, version, body)
+            return body
+        finally:
+            del self._inflight[(key, version)]
+
+    async def get_or_compute(self, key: str, version: str, compute: Callable[[], bytes]) -> bytes:
+        """
+        Lấy từ cache hoặc chạy compute (trong threadpool) một lần cho các request trùng nhau.
+        compute chạy trong task của cache: request khởi tạo bị hủy (client ngắt kết nối) thì các request
+        đang chờ vẫn nhận kết quả, kết quả vẫn được lưu vào cache.
+        Args:
+            compute: Hàm đồng bộ truy vấn database và trả về bytes đã serialize
+        """
+        body = self.get(key, version)
+        if body is not None:
+            self.hits += 1
+            return body
+
+        flight_key = (key, version)
+        task = self._inflight.get(flight_key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = self._inflight[flight_key] = asyncio.ensure_future(self._compute(key, version, compute))
+            # Tránh cảnh báo "exception was never retrieved" khi mọi request chờ đã bị hủy
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        return await asyncio.shield(task)
+
+    async def get_encoded(self, key: str, version: str, body: bytes, encoding: str, encode: Callable[[bytes, str], bytes]) -> bytes:
+        """
+        Bản nén của body: lấy từ cache nếu đã có, nếu không thì nén (trong threadpool) và lưu cùng mục
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version and encoding in entry[1]:
+                self.encoded_hits += 1
+                return entry[1][encoding]
+
+        encoded = await run_in_threadpool(encode, body, encoding)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version and encoding not in entry[1]:
+                entry[1][encoding] = encoded
+                self._bytes += len(encoded)
+                self._evict()
+        return encoded
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "encoded_hits": self.encoded_hits
+        }
+
+
+def create_result_cache() -> ResultCache:
+    """Tạo ResultCache với cấu hình từ environment"""
+    return ResultCache(max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))))
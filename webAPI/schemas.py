@@ -21,6 +21,13 @@ class LoginResponse(BaseModel):
     success: bool
     message: str
     user_info: Optional[UserResponse] = None
+    access_token: Optional[str] = None        # Gửi lại qua header "Authorization: Bearer <token>"
+    token_type: Optional[str] = None          # "bearer"
+    expires_in: Optional[int] = None          # Số giây token còn hiệu lực
+
+class LogoutResponse(BaseModel):
+    success: bool
+    message: str
     
 # Change password request/response schemas
 class ChangePasswordRequest(BaseModel):
@@ -45,6 +52,9 @@ class RealtimeDataResponse(BaseModel):
     StatusCam2: str
     StatusCam3: str
     timestamp: str
+    stable: bool = False                    # Cân đã ổn định
+    stable_since: Optional[str] = None      # Thời điểm bắt đầu ổn định (ISO format)
+    settled_weight: Optional[str] = None    # Khối lượng ổn định (trung bình cửa sổ)
 
 class RealtimeUpdateResponse(BaseModel):
     success: bool
@@ -272,3 +282,51 @@ class XeResponse(BaseModel):
     
     class Config:
         from_attributes = True
+
+# Suggest (autocomplete) schemas
+class SuggestItem(BaseModel):
+    id: Union[int, str]                       # Khóa chính của dòng danh mục
+    value: str                                # Giá trị hiển thị (tên khách hàng, tên hàng, biển số)
+
+class SuggestResponse(BaseModel):
+    entity: str
+    query: str
+    suggestions: List[SuggestItem] = []
+
+# Hồ sơ xe theo biển số (tự điền khách hàng, loại hàng, lái xe từ lịch sử phiếu)
+class XeProfileResponse(BaseModel):
+    bienso: str                                   # Biển số đã chuẩn hóa
+    found: bool                                   # Có dữ liệu xe hoặc lịch sử phiếu
+    xe: Optional[XeResponse] = None               # Dòng trong bảng xe (nếu có)
+    khachhang: Optional[str] = None               # Khách hàng của phiếu gần nhất
+    loaihang: Optional[str] = None                # Loại hàng của phiếu gần nhất
+    laixe: Optional[str] = None                   # Lái xe của phiếu gần nhất
+    bang: Optional[str] = None                    # Bảng của phiếu gần nhất (nhapkho, xuatkho, canthue, nhaptau)
+    sophieu: Optional[int] = None                 # Số phiếu gần nhất
+    ngaycan: Optional[date] = None                # Ngày cân của phiếu gần nhất
+    khoiluongbi: Optional[Decimal] = None         # Khối lượng bì (xe không tải) gần nhất
+    ngaycan_bi: Optional[date] = None             # Ngày cân của phiếu có khối lượng bì
+
+# Tham số lọc chung cho các bảng phiếu cân (nhapkho, xuatkho, canthue, nhaptau)
+class TicketQueryParams(BaseModel):
+    tu_ngay: Optional[date] = None            # Từ ngày
+    den_ngay: Optional[date] = None           # Đến ngày
+    khachhang: Optional[str] = None           # Tên khách hàng (contains)
+    sophieu: Optional[str] = None             # Số phiếu (contains)
+    bienso: Optional[str] = None              # Biển số xe (tiền tố, cả 4 cột biển số)
+    bienso_exact: bool = False                # Khớp chính xác biển số
+    loaihang: Optional[str] = None            # Loại hàng (contains)
+    include_deleted: bool = False             # Lấy cả phiếu đã xóa (xoaphieu = 1)
+    limit: Optional[int] = None               # Giới hạn số records trả về
+    offset: int = 0                           # Vị trí bắt đầu lấy dữ liệu
+
+# Đồng bộ tăng dần các phiếu đã thay đổi (thêm mới, sửa, xóa mềm) kể từ một token
+class SyncTicketsResponse(BaseModel):
+    token: str                                    # Token để gửi ở lần đồng bộ tiếp theo (since)
+    full_resync: bool = False                     # Token không còn hợp lệ: client cần tải lại toàn bộ
+    has_more: bool = False                        # Còn thay đổi chưa trả về, gọi tiếp với token mới
+    nhapkho: List[NhapkhoResponse] = []
+    xuatkho: List[XuatkhoResponse] = []
+    canthue: List[CanthueResponse] = []
+    nhaptau: List[NhaptauResponse] = []
+    deleted: Dict[str, List[int]] = {}            # Số phiếu bị xóa hẳn khỏi database theo bảng
@@ -0,0 +1,89 @@
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple, get_args, get_origin
+
+from pydantic import BaseModel
+
+# Thư viện MessagePack tùy chọn: pip install msgpack
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+# Schema -> [(tên trường, kiểu lồng nhau hoặc None nếu là giá trị đơn)]
+_plans: Dict[type, List[Tuple[str, Optional[object]]]] = {}
+
+
+def wants_msgpack(accept: Optional[str]) -> bool:
+    """Client yêu cầu MessagePack qua header Accept (và thư viện msgpack đã cài)"""
+    if msgpack is None or not accept:
+        return False
+    for part in accept.split(","):
+        media_type, _, params = part.strip().partition(";")
+        if media_type.strip().lower() not in MSGPACK_MEDIA_TYPES:
+            continue
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def _nested(annotation) -> Optional[object]:
+    """Kiểu cần chuyển đổi tiếp (list, schema con), None nếu là giá trị đơn"""
+    origin = get_origin(annotation)
+    if origin is list:
+        return annotation
+    if origin is not None:
+        # Optional[X]
+        for arg in get_args(annotation):
+            nested = _nested(arg)
+            if nested is not None:
+                return nested
+        return None
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    return None
+
+
+def _plan(schema: type) -> List[Tuple[str, Optional[object]]]:
+    plan = _plans.get(schema)
+    if plan is None:
+        plan = _plans[schema] = [(name, _nested(field.annotation)) for name, field in schema.model_fields.items()]
+    return plan
+
+
+def to_plain(value, annotation):
+    """
+    Chuyển ORM object/dict thành dict/list thuần theo các trường của schema, không qua validate của Pydantic
+    """
+    if value is None:
+        return None
+    if get_origin(annotation) is list:
+        item = get_args(annotation)[0]
+        return [to_plain(entry, item) for entry in value]
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        if isinstance(value, dict):
+            return {name: value.get(name) if nested is None else to_plain(value.get(name), nested) for name, nested in _plan(annotation)}
+        return {name: getattr(value, name, None) if nested is None else to_plain(getattr(value, name, None), nested) for name, nested in _plan(annotation)}
+    return value
+
+
+def _encode_default(value):
+    """Decimal -> chuỗi (giữ đúng giá trị như JSON), date/datetime/time -> ISO 8601"""
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    raise TypeError(f"Không serialize được kiểu {type(value).__name__}")
+
+
+def pack_msgpack(value, annotation) -> bytes:
+    """Serialize dữ liệu trả về của API (theo response schema) thành MessagePack"""
+    return msgpack.packb(to_plain(value, annotation), default=_encode_default, use_bin_type=True)
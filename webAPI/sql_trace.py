@@ -0,0 +1,308 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from metrics import current_route
+
+# Route của câu SQL chạy ngoài request (job lưu trữ, khởi động, CLI)
+BACKGROUND_ROUTE = "-"
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING_LITERAL = re.compile(r"N?'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w\]])-?\d+(?:\.\d+)?\b")
+# Danh sách IN (?, ?, ...) có độ dài thay đổi theo số tham số
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_TABLE = re.compile(r"\b(?:FROM|JOIN|INTO|UPDATE)\s+(?:\[?\w+\]?\.)?\[?(\w+)\]?", re.IGNORECASE)
+
+
+def statement_shape(statement: str) -> str:
+    """Dạng chuẩn của câu SQL: bỏ khác biệt về khoảng trắng, giá trị hằng và độ dài danh sách IN"""
+    shape = _WHITESPACE.sub(" ", statement).strip()
+    shape = _STRING_LITERAL.sub("?", shape)
+    shape = _NUMBER_LITERAL.sub("?", shape)
+    return _IN_LIST.sub("(?...)", shape)
+
+
+def statement_tables(statement: str) -> List[str]:
+    """Các bảng xuất hiện sau FROM/JOIN/INTO/UPDATE"""
+    tables = []
+    for name in _TABLE.findall(statement):
+        if name.lower() not in tables and not name.lower().startswith("changetable"):
+            tables.append(name.lower())
+    return tables
+
+
+class ShapeStats:
+    """Thống kê của một dạng câu SQL"""
+
+    def __init__(self, shape: str, tables: List[str], samples: int):
+        self.shape = shape
+        self.fingerprint = hashlib.sha1(shape.encode("utf-8")).hexdigest()[:12]
+        self.tables = tables
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.slow = 0
+        self.routes: Dict[str, int] = {}
+        # Thời gian của các lần chạy gần nhất để tính p50/p99
+        self.durations: Deque[float] = deque(maxlen=samples)
+        self.plan: Optional[str] = None
+        self.plan_captured_at: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        durations = sorted(self.durations)
+
+        def percentile(q: float) -> float:
+            if not durations:
+                return 0.0
+            return round(durations[min(len(durations) - 1, int(q * len(durations)))] * 1000, 3)
+
+        return {
+            "fingerprint": self.fingerprint,
+            "shape": self.shape,
+            "tables": self.tables,
+            "routes": dict(sorted(self.routes.items(), key=lambda item: -item[1])),
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+            "p50_ms": percentile(0.5),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(self.max * 1000, 3),
+            "rows": self.rows,
+            "rows_per_exec": round(self.rows / self.count, 1) if self.count else 0.0,
+            "slow": self.slow,
+            "has_plan": self.plan is not None
+        }
+
+
+class _CountingCursor:
+    """Bọc cursor DBAPI để đếm số dòng SELECT trả về khi SQLAlchemy fetch kết quả"""
+
+    def __init__(self, cursor, tracer: "SQLTracer", stats: ShapeStats):
+        self._cursor = cursor
+        self._tracer = tracer
+        self._stats = stats
+
+    def _count(self, rows: int):
+        with self._tracer._lock:
+            self._stats.rows += rows
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._count(1)
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._count(len(rows))
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+
+class SQLTracer:
+    """
+    Đo thời gian mọi câu SQL của engine, gắn route (đường dẫn mẫu của request) và bảng:
+    - Thống kê theo dạng câu SQL: số lần chạy, p50/p99/max, số dòng trả về, route gọi
+    - Câu chạy lâu hơn slow_ms ghi vào slow-query log (file JSON lines nếu có log_path) và giữ bản gần nhất trong bộ nhớ
+    - capture_plans: lấy SHOWPLAN XML (SQL Server) của dạng câu chậm trong thread nền, mỗi dạng tối đa một lần mỗi plan_ttl giây
+
+    Thời gian đo là thời gian thực thi trên cursor, không gồm thời gian fetch kết quả.
+    """
+
+    def __init__(self, engine: Engine, slow_ms: float = 500, max_shapes: int = 2000, samples: int = 1024,
+                 slow_log_size: int = 200, log_path: Optional[str] = None, capture_plans: bool = False, plan_ttl: float = 3600):
+        self.engine = engine
+        self.slow_seconds = slow_ms / 1000
+        self.max_shapes = max_shapes
+        self.samples = samples
+        self.log_path = log_path
+        self.capture_plans = capture_plans and engine.dialect.name == "mssql"
+        self.plan_ttl = plan_ttl
+        self._lock = threading.Lock()
+        self._shapes: Dict[str, ShapeStats] = {}
+        # câu SQL gốc -> (dạng chuẩn, bảng); câu SQL do SQLAlchemy sinh ra lặp lại nên cache lại kết quả chuẩn hóa
+        self._normalized: "OrderedDict[str, tuple]" = OrderedDict()
+        self._slow: Deque[dict] = deque(maxlen=slow_log_size)
+        self._plan_executor: Optional[ThreadPoolExecutor] = None
+        self._plans_pending = set()
+        self.dropped = 0
+        self.started_at = time.time()
+
+    def install(self):
+        event.listen(self.engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(self.engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _normalize(self, statement: str) -> tuple:
+        with self._lock:
+            normalized = self._normalized.get(statement)
+            if normalized is not None:
+                self._normalized.move_to_end(statement)
+                return normalized
+        normalized = (statement_shape(statement), statement_tables(statement))
+        with self._lock:
+            self._normalized[statement] = normalized
+            if len(self._normalized) > 4 * self.max_shapes:
+                self._normalized.popitem(last=False)
+        return normalized
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None and not context.execution_options.get("sql_trace_skip"):
+            context._sql_trace_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_sql_trace_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        shape, tables = self._normalize(statement)
+        route = current_route() or BACKGROUND_ROUTE
+
+        with self._lock:
+            stats = self._shapes.get(shape)
+            if stats is None:
+                if len(self._shapes) >= self.max_shapes:
+                    self.dropped += 1
+                    return
+                stats = self._shapes[shape] = ShapeStats(shape, tables, self.samples)
+            stats.count += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.durations.append(elapsed)
+            stats.routes[route] = stats.routes.get(route, 0) + 1
+            if cursor.description is None and cursor.rowcount > 0:
+                stats.rows += cursor.rowcount
+            slow = elapsed >= self.slow_seconds
+            if slow:
+                stats.slow += 1
+
+        if cursor.description is not None and not executemany:
+            # SELECT: đếm số dòng khi SQLAlchemy fetch (kết quả được đọc từ context.cursor sau sự kiện này)
+            context.cursor = _CountingCursor(cursor, self, stats)
+        if slow:
+            self._record_slow(stats, statement, parameters, route, elapsed)
+
+    def _record_slow(self, stats: ShapeStats, statement: str, parameters, route: str, elapsed: float):
+        entry = {
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "fingerprint": stats.fingerprint,
+            "route": route,
+            "tables": stats.tables,
+            "duration_ms": round(elapsed * 1000, 3),
+            "statement": statement,
+            "parameters": repr(parameters)[:500]
+        }
+        with self._lock:
+            self._slow.append(entry)
+        print(f"🐢 SQL chậm {entry['duration_ms']}ms [{route}] {stats.fingerprint} {','.join(stats.tables)}")
+        if self.log_path:
+            try:
+                with open(self.log_path, "a", encoding="utf-8") as log:
+                    log.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"⚠️ Không ghi được slow-query log {self.log_path}: {e}")
+        if self.capture_plans:
+            self._schedule_plan(stats, statement, parameters)
+
+    def _schedule_plan(self, stats: ShapeStats, statement: str, parameters):
+        with self._lock:
+            if stats.fingerprint in self._plans_pending:
+                return
+            if stats.plan_captured_at is not None and time.time() - stats.plan_captured_at < self.plan_ttl:
+                return
+            self._plans_pending.add(stats.fingerprint)
+            if self._plan_executor is None:
+                self._plan_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sql-plan")
+        self._plan_executor.submit(self._capture_plan, stats, statement, parameters)
+
+    def _capture_plan(self, stats: ShapeStats, statement: str, parameters):
+        """Lấy estimated plan (SHOWPLAN XML) trên kết nối riêng, câu SQL không thực sự chạy"""
+        try:
+            with self.engine.connect().execution_options(sql_trace_skip=True) as conn:
+                conn.exec_driver_sql("SET SHOWPLAN_XML ON")
+                try:
+                    plan = conn.exec_driver_sql(statement, parameters).scalar()
+                finally:
+                    conn.exec_driver_sql("SET SHOWPLAN_XML OFF")
+            with self._lock:
+                stats.plan = plan
+                stats.plan_captured_at = time.time()
+        except Exception as e:
+            print(f"⚠️ Không lấy được SHOWPLAN cho {stats.fingerprint}: {e}")
+            with self._lock:
+                stats.plan_captured_at = time.time()
+        finally:
+            with self._lock:
+                self._plans_pending.discard(stats.fingerprint)
+
+    def shapes(self, sort: str = "total_ms", limit: int = 50, route: Optional[str] = None, table: Optional[str] = None) -> List[dict]:
+        """Thống kê các dạng câu SQL, sắp xếp giảm dần theo trường sort"""
+        with self._lock:
+            items = [
+                stats.to_dict() for stats in self._shapes.values()
+                if (route is None or route in stats.routes) and (table is None or table.lower() in stats.tables)
+            ]
+        items.sort(key=lambda item: item.get(sort, 0), reverse=True)
+        return items[:limit]
+
+    def slow_queries(self, limit: int = 50) -> List[dict]:
+        with self._lock:
+            return list(self._slow)[-limit:][::-1]
+
+    def plan(self, fingerprint: str) -> Optional[str]:
+        with self._lock:
+            for stats in self._shapes.values():
+                if stats.fingerprint == fingerprint:
+                    return stats.plan
+        return None
+
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
+            self._slow.clear()
+            self.dropped = 0
+            self.started_at = time.time()
+
+    def stats(self) -> dict:
+        return {
+            "shapes": len(self._shapes),
+            "dropped": self.dropped,
+            "slow_ms": self.slow_seconds * 1000,
+            "capture_plans": self.capture_plans,
+            "since": datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds")
+        }
+
+
+def create_sql_tracer(engine: Engine) -> SQLTracer:
+    """
+    Tạo SQLTracer với cấu hình từ environment:
+    SQL_SLOW_MS (mặc định 500), SQL_SLOW_LOG (file JSON lines), SQL_TRACE_SHOWPLAN=true (chỉ SQL Server)
+    """
+    return SQLTracer(
+        engine,
+        slow_ms=float(os.getenv("SQL_SLOW_MS", "500")),
+        max_shapes=int(os.getenv("SQL_TRACE_MAX_SHAPES", "2000")),
+        log_path=os.getenv("SQL_SLOW_LOG") or None,
+        capture_plans=os.getenv("SQL_TRACE_SHOWPLAN", "false").lower() == "true"
+    )
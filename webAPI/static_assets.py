@@ -0,0 +1,221 @@
+"""
+Phục vụ bundle Flutter webAPP: file nén sẵn (br/gzip), ETag theo hash nội dung, no-cache + 304 khi không đổi.
+
+Nén sẵn khi khởi động API (chạy nền) hoặc lúc build/deploy:
+    python static_assets.py            # Nén toàn bộ webAPP vào STATIC_CACHE_DIR
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import pathlib
+import re
+import stat
+import threading
+from typing import Dict, Optional, Tuple
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+
+from compression import brotli, negotiate_encoding
+
+# Các loại file nén được (ảnh png/jpg đã nén sẵn)
+COMPRESSIBLE_SUFFIXES = {".js", ".mjs", ".wasm", ".json", ".html", ".css", ".otf", ".ttf", ".symbols", ".bin", ".frag", ".svg", ".txt", ""}
+
+# Encoding nén sẵn -> phần mở rộng của file trong thư mục cache
+PRECOMPRESSED = {"br": "br", "gzip": "gz"}
+
+RESOURCES_PATTERN = re.compile(r"const RESOURCES = (\{.*?\});", re.S)
+
+
+def read_service_worker_hashes(directory: pathlib.Path) -> Dict[str, str]:
+    """Đọc RESOURCES (đường dẫn -> md5) trong flutter_service_worker.js do flutter build tạo ra"""
+    service_worker = directory / "flutter_service_worker.js"
+    if not service_worker.is_file():
+        return {}
+    match = RESOURCES_PATTERN.search(service_worker.read_text(encoding="utf-8"))
+    if not match:
+        return {}
+    try:
+        return json.loads(match.group(1))
+    except ValueError:
+        return {}
+
+
+def _md5(path: pathlib.Path) -> str:
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class WebAppStaticFiles(StaticFiles):
+    """
+    StaticFiles cho bundle Flutter:
+    - ETag = md5 nội dung (trùng hash trong RESOURCES của flutter_service_worker.js khi file chưa bị sửa sau build),
+      tính lại khi (kích thước, thời điểm sửa) của file đổi nên deploy webAPP không cần khởi động lại API
+    - Mọi file: no-cache + ETag, trình duyệt hỏi lại và nhận 304 nếu không đổi
+      (loader của Flutter tải main.dart.js, canvaskit... không kèm hash trên URL nên không cache immutable được)
+    - Chọn bản nén sẵn br/gzip trong cache_dir theo Accept-Encoding (tên bản nén gồm md5 của nội dung)
+    """
+
+    def __init__(self, directory: str, cache_dir: str, html: bool = True, brotli_quality: int = 9, min_size: int = 1024):
+        super().__init__(directory=directory, html=html)
+        self.root = pathlib.Path(directory).resolve()
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.brotli_quality = brotli_quality
+        self.min_size = min_size
+        # Đường dẫn tương đối -> (kích thước, thời điểm sửa, md5); tính khi cần, không tính lúc import
+        self._hashes: Dict[str, Tuple[int, float, str]] = {}
+
+    def _relative(self, full_path) -> Optional[str]:
+        try:
+            return pathlib.Path(full_path).resolve().relative_to(self.root).as_posix()
+        except ValueError:
+            return None
+
+    def _content_hash(self, rel: str, stat_result: os.stat_result) -> str:
+        """md5 của file, tính lại khi kích thước hoặc thời điểm sửa khác lần tính trước (chạy trong thread, không trong event loop)"""
+        signature = (stat_result.st_size, stat_result.st_mtime)
+        cached = self._hashes.get(rel)
+        if cached is not None and cached[:2] == signature:
+            return cached[2]
+        content_hash = _md5(self.root / rel)
+        self._hashes[rel] = (*signature, content_hash)
+        if cached is not None and cached[2] != content_hash and self._compressible(rel, stat_result.st_size):
+            # File đổi sau khi API đã chạy (deploy webAPP mới): nén sẵn bản mới trong thread nền
+            threading.Thread(target=self._compress_file, args=(rel, content_hash), name="webapp-precompress", daemon=True).start()
+        return content_hash
+
+    def _cached_hash(self, rel: str, stat_result: os.stat_result) -> Optional[str]:
+        """md5 đã tính cho đúng phiên bản file này, None nếu chưa có (file vừa đổi giữa lookup và response)"""
+        cached = self._hashes.get(rel)
+        if cached is not None and cached[:2] == (stat_result.st_size, stat_result.st_mtime):
+            return cached[2]
+        return None
+
+    def lookup_path(self, path: str):
+        # StaticFiles gọi lookup_path trong threadpool: tính md5 ở đây để file_response (trong event loop) chỉ tra cache
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+            rel = self._relative(full_path)
+            if rel is not None:
+                self._content_hash(rel, stat_result)
+        return full_path, stat_result
+
+    def _variant_path(self, rel: str, content_hash: str, encoding: str) -> pathlib.Path:
+        return self.cache_dir / f"{rel}.{content_hash}.{PRECOMPRESSED[encoding]}"
+
+    def _compressible(self, rel: str, size: int) -> bool:
+        return pathlib.PurePosixPath(rel).suffix.lower() in COMPRESSIBLE_SUFFIXES and size >= self.min_size
+
+    def _compress_file(self, rel: str, content_hash: str) -> int:
+        """Tạo các bản nén còn thiếu của một file, trả về số bản đã tạo"""
+        encoders = {"gzip": lambda body: gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            encoders["br"] = lambda body: brotli.compress(body, quality=self.brotli_quality)
+        body = None
+        created = 0
+        for encoding, encode in encoders.items():
+            target = self._variant_path(rel, content_hash, encoding)
+            if target.is_file():
+                continue
+            if body is None:
+                body = (self.root / rel).read_bytes()
+                # File đổi lần nữa trong lúc chờ: bản nén phải khớp md5 trong tên file
+                if hashlib.md5(body).hexdigest() != content_hash:
+                    return created
+            target.parent.mkdir(parents=True, exist_ok=True)
+            temp = target.with_name(f"{target.name}.{threading.get_ident()}.tmp")
+            temp.write_bytes(encode(body))
+            os.replace(temp, target)
+            created += 1
+        return created
+
+    def precompress(self) -> int:
+        """
+        Tính md5 và tạo các bản nén còn thiếu (tên file gồm md5 nên bản cũ không bao giờ bị dùng nhầm)
+        Returns:
+            int: Số file nén mới
+        """
+        hashes = {}
+        created = 0
+        for path in self.root.rglob("*"):
+            if not path.is_file():
+                continue
+            rel = path.relative_to(self.root).as_posix()
+            stat_result = path.stat()
+            content_hash = hashes[rel] = self._content_hash(rel, stat_result)
+            if self._compressible(rel, stat_result.st_size):
+                created += self._compress_file(rel, content_hash)
+
+        # File bị sửa sau build (vd. config.js) vẫn có ETag đúng, chỉ cảnh báo
+        resources = read_service_worker_hashes(self.root)
+        mismatched = [rel for rel, value in resources.items() if rel in hashes and hashes[rel] != value]
+        if mismatched:
+            print(f"⚠️ webAPP: {len(mismatched)} file khác hash trong flutter_service_worker.js: {', '.join(mismatched[:5])}")
+        return created
+
+    def precompress_in_background(self):
+        """Nén sẵn trong thread nền để không làm chậm khởi động; trong lúc chờ phục vụ bản gốc"""
+        def run():
+            try:
+                created = self.precompress()
+                if created:
+                    print(f"🗜️ webAPP: đã nén sẵn {created} file vào {self.cache_dir}")
+            except Exception as e:
+                print(f"⚠️ webAPP: lỗi khi nén sẵn: {e}")
+        threading.Thread(target=run, name="webapp-precompress", daemon=True).start()
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        rel = self._relative(full_path)
+        if rel is None:
+            return super().file_response(full_path, stat_result, scope, status_code)
+
+        content_hash = self._cached_hash(rel, stat_result)
+        headers = {"Cache-Control": "no-cache"}
+        media_type = mimetypes.guess_type(str(full_path))[0] or "text/plain"
+
+        path, file_stat = full_path, stat_result
+        if content_hash is not None:
+            headers["ETag"] = f'"{content_hash}"'
+            if self._compressible(rel, stat_result.st_size):
+                headers["Vary"] = "Accept-Encoding"
+                variants = {encoding: self._variant_path(rel, content_hash, encoding) for encoding in PRECOMPRESSED}
+                available = [encoding for encoding, variant in variants.items() if variant.is_file()]
+                encoding = negotiate_encoding(request_headers.get("accept-encoding"), available)
+                if encoding is not None:
+                    path = variants[encoding]
+                    file_stat = path.stat()
+                    headers["Content-Encoding"] = encoding
+                    headers["ETag"] = f'"{content_hash}-{PRECOMPRESSED[encoding]}"'
+
+        response = FileResponse(
+            path, status_code=status_code, headers=headers, media_type=media_type,
+            stat_result=file_stat, method=scope["method"]
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def create_webapp_static_files(directory: pathlib.Path, precompress_on_startup: bool = True) -> WebAppStaticFiles:
+    """Tạo WebAppStaticFiles với cấu hình từ environment, nén sẵn nền nếu STATIC_PRECOMPRESS_ON_STARTUP=true"""
+    static_files = WebAppStaticFiles(
+        str(directory),
+        cache_dir=os.getenv("STATIC_CACHE_DIR", str(pathlib.Path(__file__).parent / ".static_cache")),
+        brotli_quality=int(os.getenv("STATIC_BROTLI_QUALITY", "9"))
+    )
+    if precompress_on_startup and os.getenv("STATIC_PRECOMPRESS_ON_STARTUP", "true").lower() == "true":
+        static_files.precompress_in_background()
+    return static_files
+
+
+if __name__ == "__main__":
+    static_files = create_webapp_static_files(pathlib.Path(__file__).parent.parent / "webAPP", precompress_on_startup=False)
+    print(f"🗜️ Đã nén sẵn {static_files.precompress()} file vào {static_files.cache_dir}")
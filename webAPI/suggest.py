@@ -0,0 +1,148 @@
+import threading
+from bisect import bisect_left, insort
+from typing import Callable, Dict, List, Tuple
+
+from text_utils import fold_vietnamese, normalize_plate
+
+class SuggestIndex:
+    """
+    Chỉ mục gợi ý theo tiền tố cho một cột của bảng danh mục.
+
+    Khóa đã chuẩn hóa (toàn chuỗi và từng vị trí đầu từ) lưu trong các mảng đã sắp xếp, tách riêng
+    khóa toàn chuỗi / khóa từ và chia theo độ dài của khóa toàn chuỗi; tìm kiếm bằng bisect.
+    Thứ hạng: khớp chính xác > tiền tố toàn chuỗi > tiền tố của một từ, sau đó ưu tiên chuỗi ngắn hơn,
+    rồi theo thứ tự chữ cái. Duyệt các mảng theo đúng thứ hạng nên dừng ngay khi đủ limit kết quả.
+    """
+
+    def __init__(self, key_column: str, value_column: str, normalize: Callable[[object], str], word_prefixes: bool = True):
+        self.key_column = key_column
+        self.value_column = value_column
+        self.normalize = normalize
+        self.word_prefixes = word_prefixes
+        # Độ dài khóa toàn chuỗi -> [(khóa, pk, giá trị)] đã sắp xếp
+        self._full: Dict[int, List[Tuple[str, object, str]]] = {}
+        self._words: Dict[int, List[Tuple[str, object, str]]] = {}
+        self._lock = threading.Lock()
+
+    def _entries_for(self, row: dict) -> List[Tuple[Dict[int, list], int, Tuple[str, object, str]]]:
+        """Các khóa chỉ mục của một dòng: (nhóm khóa, độ dài khóa toàn chuỗi, khóa)"""
+        value = row.get(self.value_column)
+        if not value:
+            return []
+        value = str(value).strip()
+        key = self.normalize(value)
+        if not key:
+            return []
+
+        pk = row[self.key_column]
+        entries = [(self._full, len(key), (key, pk, value))]
+        if self.word_prefixes:
+            words = key.split()
+            for i in range(1, len(words)):
+                entries.append((self._words, len(key), (" ".join(words[i:]), pk, value)))
+        return entries
+
+    def __len__(self) -> int:
+        return sum(len(bucket) for group in (self._full, self._words) for bucket in group.values())
+
+    def apply_changes(self, old_rows: List[dict], new_rows: List[dict]):
+        """Cập nhật chỉ mục theo phần khác nhau giữa dữ liệu cũ và mới (không dựng lại toàn bộ)"""
+        old_by_pk = {row[self.key_column]: row.get(self.value_column) for row in old_rows}
+        new_by_pk = {row[self.key_column]: row.get(self.value_column) for row in new_rows}
+
+        removed = [row for row in old_rows if new_by_pk.get(row[self.key_column], object()) != row.get(self.value_column)]
+        added = [row for row in new_rows if old_by_pk.get(row[self.key_column], object()) != row.get(self.value_column)]
+
+        with self._lock:
+            if not old_rows:
+                # Lần nạp đầu tiên: sắp xếp một lần
+                self._full.clear()
+                self._words.clear()
+                for row in new_rows:
+                    for group, length, entry in self._entries_for(row):
+                        group.setdefault(length, []).append(entry)
+                for group in (self._full, self._words):
+                    for bucket in group.values():
+                        bucket.sort()
+                return
+            for row in removed:
+                for group, length, entry in self._entries_for(row):
+                    bucket = group.get(length, [])
+                    index = bisect_left(bucket, entry)
+                    if index < len(bucket) and bucket[index] == entry:
+                        del bucket[index]
+                        if not bucket:
+                            del group[length]
+            for row in added:
+                for group, length, entry in self._entries_for(row):
+                    insort(group.setdefault(length, []), entry)
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[object, str]]:
+        """
+        Tìm các giá trị có tiền tố khớp query
+        Returns:
+            list[(pk, value)]: Tối đa limit kết quả đã xếp hạng
+        """
+        needle = self.normalize(query)
+        if not needle or limit <= 0:
+            return []
+
+        results: List[Tuple[object, str]] = []
+        seen = set()
+        with self._lock:
+            # Khớp chính xác (độ dài bằng needle), tiền tố toàn chuỗi, tiền tố của một từ; mỗi nhóm từ khóa ngắn đến dài
+            tiers = [(self._full, [len(needle)])]
+            tiers.append((self._full, sorted(length for length in self._full if length > len(needle))))
+            tiers.append((self._words, sorted(length for length in self._words if length > len(needle))))
+            for group, lengths in tiers:
+                for length in lengths:
+                    bucket = group.get(length, ())
+                    index = bisect_left(bucket, (needle,))
+                    while index < len(bucket):
+                        key, pk, value = bucket[index]
+                        if not key.startswith(needle):
+                            break
+                        index += 1
+                        if pk in seen:
+                            continue
+                        seen.add(pk)
+                        results.append((pk, value))
+                        if len(results) >= limit:
+                            return results
+        return results
+
+
+# Cấu hình các entity hỗ trợ gợi ý: entity -> (bảng danh mục, khóa chính, cột giá trị)
+SUGGEST_ENTITIES = {
+    "khachhang": ("khachhang", "ID", "tenkhachhang"),
+    "loaihang": ("loaihang", "mahang", "tenhang"),
+    "xe": ("xe", "ID", "blenso_xe")
+}
+
+
+class SuggestService:
+    """Quản lý chỉ mục gợi ý, cập nhật theo các lần nạp lại của MasterDataCache"""
+
+    def __init__(self, master_cache):
+        self.master_cache = master_cache
+        self.indexes: Dict[str, SuggestIndex] = {}
+        self._entity_by_table: Dict[str, str] = {}
+        for entity, (table, key_column, value_column) in SUGGEST_ENTITIES.items():
+            if entity == "xe":
+                index = SuggestIndex(key_column, value_column, normalize_plate, word_prefixes=False)
+            else:
+                index = SuggestIndex(key_column, value_column, fold_vietnamese)
+            self.indexes[entity] = index
+            self._entity_by_table[table] = entity
+        master_cache.add_listener(self._on_reload)
+
+    def _on_reload(self, table: str, old_rows: List[dict], new_rows: List[dict]):
+        entity = self._entity_by_table.get(table)
+        if entity:
+            self.indexes[entity].apply_changes(old_rows, new_rows)
+
+    def suggest(self, db, entity: str, query: str, limit: int = 10) -> List[Tuple[object, str]]:
+        """Gợi ý cho entity; đảm bảo bảng danh mục còn mới trước khi tìm"""
+        table = SUGGEST_ENTITIES[entity][0]
+        self.master_cache.rows(db, table)
+        return self.indexes[entity].search(query, limit)
@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+from auth_tokens import InvalidToken, TokenAuthority, bearer_token
+
+
+def test_issue_and_verify():
+    authority = TokenAuthority(b"secret", ttl=60)
+    token, expires_in = authority.issue("admin")
+    assert expires_in == 60
+    assert authority.verify(token)["sub"] == "admin"
+
+
+def test_rejects_tampered_and_foreign_tokens():
+    authority = TokenAuthority(b"secret", ttl=60)
+    token, _ = authority.issue("admin")
+    payload, signature = token.split(".")
+    with pytest.raises(InvalidToken):
+        authority.verify(f"{payload}x.{signature}")
+    with pytest.raises(InvalidToken):
+        TokenAuthority(b"other", ttl=60).verify(token)
+    with pytest.raises(InvalidToken):
+        authority.verify("not-a-token")
+
+
+def test_rejects_expired_token():
+    authority = TokenAuthority(b"secret", ttl=-1)
+    token, _ = authority.issue("admin")
+    with pytest.raises(InvalidToken):
+        authority.verify(token)
+
+
+def test_revoke_and_revoke_user():
+    authority = TokenAuthority(b"secret", ttl=60)
+    first, _ = authority.issue("admin")
+    second, _ = authority.issue("admin")
+
+    authority.revoke(authority.verify(first))
+    with pytest.raises(InvalidToken):
+        authority.verify(first)
+    assert authority.verify(second)["sub"] == "admin"
+
+    authority.revoke_user("admin")
+    with pytest.raises(InvalidToken):
+        authority.verify(second)
+    time.sleep(0.005)
+    third, _ = authority.issue("admin")
+    assert authority.verify(third)["sub"] == "admin"
+
+
+def test_revoke_past_capacity_keeps_unexpired_tokens_revoked():
+    authority = TokenAuthority(b"secret", ttl=60, revoked_capacity=2)
+    tokens = []
+    for iduser in ("a", "b", "c"):
+        token, _ = authority.issue(iduser)
+        tokens.append(token)
+    time.sleep(0.005)
+    later, _ = authority.issue("c")
+
+    for token in tokens:
+        authority.revoke(authority.verify(token))
+    for token in tokens:
+        with pytest.raises(InvalidToken):
+            authority.verify(token)
+    # Quá dung lượng: thu hồi theo user, token cấp sau vẫn dùng được
+    assert authority.verify(later)["sub"] == "c"
+    assert authority.stats()["revoked"] == 2
+
+
+def test_revoke_drops_only_expired_entries():
+    authority = TokenAuthority(b"secret", ttl=-1, revoked_capacity=1)
+    authority.revoke({"sub": "a", "iat": 0, "exp": 0, "jti": "het-han"})
+    authority.ttl = 60
+    token, _ = authority.issue("b")
+    authority.revoke(authority.verify(token))
+    assert "het-han" not in authority._revoked and authority.stats()["revoked"] == 1
+    assert authority._not_before == {}
+    with pytest.raises(InvalidToken):
+        authority.verify(token)
+
+
+def test_bearer_token_from_header_or_query():
+    assert bearer_token("Bearer abc") == "abc"
+    assert bearer_token("Basic abc") is None
+    assert bearer_token(None, b"access_token=xyz&x=1") == "xyz"
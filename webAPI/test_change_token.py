@@ -0,0 +1,88 @@
+from datetime import date, timedelta
+
+from change_token import ChangeTokens, not_modified
+from database import Nhapkho
+
+
+def test_token_changes_on_insert_edit_and_bump(db, make_ticket):
+    tokens = ChangeTokens({"nhapkho": Nhapkho}, ttl=0)
+    db.add(make_ticket(Nhapkho, 1))
+    db.commit()
+    first, _ = tokens.token(db, "nhapkho")
+
+    db.add(make_ticket(Nhapkho, 2))
+    db.commit()
+    second, _ = tokens.token(db, "nhapkho")
+    assert second != first
+
+    db.get(Nhapkho, 1).lanin = 1
+    db.commit()
+    third, _ = tokens.token(db, "nhapkho")
+    assert third != second
+
+    tokens.bump("nhapkho")
+    assert tokens.token(db, "nhapkho")[0] != third
+
+
+def test_validators_depend_on_query(db):
+    tokens = ChangeTokens({"nhapkho": Nhapkho}, ttl=60)
+    etag, _ = tokens.validators(db, "/nhapkho", ["nhapkho"], '{"page":1}')
+    assert tokens.validators(db, "/nhapkho", ["nhapkho"], '{"page":1}')[0] == etag
+    assert tokens.validators(db, "/nhapkho", ["nhapkho"], '{"page":2}')[0] != etag
+
+
+def test_not_modified():
+    assert not_modified({"if-none-match": 'W/"abc", "def"'}, '"abc"', None)
+    assert not not_modified({"if-none-match": '"xyz"'}, '"abc"', None)
+    assert not not_modified({}, '"abc"', None)
+
+
+def test_token_covers_every_column(db, make_ticket):
+    tokens = ChangeTokens({"nhapkho": Nhapkho}, ttl=0)
+    db.add(make_ticket(Nhapkho, 1))
+    db.commit()
+    before, _ = tokens.token(db, "nhapkho")
+
+    db.get(Nhapkho, 1).khachhang = "CONG TY XYZ"
+    db.commit()
+    after_customer, _ = tokens.token(db, "nhapkho")
+    assert after_customer != before
+
+    db.get(Nhapkho, 1).ghichu = "sua ghi chu"
+    db.commit()
+    assert tokens.token(db, "nhapkho")[0] != after_customer
+
+
+def test_etag_changes_when_customer_is_edited(db, make_ticket):
+    tokens = ChangeTokens({"nhapkho": Nhapkho}, ttl=0)
+    db.add(make_ticket(Nhapkho, 1))
+    db.commit()
+    etag, _ = tokens.validators(db, "/nhapkho", ["nhapkho"], "{}")
+
+    db.get(Nhapkho, 1).khachhang = "CONG TY XYZ"
+    db.commit()
+    assert tokens.validators(db, "/nhapkho", ["nhapkho"], "{}")[0] != etag
+
+
+def test_token_since_only_covers_rows_from_that_date(db, make_ticket):
+    tokens = ChangeTokens({"nhapkho": Nhapkho}, ttl=0)
+    since = date.today() - timedelta(days=30)
+    db.add_all([make_ticket(Nhapkho, 1, ngaycan=since - timedelta(days=10)), make_ticket(Nhapkho, 2)])
+    db.commit()
+    before, _ = tokens.token(db, "nhapkho", since)
+
+    # Phiếu ngoài khoảng ngày không có trong kết quả: token của khoảng không đổi
+    db.get(Nhapkho, 1).khachhang = "CONG TY XYZ"
+    db.commit()
+    assert tokens.token(db, "nhapkho", since)[0] == before
+    assert tokens.token(db, "nhapkho")[0] != tokens.token(db, "nhapkho", since)[0]
+
+    db.get(Nhapkho, 2).khachhang = "CONG TY XYZ"
+    db.commit()
+    edited, _ = tokens.token(db, "nhapkho", since)
+    assert edited != before
+
+    # Sửa ngày cân đưa phiếu cũ vào khoảng ngày
+    db.get(Nhapkho, 1).ngaycan = date.today()
+    db.commit()
+    assert tokens.token(db, "nhapkho", since)[0] != edited
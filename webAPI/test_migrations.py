@@ -0,0 +1,23 @@
+from sqlalchemy import update
+
+from database import Nhapkho
+from migrations import XOAPHIEU_MIGRATION_ID, is_applied, run_migrations
+
+
+def test_manual_migration_is_skipped_on_startup(engine, db, make_ticket):
+    db.add(make_ticket(Nhapkho, 1))
+    # Phiếu cũ do VB App thêm, xoaphieu NULL (ORM dùng default 0 khi gán None)
+    db.execute(update(Nhapkho).values(xoaphieu=None))
+    db.commit()
+
+    report = run_migrations(engine)
+    assert XOAPHIEU_MIGRATION_ID in report["pending"]
+    assert XOAPHIEU_MIGRATION_ID not in report["applied"]
+    with engine.connect() as conn:
+        assert not is_applied(conn, XOAPHIEU_MIGRATION_ID)
+    assert db.get(Nhapkho, 1).xoaphieu is None
+
+    report = run_migrations(engine, include_manual=True)
+    assert XOAPHIEU_MIGRATION_ID in report["applied"] and not report["problems"]
+    db.expire_all()
+    assert db.get(Nhapkho, 1).xoaphieu == 0
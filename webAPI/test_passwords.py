@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from passwords import PasswordHasher, PasswordHasherBusy, create_password_hasher, is_hashed
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(workers=1, max_queue=1, n=2 ** 4)
+    yield hasher
+    hasher.shutdown()
+
+
+def test_hash_and_verify(hasher):
+    async def scenario():
+        stored = await hasher.hash("mat-khau")
+        assert is_hashed(stored)
+        assert await hasher.verify("mat-khau", stored) == (True, False)
+        assert await hasher.verify("sai", stored) == (False, False)
+
+    asyncio.run(scenario())
+
+
+def test_legacy_plaintext_needs_upgrade(hasher):
+    assert asyncio.run(hasher.verify("123456", "123456")) == (True, True)
+    assert asyncio.run(hasher.verify("sai", "123456")) == (False, False)
+    assert asyncio.run(hasher.verify("123456", None)) == (False, False)
+
+
+def test_rejects_when_queue_is_full(hasher):
+    async def scenario():
+        tasks = [asyncio.create_task(hasher.hash("x")) for _ in range(3)]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        return [isinstance(result, PasswordHasherBusy) for result in results]
+
+    assert asyncio.run(scenario()) == [False, False, True]
+
+
+def test_defaults_to_thread_pool(monkeypatch):
+    monkeypatch.delenv("PASSWORD_HASH_POOL", raising=False)
+    assert not create_password_hasher().use_processes
+    monkeypatch.setenv("PASSWORD_HASH_POOL", "process")
+    assert create_password_hasher().use_processes
@@ -0,0 +1,150 @@
+import threading
+from io import BytesIO
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import PictureCatalog
+from picture_storage import CAS_PREFIX, CAS_TRASH_PREFIX, LocalPictureStorage, PictureExists, PictureStore
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return LocalPictureStorage(str(tmp_path))
+
+
+def _put(store, db, filename, content=b"jpeg-bytes", picture_date="2025-08-17"):
+    return store.put(db, "NK", picture_date, filename, BytesIO(content))
+
+
+def test_put_get_find_remove(db, storage):
+    store = PictureStore(storage)
+    row = _put(store, db, "PH1-CMR1_1.jpg")
+    assert row.storage_key == "NK/2025-08-17/PH1-CMR1_1.jpg"
+    assert row.ticket_number == "PH1" and row.camera_number == 1 and row.file_size == 10
+    assert b"".join(storage.iter_chunks(row.storage_key)) == b"jpeg-bytes"
+
+    with pytest.raises(PictureExists):
+        _put(store, db, "PH1-CMR1_1.jpg")
+    with pytest.raises(ValueError):
+        _put(store, db, "khong-hop-le.jpg")
+
+    assert [found.filename for found in store.find(db, ticket_number="PH1")] == ["PH1-CMR1_1.jpg"]
+    assert store.remove(db, row.storage_key)
+    assert store.get(db, row.storage_key) is None
+    assert storage.stat(row.storage_key) is None
+
+
+def test_get_adds_pictures_written_directly_to_storage(db, storage):
+    store = PictureStore(storage)
+    storage.save("NK/2025-08-17/PH2-CMR2_1.jpg", BytesIO(b"abc"), "image/jpeg")
+    row = store.get(db, "NK/2025-08-17/PH2-CMR2_1.jpg")
+    assert row is not None and row.file_size == 3
+
+
+def test_dedup_shares_blob_until_last_reference(db, storage):
+    store = PictureStore(storage, dedup=True)
+    first = _put(store, db, "PH1-CMR1_1.jpg")
+    second = _put(store, db, "PH1-CMR1_2.jpg")
+    assert first.blob_key == second.blob_key and first.blob_key.startswith(CAS_PREFIX)
+    assert [key for key, _, _ in storage.list(CAS_PREFIX)] == [first.blob_key]
+
+    store.remove(db, first.storage_key)
+    assert store.sweep_blobs(db, grace_seconds=0)["deleted"] == 0
+    assert storage.stat(second.blob_key) is not None
+    store.remove(db, second.storage_key)
+    # Blob chỉ bị xóa bởi sweep, sau thời gian chờ
+    assert storage.stat(second.blob_key) is not None
+    assert store.sweep_blobs(db)["deleted"] == 0
+    assert store.sweep_blobs(db, grace_seconds=0) == {
+        "scanned": 1, "deleted": 1, "restored": 0, "temp_deleted": 0, "reclaimed_bytes": 10
+    }
+    assert list(storage.list(CAS_PREFIX)) == []
+
+
+def test_remove_rejects_blobs_and_non_picture_keys(db, storage):
+    store = PictureStore(storage, dedup=True)
+    first = _put(store, db, "PH1-CMR1_1.jpg")
+    _put(store, db, "PH1-CMR1_2.jpg")
+    with pytest.raises(ValueError):
+        store.remove(db, first.blob_key)
+    storage.save("NK/2025-08-17/ghichu.txt", BytesIO(b"abc"), "text/plain")
+    assert not store.remove(db, "NK/2025-08-17/ghichu.txt")
+
+    assert storage.stat(first.blob_key) is not None
+    assert storage.stat("NK/2025-08-17/ghichu.txt") is not None
+
+
+def test_sync_folder_adds_station_written_pictures(db, storage):
+    store = PictureStore(storage, folder_sync_interval=60)
+    storage.save("NK/2025-08-17/PH3-CMR1_1.jpg", BytesIO(b"abc"), "image/jpeg")
+    assert store.sync_folder(db, "NK", "2025-08-17") == 1
+    assert [row.filename for row in store.find(db, ticket_number="PH3")] == ["PH3-CMR1_1.jpg"]
+
+    # Trong folder_sync_interval không liệt kê lại thư mục
+    storage.save("NK/2025-08-17/PH3-CMR2_1.jpg", BytesIO(b"abc"), "image/jpeg")
+    assert store.sync_folder(db, "NK", "2025-08-17") == 0
+    store.folder_sync_interval = 0
+    assert store.sync_folder(db, "NK", "2025-08-17") == 1
+
+
+def test_put_after_sync_indexed_the_file_returns_row(db, storage, monkeypatch):
+    store = PictureStore(storage, folder_sync_interval=0)
+    save = storage.save
+
+    def save_then_sync(key, stream, content_type):
+        size = save(key, stream, content_type)
+        # Đồng bộ thư mục chạy giữa lúc ghi file và commit dòng catalog của upload
+        store.sync_folder(db, "NK", "2025-08-17")
+        return size
+
+    monkeypatch.setattr(storage, "save", save_then_sync)
+    row = _put(store, db, "PH4-CMR1_1.jpg")
+    assert row.storage_key == "NK/2025-08-17/PH4-CMR1_1.jpg" and row.content_hash is not None
+
+
+def test_reindex_without_remove_stale_keeps_rows(db, storage):
+    store = PictureStore(storage)
+    row = _put(store, db, "PH5-CMR1_1.jpg")
+    storage.delete(row.storage_key)
+    storage.save("XK/2025-08-18/PH6-CMR1_1.jpg", BytesIO(b"abc"), "image/jpeg")
+
+    assert store.reindex(db, remove_stale=False)["added"] == 1
+    assert store.find(db, ticket_number="PH5")
+    assert store.reindex(db)["removed"] == 1
+    assert not store.find(db, ticket_number="PH5")
+
+
+@pytest.mark.parametrize("put_after", ["move", "recheck"])
+def test_sweep_keeps_blob_of_concurrent_put(tmp_path, storage, put_after):
+    engine = create_engine(f"sqlite:///{tmp_path / 'catalog.db'}", connect_args={"check_same_thread": False})
+    PictureCatalog.__table__.create(engine)
+    Session = sessionmaker(bind=engine)
+    store = PictureStore(storage, dedup=True)
+    db = Session()
+    first = _put(store, db, "PH1-CMR1_1.jpg")
+    blob_key = first.blob_key
+    store.remove(db, first.storage_key)
+
+    delete = storage.delete
+
+    def delete_with_concurrent_put(key):
+        result = delete(key)
+        # Upload cùng nội dung (tiến trình khác) commit và đặt blob ngay sau khi sweep chuyển blob đi
+        # ("move") hoặc sau khi sweep đã kiểm tra lại tham chiếu ("recheck")
+        moved = key == blob_key if put_after == "move" else key.startswith(CAS_TRASH_PREFIX)
+        if moved and putter.ident is None:
+            putter.start()
+            putter.join()
+        return result
+
+    putter = threading.Thread(target=lambda: _put(store, Session(), "PH2-CMR1_1.jpg"))
+    storage.delete = delete_with_concurrent_put
+    result = store.sweep_blobs(db, grace_seconds=0)
+    assert putter.ident is not None
+
+    assert db.get(PictureCatalog, "NK/2025-08-17/PH2-CMR1_1.jpg").blob_key == blob_key
+    assert b"".join(storage.iter_chunks(blob_key)) == b"jpeg-bytes"
+    assert result["restored"] == (1 if put_after == "move" else 0)
+    assert [key for key, _, _ in storage.list(CAS_PREFIX)] == [blob_key]
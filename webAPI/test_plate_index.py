@@ -0,0 +1,100 @@
+from datetime import date, timedelta
+
+from change_token import ChangeTokens
+from database import Nhapkho, Xuatkho
+from plate_index import PlateIndex
+
+MODELS = {"nhapkho": Nhapkho, "xuatkho": Xuatkho}
+
+
+def _index(**options):
+    # Cập nhật ngay mỗi lần tra cứu (refresh/verify không chờ)
+    return PlateIndex(MODELS, ChangeTokens(MODELS, ttl=0), refresh_interval=0, verify_interval=0, bucket_size=10, **options)
+
+
+def test_find_tickets_exact_and_prefix(db, make_ticket):
+    db.add_all([
+        make_ticket(Nhapkho, 1, bienso1_1="51D-123.45"),
+        make_ticket(Nhapkho, 2, bienso1_1="51C99999", bienso2_1="51D12345"),
+        make_ticket(Nhapkho, 3, bienso1_1="60A11111"),
+        make_ticket(Xuatkho, 1, bienso1_1="51D12345")
+    ])
+    db.commit()
+    index = _index()
+
+    assert index.find_tickets(db, "nhapkho", "51d 123.45", exact=True) == [1, 2]
+    assert index.find_tickets(db, "nhapkho", "51", exact=False) == [1, 2]
+    assert index.find_tickets(db, "nhapkho", "51", exact=False, max_results=1) is None
+    assert index.find_tickets(db, "xuatkho", "51D12345", exact=True) == [1]
+    assert index.find_tickets(db, "nhapkho", "", exact=True) == []
+
+
+def test_profile_uses_latest_ticket_and_tare(db, make_ticket):
+    today = date.today()
+    db.add_all([
+        make_ticket(Nhapkho, 1, ngaycan=today - timedelta(days=3), khachhang="CU", khoiluonglan2=4800),
+        make_ticket(Nhapkho, 2, ngaycan=today, khachhang="MOI", lancan=1, khoiluonglan2=None)
+    ])
+    db.commit()
+    index = _index()
+
+    profile = index.profile(db, "51D-12345")
+    assert profile["found"] and profile["khachhang"] == "MOI" and profile["sophieu"] == 2
+    assert profile["khoiluongbi"] == 4800
+    assert index.profile(db, "") is None
+
+
+def test_refresh_applies_new_edited_and_deleted_recent_tickets(db, make_ticket):
+    db.add_all([make_ticket(Nhapkho, 1), make_ticket(Nhapkho, 2, khachhang="MOI")])
+    db.commit()
+    index = _index()
+    assert index.find_tickets(db, "nhapkho", "51D12345", exact=True) == [1, 2]
+
+    db.add(make_ticket(Nhapkho, 3, bienso1_1="60A11111"))
+    db.get(Nhapkho, 1).bienso1_1 = "43C55555"
+    db.delete(db.get(Nhapkho, 2))
+    db.commit()
+
+    assert index.find_tickets(db, "nhapkho", "51D12345", exact=True) == []
+    assert index.find_tickets(db, "nhapkho", "43C55555", exact=True) == [1]
+    assert index.find_tickets(db, "nhapkho", "60A11111", exact=True) == [3]
+    assert not index.profile(db, "51D12345")["found"]
+    assert index.profile(db, "43C55555")["khachhang"] == "CONG TY ABC"
+
+
+def test_refresh_applies_edits_and_deletes_of_old_tickets(db, make_ticket):
+    old = date.today() - timedelta(days=30)
+    db.add_all([
+        make_ticket(Nhapkho, 1, ngaycan=old - timedelta(days=1), khachhang="CU NHAT"),
+        make_ticket(Nhapkho, 2, ngaycan=old, khachhang="CU"),
+        make_ticket(Nhapkho, 15, ngaycan=old, bienso1_1="60A11111")
+    ])
+    db.commit()
+    index = _index()
+    assert index.profile(db, "51D12345")["sophieu"] == 2
+
+    # Phiếu nguồn của hồ sơ bị xóa: hồ sơ lấy lại từ phiếu còn lại
+    db.delete(db.get(Nhapkho, 2))
+    # Phiếu cũ bị sửa biển số
+    db.get(Nhapkho, 15).bienso1_1 = "43C55555"
+    db.commit()
+
+    profile = index.profile(db, "51D12345")
+    assert profile["sophieu"] == 1 and profile["khachhang"] == "CU NHAT"
+    assert index.find_tickets(db, "nhapkho", "51D12345", exact=True) == [1]
+    assert index.find_tickets(db, "nhapkho", "60A11111", exact=True) == []
+    assert index.find_tickets(db, "nhapkho", "43C55555", exact=True) == [15]
+
+
+def test_background_rebuild_replaces_snapshot(db, make_ticket):
+    db.add(make_ticket(Nhapkho, 1))
+    db.commit()
+    index = _index()
+    index.rebuild(db)
+    snapshot = index._snapshot
+
+    db.add(make_ticket(Nhapkho, 2))
+    db.commit()
+    index._rebuild_in_background(db.get_bind())
+    assert index._snapshot is not snapshot
+    assert index.find_tickets(db, "nhapkho", "51D12345", exact=True) == [1, 2]
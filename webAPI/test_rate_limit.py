@@ -0,0 +1,52 @@
+from rate_limit import RateLimiter, RouteClass, classify_route, client_key, create_rate_limiter
+
+
+def test_classify_route_groups():
+    assert classify_route("/webapp/main.dart.js", {}) is None
+    assert classify_route("/realtime/stream", {}) == "stream"
+    assert classify_route("/realtime/update", {}) == "realtime"
+    assert classify_route("/auth/login", {}) == "auth"
+    assert classify_route("/nhapkho", {}) == "tickets"
+    assert classify_route("/sync/tickets", {}) == "tickets"
+    assert classify_route("/logistics/all", {"tu_ngay": ["2025-01-01"]}) == "tickets"
+    assert classify_route("/logistics/all", {}) == "logistics_unbounded"
+    assert classify_route("/picture/list", {"date": ["2025-08-17"]}) == "picture"
+    assert classify_route("/picture/list", {"ticket_number": ["PH1"]}) == "picture"
+    assert classify_route("/picture/list", {"picture_type": ["NK"]}) == "picture_scan"
+    assert classify_route("/picture/view/NK/2025-08-17/PH1-CMR1_1.jpg", {}) == "picture"
+    assert classify_route("/khachhang", {}) == "default"
+
+
+def test_token_bucket_allows_burst_then_waits():
+    route_class = RouteClass("test", rate=1, burst=3, max_concurrency=10)
+    limiter = RateLimiter({"test": route_class})
+
+    assert [limiter.take("client-a", route_class) for _ in range(3)] == [0.0, 0.0, 0.0]
+    wait = limiter.take("client-a", route_class)
+    assert 0 < wait <= 1
+    # Client khác có bucket riêng
+    assert limiter.take("client-b", route_class) == 0.0
+
+
+def test_client_key_prefers_token_user_then_forwarded_for():
+    scope = {"headers": [(b"x-forwarded-for", b"10.0.0.7, 10.0.0.1")], "client": ("127.0.0.1", 5000)}
+    assert client_key(scope) == "127.0.0.1"
+    assert client_key(scope, trust_proxy=True) == "10.0.0.7"
+    assert client_key({**scope, "state": {"user": {"sub": "admin"}}}, trust_proxy=True) == "user:admin"
+
+
+def test_shift_change_logins_behind_one_ip_are_allowed():
+    limiter = create_rate_limiter()
+    auth = limiter.route_classes["auth"]
+    # 40 trạm đăng nhập cùng lúc sau NAT: không bị chặn theo IP
+    assert all(limiter.take("10.0.0.1", auth) == 0.0 for _ in range(40))
+    assert all(limiter.take_login(f"tram{i}") == 0.0 for i in range(40))
+
+
+def test_login_budget_is_per_account():
+    limiter = create_rate_limiter()
+    burst = int(limiter.route_classes["login"].burst)
+    assert [limiter.take_login("admin") for _ in range(burst)] == [0.0] * burst
+    assert limiter.take_login("admin") > 0
+    assert limiter.take_login("user2") == 0.0
+    assert limiter.route_classes["login"].limited == 1
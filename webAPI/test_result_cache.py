@@ -0,0 +1,76 @@
+import asyncio
+import threading
+
+from result_cache import ResultCache
+
+
+def test_hit_after_compute_and_miss_on_new_version():
+    cache = ResultCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return b"[1]"
+
+    async def scenario():
+        assert await cache.get_or_compute("k", "v1", compute) == b"[1]"
+        assert await cache.get_or_compute("k", "v1", compute) == b"[1]"
+        assert await cache.get_or_compute("k", "v2", compute) == b"[1]"
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+    assert cache.hits == 1 and cache.misses == 2
+
+
+def test_concurrent_misses_compute_once():
+    cache = ResultCache()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return b"body"
+
+    async def scenario():
+        tasks = [asyncio.create_task(cache.get_or_compute("k", "v", compute)) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.run(scenario()) == [b"body"] * 5
+    assert len(calls) == 1
+    assert cache.coalesced == 4
+
+
+def test_evicts_least_recently_used_over_budget():
+    cache = ResultCache(max_bytes=10, max_entry_bytes=10)
+    cache.put("a", "v", b"12345")
+    cache.put("b", "v", b"12345")
+    assert cache.get("a", "v") == b"12345"
+    cache.put("c", "v", b"12345")
+    assert cache.get("b", "v") is None
+    assert cache.get("a", "v") == b"12345"
+
+
+def test_cancelled_owner_does_not_cancel_waiters():
+    cache = ResultCache(max_bytes=1024)
+    release = threading.Event()
+
+    def compute():
+        release.wait(2)
+        return b"body"
+
+    async def scenario():
+        owner = asyncio.create_task(cache.get_or_compute("k", "v1", compute))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(cache.get_or_compute("k", "v1", compute))
+        await asyncio.sleep(0.01)
+        # Client của request khởi tạo ngắt kết nối
+        owner.cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+        return owner.cancelled(), await waiter
+
+    assert asyncio.run(scenario()) == (True, b"body")
+    assert cache.get("k", "v1") == b"body"
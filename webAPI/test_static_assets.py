@@ -0,0 +1,42 @@
+import os
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from static_assets import WebAppStaticFiles
+
+
+def _client(tmp_path):
+    webapp = tmp_path / "webapp"
+    webapp.mkdir()
+    (webapp / "main.dart.js").write_text("console.log('v1');" * 100)
+    static_files = WebAppStaticFiles(str(webapp), cache_dir=str(tmp_path / "cache"))
+    app = FastAPI()
+    app.mount("/webapp", static_files)
+    return TestClient(app), webapp, static_files
+
+
+def test_etag_and_variant_follow_redeploy_without_restart(tmp_path):
+    client, webapp, static_files = _client(tmp_path)
+    assert static_files._hashes == {}
+
+    first = client.get("/webapp/main.dart.js", headers={"accept-encoding": "identity"})
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "no-cache"
+    assert client.get("/webapp/main.dart.js", headers={"if-none-match": etag, "accept-encoding": "identity"}).status_code == 304
+
+    assert static_files.precompress() >= 1
+    assert client.get("/webapp/main.dart.js", headers={"accept-encoding": "gzip"}).headers["content-encoding"] == "gzip"
+
+    # Deploy bản mới (khác kích thước và thời điểm sửa) khi API đang chạy
+    path = webapp / "main.dart.js"
+    path.write_text("console.log('v2 moi');" * 100)
+    os.utime(path, (path.stat().st_atime, path.stat().st_mtime + 10))
+
+    changed = client.get("/webapp/main.dart.js", headers={"if-none-match": etag, "accept-encoding": "identity"})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    assert "v2 moi" in changed.text
+    # Bản nén cũ (theo md5 cũ) không được dùng cho nội dung mới
+    static_files._compress_file("main.dart.js", changed.headers["etag"].strip('"'))
+    compressed = client.get("/webapp/main.dart.js", headers={"accept-encoding": "gzip"})
+    assert "v2 moi" in compressed.text
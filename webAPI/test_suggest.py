@@ -0,0 +1,38 @@
+from suggest import SuggestIndex
+from text_utils import fold_vietnamese, normalize_plate
+
+
+def _index(values, normalize=fold_vietnamese, word_prefixes=True):
+    index = SuggestIndex("ID", "ten", normalize, word_prefixes)
+    index.apply_changes([], [{"ID": pk, "ten": value} for pk, value in enumerate(values, 1)])
+    return index
+
+
+def test_ranks_exact_then_prefix_then_word_then_shorter():
+    index = _index(["Công ty Đồng Nai", "Đồng Tâm", "Dong", "Công ty Dòng Chảy Dài", "Bình Dương"])
+    assert index.search("dong") == [(3, "Dong"), (2, "Đồng Tâm"), (1, "Công ty Đồng Nai"), (4, "Công ty Dòng Chảy Dài")]
+    assert index.search("dong", limit=2) == [(3, "Dong"), (2, "Đồng Tâm")]
+    assert index.search("cong ty") == [(1, "Công ty Đồng Nai"), (4, "Công ty Dòng Chảy Dài")]
+    assert index.search("xyz") == []
+    assert index.search("   ") == []
+
+
+def test_each_value_listed_once_with_best_rank():
+    index = _index(["Nam Nam", "Bac Nam"])
+    assert index.search("nam") == [(1, "Nam Nam"), (2, "Bac Nam")]
+
+
+def test_apply_changes_adds_renames_and_removes():
+    old = [{"ID": 1, "ten": "Công ty A"}, {"ID": 2, "ten": "Công ty B"}]
+    index = SuggestIndex("ID", "ten", fold_vietnamese)
+    index.apply_changes([], old)
+    index.apply_changes(old, [{"ID": 1, "ten": "Nhà máy A"}, {"ID": 3, "ten": "Công ty C"}])
+    assert index.search("cong") == [(3, "Công ty C")]
+    assert index.search("nha") == [(1, "Nhà máy A")]
+    assert len(index) == 6
+
+
+def test_plate_index_without_word_prefixes():
+    index = _index(["51D-123.45", "51C-999.99", "60A-111.11"], normalize_plate, word_prefixes=False)
+    assert index.search("51d 12") == [(1, "51D-123.45")]
+    assert [pk for pk, _ in index.search("51")] == [2, 1]
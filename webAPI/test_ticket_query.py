@@ -0,0 +1,104 @@
+from datetime import date, timedelta
+
+from sqlalchemy import update
+
+from archive import ArchiveManager
+from change_token import ChangeTokens
+from database import Nhapkho
+from migrations import run_migrations
+from plate_index import PlateIndex
+from schemas import TicketQueryParams
+from ticket_query import TicketQueryEngine
+
+MODELS = {"nhapkho": Nhapkho}
+
+
+def test_null_xoaphieu_counts_as_active_until_migration(engine, db, make_ticket):
+    db.add_all([
+        make_ticket(Nhapkho, 1),
+        make_ticket(Nhapkho, 2),
+        make_ticket(Nhapkho, 3, xoaphieu=1)
+    ])
+    db.execute(update(Nhapkho).where(Nhapkho.sophieu == 1).values(xoaphieu=None))
+    db.commit()
+    run_migrations(engine)
+    query_engine = TicketQueryEngine(MODELS, PlateIndex(MODELS, ChangeTokens(MODELS, ttl=0)))
+
+    assert [row.sophieu for row in query_engine.execute(db, "nhapkho", TicketQueryParams())] == [2, 1]
+
+    run_migrations(engine, include_manual=True)
+    query_engine._xoaphieu_checked = (False, 0.0)
+    assert [row.sophieu for row in query_engine.execute(db, "nhapkho", TicketQueryParams())] == [2, 1]
+    assert query_engine.xoaphieu_not_null(db)
+
+
+def test_plate_filter_includes_tickets_newer_than_the_index(engine, db, make_ticket):
+    db.add(make_ticket(Nhapkho, 1))
+    db.commit()
+    run_migrations(engine, include_manual=True)
+    # Chỉ mục chỉ cập nhật sau 1 giờ: phiếu mới chưa có trong chỉ mục
+    plate_index = PlateIndex(MODELS, ChangeTokens(MODELS, ttl=0), refresh_interval=3600)
+    query_engine = TicketQueryEngine(MODELS, plate_index)
+    params = TicketQueryParams(bienso="51D-123")
+    assert [row.sophieu for row in query_engine.execute(db, "nhapkho", params)] == [1]
+
+    db.add_all([make_ticket(Nhapkho, 2), make_ticket(Nhapkho, 3, bienso1_1="60A11111")])
+    db.commit()
+    assert plate_index.find_tickets(db, "nhapkho", "51D-123") == [1]
+    assert [row.sophieu for row in query_engine.execute(db, "nhapkho", params)] == [2, 1]
+    exact = TicketQueryParams(bienso="51D12345", bienso_exact=True)
+    assert [row.sophieu for row in query_engine.execute(db, "nhapkho", exact)] == [2, 1]
+
+
+def _archive_setup(engine, db, make_ticket):
+    today = date.today()
+    db.add_all([
+        make_ticket(Nhapkho, 1, ngaycan=today - timedelta(days=200)),
+        make_ticket(Nhapkho, 2, ngaycan=today - timedelta(days=150)),
+        make_ticket(Nhapkho, 3, ngaycan=today)
+    ])
+    db.commit()
+    run_migrations(engine, include_manual=True)
+    archive = ArchiveManager(engine, keep_days=90, state_refresh=0)
+    return archive, TicketQueryEngine(MODELS, PlateIndex(MODELS, ChangeTokens(MODELS, ttl=0)), archive=archive)
+
+
+def test_archive_run_in_progress_does_not_hide_hot_rows(engine, db, make_ticket):
+    archive, query_engine = _archive_setup(engine, db, make_ticket)
+    # Mốc đã đặt nhưng chưa chuyển phiếu nào (đang lưu trữ)
+    with engine.begin() as conn:
+        archive._set_watermark(conn, "nhapkho", date.today() - timedelta(days=90))
+
+    params = TicketQueryParams(den_ngay=date.today() - timedelta(days=100))
+    assert [row.sophieu for row in query_engine.execute(db, "nhapkho", params)] == [2, 1]
+
+
+def test_rows_moved_between_hot_and_archive_reads_are_not_duplicated(engine, db, make_ticket, monkeypatch):
+    archive, query_engine = _archive_setup(engine, db, make_ticket)
+    with engine.begin() as conn:
+        archive._set_watermark(conn, "nhapkho", date.today() - timedelta(days=90))
+    fetch = query_engine._fetch
+
+    def fetch_then_archive(db, table, params, tier):
+        rows = fetch(db, table, params, tier)
+        if tier == "hot":
+            archive.archive_table(table, date.today() - timedelta(days=90))
+        return rows
+
+    monkeypatch.setattr(query_engine, "_fetch", fetch_then_archive)
+    params = TicketQueryParams(limit=10)
+    assert [row.sophieu for row in query_engine.execute(db, "nhapkho", params)] == [3, 2, 1]
+
+
+def test_archive_waits_for_other_processes_to_reload_watermark(engine, db, make_ticket, monkeypatch):
+    archive, _ = _archive_setup(engine, db, make_ticket)
+    archive.state_refresh = 30
+    waits = []
+
+    def record_sleep(seconds):
+        # Phiếu còn ở bảng chính trong lúc chờ các tiến trình khác đọc mốc mới
+        waits.append((seconds, db.query(Nhapkho).count()))
+
+    monkeypatch.setattr("archive.time.sleep", record_sleep)
+    assert archive.archive_table("nhapkho", date.today() - timedelta(days=90)) == 2
+    assert len(waits) == 1 and 30 < waits[0][0] <= 31 and waits[0][1] == 3
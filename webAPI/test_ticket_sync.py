@@ -0,0 +1,68 @@
+from datetime import date, timedelta
+
+from change_token import ChangeTokens
+from database import ARCHIVE_MODELS, Nhapkho
+from ticket_sync import TicketSync
+
+
+def _sync():
+    tokens = ChangeTokens({"nhapkho": Nhapkho}, ttl=0)
+    sync = TicketSync({"nhapkho": Nhapkho}, {"nhapkho": ARCHIVE_MODELS["nhapkho"]}, tokens, backend="local")
+    sync.local_log.refresh_interval = 0
+    sync.local_log.verify_interval = 0
+    return sync
+
+
+def test_local_backend_reports_inserts_and_edits(db, make_ticket):
+    db.add(make_ticket(Nhapkho, 1))
+    db.commit()
+    sync = _sync()
+
+    first = sync.pull(db, None)
+    assert first["full_resync"]
+
+    db.add(make_ticket(Nhapkho, 2))
+    db.get(Nhapkho, 1).lanin = 1
+    db.commit()
+    second = sync.pull(db, first["token"])
+    assert [row.sophieu for row in second["nhapkho"]] == [1, 2]
+    assert not second["has_more"] and second["deleted"] == {}
+
+    db.delete(db.get(Nhapkho, 2))
+    db.commit()
+    third = sync.pull(db, second["token"])
+    assert third["deleted"] == {"nhapkho": [2]}
+
+    assert sync.pull(db, third["token"]) == {"token": third["token"], "has_more": False, "deleted": {}}
+
+
+def test_local_backend_reports_edits_to_any_column(db, make_ticket):
+    db.add(make_ticket(Nhapkho, 1))
+    db.commit()
+    sync = _sync()
+    token = sync.pull(db, None)["token"]
+
+    db.get(Nhapkho, 1).ghichu = "sua ghi chu"
+    db.commit()
+    result = sync.pull(db, token)
+    assert [row.ghichu for row in result["nhapkho"]] == ["sua ghi chu"]
+
+
+def test_local_backend_requires_resync_after_old_ticket_edit(db, make_ticket):
+    db.add_all([
+        make_ticket(Nhapkho, 1, ngaycan=date.today() - timedelta(days=30)),
+        make_ticket(Nhapkho, 2)
+    ])
+    db.commit()
+    sync = _sync()
+    token = sync.pull(db, None)["token"]
+    token = sync.pull(db, token)["token"]
+
+    # Phiếu ngoài khoảng theo dõi (7 ngày) bị sửa: không ghi được vào nhật ký
+    db.get(Nhapkho, 1).khachhang = "CONG TY XYZ"
+    db.commit()
+    result = sync.pull(db, token)
+    assert result["full_resync"]
+
+    # Token mới sau khi tải lại toàn bộ dùng tiếp được
+    assert not sync.pull(db, result["token"]).get("full_resync")
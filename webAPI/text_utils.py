@@ -0,0 +1,27 @@
+import unicodedata
+
+
+def fold_vietnamese(value) -> str:
+    """
+    Chuẩn hóa chuỗi tiếng Việt để so sánh không phân biệt hoa thường và dấu
+    (tương đương COLLATE Vietnamese_CI_AI, đồng thời coi "đ" như "d")
+
+    Examples:
+    - "CÔNG TY Đồng Nai" -> "cong ty dong nai"
+    """
+    if value is None:
+        return ""
+    decomposed = unicodedata.normalize("NFD", str(value))
+    stripped = "".join(ch for ch in decomposed if unicodedata.category(ch) != "Mn")
+    return stripped.replace("đ", "d").replace("Đ", "D").casefold()
+
+
+def normalize_plate(value) -> str:
+    """
+    Chuẩn hóa biển số xe: chữ in hoa, bỏ dấu, bỏ khoảng trắng và ký tự phân cách
+
+    Examples:
+    - "51D-123.45" -> "51D12345"
+    - "51d 12345"  -> "51D12345"
+    """
+    return "".join(ch for ch in fold_vietnamese(value) if ch.isalnum()).upper()
@@ -0,0 +1,235 @@
+import threading
+import time
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import String, and_, bindparam, cast, literal_column, or_, select
+from sqlalchemy.orm import Session
+
+from archive import ArchiveManager
+from database import ARCHIVE_MODELS
+from migrations import XOAPHIEU_MIGRATION_ID, is_applied
+from plate_index import PlateIndex, plate_sql_filter, plate_sql_match, plate_sql_pattern
+from schemas import TicketQueryParams
+
+# Collation tìm kiếm tiếng Việt không phân biệt hoa thường và dấu (SQL Server)
+VIETNAMESE_COLLATION = "Vietnamese_CI_AI"
+
+# Trước khi chạy migration xoaphieu NULL -> 0 (chạy thủ công), kiểm tra lại mỗi chừng này giây
+XOAPHIEU_RECHECK_SECONDS = 60
+
+
+def vietnamese_like(column, param_name: str, dialect_name: str):
+    """
+    Điều kiện LIKE hỗ trợ tiếng Việt không phân biệt hoa thường và dấu,
+    giá trị được truyền qua bind parameter
+    """
+    if dialect_name == "mssql":
+        column = column.collate(VIETNAMESE_COLLATION)
+    return column.like(bindparam(param_name, type_=String))
+
+
+class TicketQueryEngine:
+    """
+    Bộ truy vấn chung cho các bảng phiếu cân có cùng cấu trúc.
+
+    Mỗi tổ hợp (bảng, bộ lọc đang dùng, offset/limit, dialect) được dựng thành một câu lệnh
+    select với bind parameter và giữ lại để dùng lại; SQLAlchemy cache bản biên dịch của câu lệnh,
+    database tái sử dụng execution plan vì chỉ giá trị tham số thay đổi.
+
+    Phiếu của các kỳ đã đóng nằm ở bảng lưu trữ; bảng lưu trữ chỉ được đọc khi khoảng ngày
+    của truy vấn bắt đầu trước mốc lưu trữ, kết quả 2 bảng được gộp theo thứ tự ngày cân.
+    Phiếu chỉ chuyển từ bảng chính sang bảng lưu trữ, nên đọc bảng chính trước rồi bỏ trùng theo số phiếu
+    thì không sót, không trùng phiếu đang được chuyển giữa 2 câu lệnh.
+    """
+
+    def __init__(self, models: Dict[str, object], plate_index: PlateIndex, plate_max_in: int = 2000, archive: Optional[ArchiveManager] = None):
+        self.models = models
+        self.plate_index = plate_index
+        self.plate_max_in = plate_max_in
+        self.archive = archive
+        self._templates: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        # (đã chạy migration xoaphieu, thời điểm kiểm tra)
+        self._xoaphieu_checked: Tuple[bool, float] = (False, 0.0)
+        self.template_hits = 0
+        self.template_misses = 0
+        self.table_stats: Dict[str, Dict[str, float]] = {
+            table: {"queries": 0, "archive_queries": 0, "rows": 0, "seconds": 0.0} for table in models
+        }
+
+    def _model(self, table: str, tier: str):
+        return ARCHIVE_MODELS[table] if tier == "archive" else self.models[table]
+
+    def _build_template(self, table: str, shape: Tuple[str, ...], dialect_name: str, tier: str = "hot"):
+        """Dựng câu lệnh select với bind parameter cho một tổ hợp bộ lọc"""
+        model = self._model(table, tier)
+        stmt = select(model)
+        active = set(shape)
+
+        if "xoaphieu_null" in active:
+            # Database chưa chạy migration xoaphieu: phiếu cũ có xoaphieu NULL cũng là phiếu chưa xóa
+            stmt = stmt.where(or_(model.xoaphieu == literal_column("0"), model.xoaphieu.is_(None)))
+        elif "include_deleted" not in active:
+            # Chỉ phiếu chưa xóa; hằng số (không phải tham số) để khớp filtered index xoaphieu = 0
+            stmt = stmt.where(model.xoaphieu == literal_column("0"))
+        if "tu_ngay" in active:
+            stmt = stmt.where(model.ngaycan >= bindparam("tu_ngay"))
+        if "den_ngay" in active:
+            stmt = stmt.where(model.ngaycan <= bindparam("den_ngay"))
+        if "khachhang" in active:
+            stmt = stmt.where(vietnamese_like(model.khachhang, "khachhang", dialect_name))
+        if "sophieu" in active:
+            stmt = stmt.where(cast(model.sophieu, String).like(bindparam("sophieu", type_=String)))
+        if "bienso_ids" in active:
+            # Phiếu thêm sau lần cập nhật chỉ mục gần nhất (sophieu lớn hơn mốc đã đọc) lọc trực tiếp trên 4 cột biển số
+            stmt = stmt.where(or_(
+                model.sophieu.in_(bindparam("bienso_ids", expanding=True)),
+                and_(
+                    model.sophieu > bindparam("bienso_after"),
+                    plate_sql_match(model, bindparam("bienso", type_=String), "bienso_exact" in active)
+                )
+            ))
+        if "loaihang" in active:
+            stmt = stmt.where(vietnamese_like(model.loaihang, "loaihang", dialect_name))
+
+        # Sắp xếp theo ngày cân (mới nhất trước), số phiếu để phân trang ổn định
+        stmt = stmt.order_by(model.ngaycan.desc(), model.sophieu.desc())
+
+        if "offset" in active:
+            stmt = stmt.offset(bindparam("offset"))
+        if "limit" in active:
+            stmt = stmt.limit(bindparam("limit"))
+        return stmt
+
+    def _template(self, table: str, shape: Tuple[str, ...], dialect_name: str, tier: str = "hot"):
+        key = (table, shape, dialect_name, tier)
+        with self._lock:
+            stmt = self._templates.get(key)
+            if stmt is not None:
+                self.template_hits += 1
+                return stmt
+            self.template_misses += 1
+            stmt = self._templates[key] = self._build_template(table, shape, dialect_name, tier)
+            return stmt
+
+    def xoaphieu_not_null(self, db: Session) -> bool:
+        """Migration xoaphieu NULL -> 0 đã chạy chưa (kiểm tra lại định kỳ đến khi đã chạy)"""
+        applied, checked_at = self._xoaphieu_checked
+        if not applied and time.monotonic() - checked_at >= XOAPHIEU_RECHECK_SECONDS:
+            applied = is_applied(db.connection(), XOAPHIEU_MIGRATION_ID)
+            self._xoaphieu_checked = (applied, time.monotonic())
+        return applied
+
+    def build(self, db: Session, table: str, params: TicketQueryParams, tier: str = "hot"):
+        """
+        Tạo câu lệnh và giá trị tham số cho một truy vấn
+        Args:
+            tier: "hot" - bảng chính, "archive" - bảng lưu trữ
+        Returns:
+            (stmt, values)
+        """
+        model = self._model(table, tier)
+        values = {}
+
+        if params.tu_ngay:
+            values["tu_ngay"] = params.tu_ngay
+        if params.den_ngay:
+            values["den_ngay"] = params.den_ngay
+        if params.khachhang:
+            values["khachhang"] = f"%{params.khachhang}%"
+        if params.sophieu:
+            values["sophieu"] = f"%{params.sophieu}%"
+        if params.loaihang:
+            values["loaihang"] = f"%{params.loaihang}%"
+        if params.offset and params.offset > 0:
+            values["offset"] = params.offset
+        if params.limit and params.limit > 0:
+            values["limit"] = params.limit
+
+        extra = None
+        if params.bienso and tier == "archive":
+            # Chỉ mục biển số chỉ phủ bảng chính
+            extra = plate_sql_filter(model, params.bienso, params.bienso_exact)
+        elif params.bienso:
+            # Lọc biển số qua chỉ mục (khóa chính), quét bảng nếu quá nhiều kết quả.
+            # Đọc mốc trước khi tìm: phiếu mới hơn mốc có thể chưa vào chỉ mục, được lọc bằng SQL
+            self.plate_index.ensure_fresh(db)
+            high_water = self.plate_index.high_water(table)
+            sophieu_list = self.plate_index.find_tickets(
+                db, table, params.bienso, params.bienso_exact, self.plate_max_in
+            )
+            if sophieu_list is None:
+                extra = plate_sql_filter(model, params.bienso, params.bienso_exact)
+            else:
+                values["bienso_ids"] = sophieu_list
+                values["bienso_after"] = high_water
+                values["bienso"] = plate_sql_pattern(params.bienso, params.bienso_exact)
+
+        shape = tuple(sorted(values))
+        if "bienso_ids" in values and params.bienso_exact:
+            shape += ("bienso_exact",)
+        if params.include_deleted:
+            shape += ("include_deleted",)
+        elif not self.xoaphieu_not_null(db):
+            shape += ("xoaphieu_null",)
+        stmt = self._template(table, shape, db.bind.dialect.name, tier)
+        if extra is not None:
+            stmt = stmt.where(extra)
+        return stmt, values
+
+    def tiers(self, db: Session, table: str, params: TicketQueryParams) -> List[str]:
+        """
+        Các bảng cần đọc theo khoảng ngày của truy vấn so với mốc lưu trữ (bảng chính luôn đọc trước).
+        Khoảng ngày nằm hẳn trước mốc vẫn đọc bảng chính (seek index ngaycan, thường rỗng):
+        mốc được đặt trước khi chuyển nên trong lúc lưu trữ phiếu cũ còn ở bảng chính.
+        """
+        if self.archive is None or not self.archive.needs_archive(db, table, params.tu_ngay):
+            return ["hot"]
+        return ["hot", "archive"]
+
+    def _fetch(self, db: Session, table: str, params: TicketQueryParams, tier: str) -> List[object]:
+        stmt, values = self.build(db, table, params, tier)
+        return db.execute(stmt, values).scalars().all()
+
+    def execute(self, db: Session, table: str, params: TicketQueryParams) -> List[object]:
+        """Thực hiện truy vấn một bảng phiếu, trả về danh sách ORM object"""
+        started = time.perf_counter()
+        tiers = self.tiers(db, table, params)
+        if len(tiers) == 1:
+            results = self._fetch(db, table, params, tiers[0])
+        else:
+            # Lấy offset + limit dòng đầu của mỗi bảng, gộp theo (ngaycan, sophieu) giảm dần rồi cắt trang
+            offset = params.offset if params.offset and params.offset > 0 else 0
+            window = offset + params.limit if params.limit and params.limit > 0 else None
+            merged_params = params.model_copy(update={"offset": 0, "limit": window})
+            results = []
+            seen = set()
+            for tier in tiers:
+                # Phiếu được chuyển sang bảng lưu trữ sau khi đã đọc bảng chính xuất hiện ở cả 2: giữ bản đọc trước
+                for row in self._fetch(db, table, merged_params, tier):
+                    if row.sophieu not in seen:
+                        seen.add(row.sophieu)
+                        results.append(row)
+            results.sort(key=lambda row: (row.ngaycan or date.min, row.sophieu), reverse=True)
+            results = results[offset:window]
+
+        stats = self.table_stats[table]
+        stats["queries"] += 1
+        if "archive" in tiers:
+            stats["archive_queries"] += 1
+        stats["rows"] += len(results)
+        stats["seconds"] += time.perf_counter() - started
+        return results
+
+    def stats(self) -> dict:
+        """Thống kê template và thời gian truy vấn của từng bảng"""
+        return {
+            "templates": len(self._templates),
+            "template_hits": self.template_hits,
+            "template_misses": self.template_misses,
+            "tables": {
+                table: {**stats, "seconds": round(stats["seconds"], 4)}
+                for table, stats in self.table_stats.items()
+            }
+        }
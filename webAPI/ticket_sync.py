@@ -0,0 +1,286 @@
+import os
+import threading
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+from change_token import ChangeTokens, bucket_checksums
+
+# Số phiếu tối đa mỗi câu lệnh IN (SQL Server giới hạn 2100 tham số)
+LOAD_CHUNK = 2000
+
+
+class InvalidSyncToken(ValueError):
+    """Token đồng bộ không đúng định dạng"""
+
+
+class LocalChangeLog:
+    """
+    Nhật ký thay đổi trong tiến trình, thay cho Change Tracking khi database chưa bật.
+
+    Giữ dấu vân tay (fingerprint) mọi cột của các phiếu trong window_days ngày gần đây và phiếu mới;
+    mỗi khi token thay đổi của bảng khác lần quét trước thì quét lại và ghi các phiếu
+    thêm mới/sửa/xóa vào nhật ký với phiên bản tăng dần. Nhật ký chỉ tồn tại trong tiến trình
+    (epoch đổi khi khởi động lại), client có token của tiến trình khác sẽ được yêu cầu tải lại toàn bộ.
+
+    Phiếu cũ hơn khoảng theo dõi được kiểm tra mỗi verify_interval giây bằng checksum theo nhóm số phiếu;
+    phiếu cũ bị sửa/xóa không ghi được vào nhật ký nên mọi token đã cấp phải tải lại toàn bộ.
+    """
+
+    def __init__(
+        self,
+        models: Dict[str, object],
+        change_tokens: ChangeTokens,
+        window_days: int = 7,
+        max_entries: int = 100000,
+        refresh_interval: float = 1.0,
+        verify_interval: float = 60,
+        bucket_size: int = 1000
+    ):
+        self.models = models
+        self.change_tokens = change_tokens
+        self.window_days = window_days
+        self.max_entries = max_entries
+        self.refresh_interval = refresh_interval
+        self.verify_interval = verify_interval
+        self.bucket_size = bucket_size
+        self.epoch = str(int(time.time()))
+        self.version = 0
+        # Phiên bản nhỏ nhất còn đủ nhật ký phía sau (token cũ hơn phải tải lại toàn bộ)
+        self.min_version = 0
+        self._entries: List[Tuple[int, str, int]] = []
+        # Bảng -> {sophieu: (fingerprint, ngaycan)}
+        self._snapshots: Dict[str, Dict[int, tuple]] = {}
+        self._scanned_tokens: Dict[str, str] = {}
+        self._high_water: Dict[str, int] = {}
+        # Bảng -> {nhóm số phiếu: checksum} của các phiếu cũ hơn khoảng theo dõi
+        self._buckets: Dict[str, Dict[int, int]] = {}
+        self._buckets_start: Optional[date] = None
+        self._verified_tokens: Dict[str, str] = {}
+        self._refreshed_at = 0.0
+        self._verified_at = 0.0
+        self._lock = threading.Lock()
+
+    def _scan(self, db: Session, table: str, window_start: date) -> Dict[int, tuple]:
+        model = self.models[table]
+        columns = list(model.__table__.columns)
+        top = self._high_water.get(table, 0)
+        query = select(*columns).where((model.ngaycan >= window_start) | (model.sophieu > top))
+        snapshot = {}
+        for row in db.execute(query):
+            snapshot[row.sophieu] = (hash(tuple(row)), row.ngaycan)
+            top = max(top, row.sophieu or 0)
+        self._high_water[table] = top
+        return snapshot
+
+    def refresh(self, db: Session):
+        """Quét lại các bảng có token thay đổi và ghi các phiếu khác lần quét trước vào nhật ký"""
+        with self._lock:
+            if time.monotonic() - self._refreshed_at < self.refresh_interval:
+                return
+            now = time.monotonic()
+            window_start = date.today() - timedelta(days=self.window_days)
+            verify = now - self._verified_at >= self.verify_interval
+            for table in self.models:
+                token, _ = self.change_tokens.token(db, table)
+                if self._scanned_tokens.get(table) != token:
+                    self._scan_window(db, table, window_start)
+                    self._scanned_tokens[table] = token
+                if verify and (self._verified_tokens.get(table) != token or self._buckets_start != window_start):
+                    self._verify_old(db, table, window_start)
+                    self._verified_tokens[table] = token
+
+            if len(self._entries) > self.max_entries:
+                dropped = self._entries[:len(self._entries) - self.max_entries]
+                self._entries = self._entries[len(dropped):]
+                self.min_version = max(self.min_version, dropped[-1][0])
+            if verify:
+                self._verified_at = now
+                self._buckets_start = window_start
+            self._refreshed_at = time.monotonic()
+
+    def _scan_window(self, db: Session, table: str, window_start: date):
+        """Quét phiếu mới và phiếu trong khoảng theo dõi, ghi các phiếu khác lần quét trước vào nhật ký"""
+        baseline = table not in self._snapshots
+        previous = self._snapshots.get(table, {})
+        current = self._scan(db, table, window_start)
+        if not baseline:
+            changed = [sophieu for sophieu, value in current.items() if previous.get(sophieu, (None,))[0] != value[0]]
+            # Phiếu biến mất trong khi vẫn thuộc khoảng quét: bị xóa hẳn (hoặc sửa ngày cân về trước khoảng quét)
+            changed += [
+                sophieu for sophieu, (_, ngaycan) in previous.items()
+                if sophieu not in current and ngaycan is not None and ngaycan >= window_start
+            ]
+            for sophieu in sorted(changed):
+                self.version += 1
+                self._entries.append((self.version, table, sophieu))
+        self._snapshots[table] = current
+
+    def _verify_old(self, db: Session, table: str, window_start: date):
+        """So checksum theo nhóm của các phiếu cũ hơn khoảng theo dõi; có thay đổi thì token đã cấp phải tải lại toàn bộ"""
+        model = self.models[table]
+        buckets = bucket_checksums(db, model, self.bucket_size, (model.ngaycan < window_start) | model.ngaycan.is_(None))
+        previous = self._buckets.get(table)
+        # Sang ngày mới thì phiếu ra khỏi khoảng theo dõi làm checksum đổi: chỉ lấy mốc mới
+        if previous is not None and self._buckets_start == window_start and buckets != previous:
+            self.version += 1
+            self.min_version = self.version
+        self._buckets[table] = buckets
+
+    def changes_since(self, version: int) -> Optional[List[Tuple[int, str, int]]]:
+        """Các thay đổi có phiên bản lớn hơn version, None nếu nhật ký không còn đủ"""
+        with self._lock:
+            if version < self.min_version or version > self.version:
+                return None
+            return [entry for entry in self._entries if entry[0] > version]
+
+
+class TicketSync:
+    """
+    Đồng bộ tăng dần các phiếu đã thay đổi trên 4 bảng phiếu.
+
+    - Backend "changetracking": SQL Server Change Tracking (token "ct:<phiên bản>")
+    - Backend "local": LocalChangeLog trong tiến trình (token "local:<epoch>:<phiên bản>")
+    Phiếu thêm mới, sửa (lần cân 2, in lại) và xóa mềm (xoaphieu = 1) được trả về cả dòng;
+    phiếu bị xóa hẳn trả về trong deleted. Phiếu được chuyển sang bảng lưu trữ không bị coi là xóa.
+    """
+
+    def __init__(self, models: Dict[str, object], archive_models: Dict[str, object], change_tokens: ChangeTokens, backend: str = "auto", window_days: int = 7, max_rows: int = 5000, verify_interval: float = 60):
+        self.models = models
+        self.archive_models = archive_models
+        self.change_tokens = change_tokens
+        self.backend = backend
+        self.max_rows = max_rows
+        self.local_log = LocalChangeLog(models, change_tokens, window_days, verify_interval=verify_interval)
+
+    def backend_for(self, db: Session) -> str:
+        """Backend sử dụng: changetracking khi cả 4 bảng đã bật Change Tracking (nếu backend = auto)"""
+        if self.backend != "auto":
+            return self.backend
+        if db.bind.dialect.name == "mssql" and all(self.change_tokens.uses_change_tracking(db, table) for table in self.models):
+            return "changetracking"
+        return "local"
+
+    # ==== Backend Change Tracking ====
+
+    def _ct_changes(self, db: Session, since: int) -> Tuple[int, Optional[List[Tuple[int, str, int]]]]:
+        current = db.execute(text("SELECT CHANGE_TRACKING_CURRENT_VERSION()")).scalar() or 0
+        entries = []
+        for table in self.models:
+            min_valid = db.execute(
+                text("SELECT CHANGE_TRACKING_MIN_VALID_VERSION(OBJECT_ID(:table))"), {"table": table}
+            ).scalar()
+            if min_valid is None or since < min_valid:
+                return current, None
+            rows = db.execute(
+                text(f"SELECT c.SYS_CHANGE_VERSION, c.sophieu FROM CHANGETABLE(CHANGES [{table}], :since) AS c"),
+                {"since": since}
+            ).all()
+            entries.extend((version, table, sophieu) for version, sophieu in rows)
+        entries.sort()
+        return current, entries
+
+    # ==== Chung ====
+
+    def _parse(self, since: Optional[str], backend: str) -> Optional[int]:
+        """Phiên bản trong token, None nếu token thuộc backend/tiến trình khác (cần tải lại toàn bộ)"""
+        if not since:
+            return None
+        parts = since.split(":")
+        try:
+            if parts[0] == "ct" and len(parts) == 2:
+                version = int(parts[1])
+                return version if backend == "changetracking" else None
+            if parts[0] == "local" and len(parts) == 3:
+                version = int(parts[2])
+                return version if backend == "local" and parts[1] == self.local_log.epoch else None
+        except ValueError:
+            pass
+        raise InvalidSyncToken(f"Token không hợp lệ: {since}")
+
+    def _token(self, backend: str, version: int) -> str:
+        if backend == "changetracking":
+            return f"ct:{version}"
+        return f"local:{self.local_log.epoch}:{version}"
+
+    def _load(self, db: Session, tables: Dict[str, List[int]]) -> Tuple[Dict[str, list], Dict[str, List[int]]]:
+        """Đọc các phiếu theo số phiếu; phiếu không còn ở bảng chính lẫn bảng lưu trữ là đã bị xóa"""
+        rows: Dict[str, list] = {}
+        deleted: Dict[str, List[int]] = {}
+        for table, ids in tables.items():
+            model = self.models[table]
+            archive = self.archive_models[table]
+            found = []
+            for start in range(0, len(ids), LOAD_CHUNK):
+                chunk = ids[start:start + LOAD_CHUNK]
+                found.extend(db.execute(select(model).where(model.sophieu.in_(chunk))).scalars().all())
+            missing = sorted(set(ids) - {row.sophieu for row in found})
+            archived: Set[int] = set()
+            for start in range(0, len(missing), LOAD_CHUNK):
+                chunk = missing[start:start + LOAD_CHUNK]
+                archived.update(db.execute(select(archive.sophieu).where(archive.sophieu.in_(chunk))).scalars())
+            rows[table] = sorted(found, key=lambda row: row.sophieu)
+            gone = [sophieu for sophieu in missing if sophieu not in archived]
+            if gone:
+                deleted[table] = gone
+        return rows, deleted
+
+    def pull(self, db: Session, since: Optional[str], limit: Optional[int] = None) -> dict:
+        """
+        Các phiếu thay đổi kể từ token since
+        Returns:
+            dict: các trường của SyncTicketsResponse
+        """
+        limit = min(limit or self.max_rows, self.max_rows)
+        backend = self.backend_for(db)
+        version = self._parse(since, backend)
+
+        if backend == "changetracking":
+            current, entries = self._ct_changes(db, version or 0)
+        else:
+            self.local_log.refresh(db)
+            current = self.local_log.version
+            entries = None if version is None else self.local_log.changes_since(version)
+
+        if version is None or entries is None:
+            return {"token": self._token(backend, current), "full_resync": True}
+
+        # Gom theo phiếu, chỉ cắt trang ở ranh giới phiên bản để không bỏ sót thay đổi
+        selected: Dict[str, List[int]] = {}
+        seen = set()
+        next_version = version
+        has_more = False
+        for entry_version, table, sophieu in entries:
+            if (table, sophieu) not in seen and len(seen) >= limit and entry_version != next_version:
+                has_more = True
+                break
+            if (table, sophieu) not in seen:
+                seen.add((table, sophieu))
+                selected.setdefault(table, []).append(sophieu)
+            next_version = entry_version
+        if not has_more:
+            next_version = max(current, next_version)
+
+        rows, deleted = self._load(db, selected)
+        return {
+            "token": self._token(backend, next_version),
+            "has_more": has_more,
+            "deleted": deleted,
+            **rows
+        }
+
+
+def create_ticket_sync(models: Dict[str, object], archive_models: Dict[str, object], change_tokens: ChangeTokens) -> TicketSync:
+    """Tạo TicketSync với cấu hình từ environment"""
+    return TicketSync(
+        models,
+        archive_models,
+        change_tokens,
+        backend=os.getenv("SYNC_BACKEND", "auto"),
+        window_days=int(os.getenv("SYNC_WINDOW_DAYS", "7")),
+        max_rows=int(os.getenv("SYNC_MAX_ROWS", "5000")),
+        verify_interval=float(os.getenv("SYNC_VERIFY_INTERVAL", "60"))
+    )